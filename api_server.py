@@ -0,0 +1,434 @@
+"""
+Asynchronous HTTP API for Query Quest and Sheet Scout, for other services to embed the tools:
+
+    OPENAI_API_KEY=... python api_server.py --sources sources.json --port 8080
+
+The sources file names the data sources clients may use, described as in `batch_runner.py`;
+clients only ever choose one by name, so connection settings, file paths and environment
+references stay on the server. Unless `API_SERVER_TOKEN` is set (clients then send it as a
+bearer token), the server only listens on a loopback address.
+
+Endpoints (JSON bodies):
+- `GET /health`: queue, worker and session counts.
+- `POST /sessions` with `{"source": "<name>"}`: opens a conversation on a configured source.
+  Sessions on the same source share one initialized context, dropped once no session has
+  used it for the session time-to-live.
+- `DELETE /sessions/<id>`: closes a session.
+- `POST /sessions/<id>/query` with `{"question": "..."}`: answers with the `run_query` response.
+- `POST /sessions/<id>/stream` with `{"question": "..."}`: the same as server-sent events:
+  'queued', 'started', 'delta' (summary text as it is generated), 'result', then 'refined'
+  when an estimate was refined, or 'error'.
+
+Questions run on a bounded pool of worker threads fed by a bounded queue; when the queue is
+full new work is refused with 503 and `Retry-After` rather than buffered. A client that
+disconnects cancels its question, including the SQL and LLM calls in flight.
+"""
+import argparse
+import asyncio
+import hmac
+import ipaddress
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+from batch_runner import build_application
+from utils.cancellation import CancellationToken, cancellation_scope
+from utils.llm_dispatcher import stream_scope
+
+
+MAX_BODY_BYTES = 1 << 20
+
+
+class HttpError(Exception):
+    def __init__(self, status, message, headers=()):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers
+
+
+class Session:
+    """
+    A conversation: a fork of a shared application, answering one question at a time.
+    """
+
+    def __init__(self, app, source):
+        self.app = app
+        self.source = source
+        self.lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+
+
+class _Job:
+    def __init__(self, function, token, loop):
+        self.function = function
+        self.token = token
+        self.future = loop.create_future()
+
+
+class ApiServer:
+    """
+    Serves the applications over HTTP from an asyncio loop. Blocking work (context
+    initialization, code generation and execution, pandas) runs on the worker threads.
+    """
+
+    def __init__(self, sources, api_key, workers=8, queue_size=32, session_ttl=3600, auth_token=None):
+        """
+        :param sources: dict - Source configurations by name (see `batch_runner.py`).
+        :param api_key: str - OpenAI API key of all sessions.
+        :param workers: int - Questions and initializations processed at the same time.
+        :param queue_size: int - Work waiting for a worker before new work is refused.
+        :param session_ttl: int - Seconds an idle session is kept.
+        :param auth_token: str - Bearer token required from clients. Without it the server only
+                           listens on a loopback address.
+        """
+        self.sources = sources
+        self.api_key = api_key
+        self.workers = workers
+        self.queue_size = queue_size
+        self.session_ttl = session_ttl
+        self.auth_token = auth_token
+        self.contexts = {}
+        self._context_used = {}
+        self.sessions = {}
+        self.running = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='api-worker')
+        self._queue = None
+
+    async def start(self, host='127.0.0.1', port=8080):
+        """
+        Starts the workers and the listening socket.
+
+        :return: asyncio.Server - The server.
+        """
+        if not self.auth_token and not self._is_loopback(host):
+            raise ValueError(f"Set an auth token to listen on '{host}'; without one only loopback addresses are allowed.")
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        for _ in range(self.workers):
+            asyncio.ensure_future(self._work())
+        asyncio.ensure_future(self._expire_sessions())
+        return await asyncio.start_server(self._handle, host, port)
+
+    @staticmethod
+    def _is_loopback(host):
+        if host == 'localhost':
+            return True
+        try:
+            return ipaddress.ip_address(host).is_loopback
+        except ValueError:
+            return False
+
+    async def _work(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._queue.get()
+            if job.token.cancelled or job.future.done():
+                job.future.cancel()
+                continue
+            self.running += 1
+            try:
+                result = await loop.run_in_executor(self._executor, job.function)
+            except BaseException as e:
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                if not job.future.done():
+                    job.future.set_result(result)
+            finally:
+                self.running -= 1
+
+    def _submit(self, function, token):
+        """
+        Queues blocking work for the workers, or refuses it when the queue is full.
+
+        :return: asyncio.Future - The work's result.
+        """
+        job = _Job(function, token, asyncio.get_running_loop())
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise HttpError(503, 'The server is busy, please retry shortly.', headers=('Retry-After: 5',))
+        return job.future
+
+    async def _expire_sessions(self):
+        while True:
+            await asyncio.sleep(60)
+            now = time.monotonic()
+            for session_id, session in list(self.sessions.items()):
+                if not session.lock.locked() and now - session.last_used > self.session_ttl:
+                    del self.sessions[session_id]
+            # A context no session uses is only kept for sessions opened again soon
+            used = {session.source for session in self.sessions.values()}
+            for name, context in list(self.contexts.items()):
+                if name not in used and context.done() and now - self._context_used[name] > self.session_ttl:
+                    del self.contexts[name]
+
+    async def _context(self, name):
+        """
+        Returns the initialized application of a source, initializing it once for all sessions.
+        """
+        if name not in self.sources:
+            raise HttpError(404, f"Unknown source '{name}'.")
+        self._context_used[name] = time.monotonic()
+        if name not in self.contexts:
+            def initialize():
+                app = build_application(self.sources[name], self.api_key)
+                app.initialize_context()
+                return app
+            self.contexts[name] = self._submit(initialize, CancellationToken())
+        try:
+            # Shielded, as the context outlives the request that started its initialization
+            return await asyncio.shield(self.contexts[name])
+        except HttpError:
+            raise
+        except Exception as e:
+            self.contexts.pop(name, None)
+            raise HttpError(400, f'The source could not be initialized: {e}')
+
+    def _session(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise HttpError(404, 'Unknown session.')
+        session.last_used = time.monotonic()
+        return session
+
+    @staticmethod
+    async def _read_request(reader):
+        request_line = (await reader.readline()).decode('latin-1').strip()
+        if not request_line:
+            raise ConnectionResetError()
+        try:
+            method, target, _ = request_line.split(' ', 2)
+        except ValueError:
+            raise HttpError(400, 'Malformed request line.')
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length') or 0)
+        if length > MAX_BODY_BYTES:
+            raise HttpError(413, 'Request body too large.')
+        body = {}
+        if length:
+            try:
+                body = json.loads(await reader.readexactly(length))
+            except ValueError:
+                body = None
+            if not isinstance(body, dict):
+                raise HttpError(400, 'The body must be a JSON object.')
+        return method.upper(), target.split('?', 1)[0].rstrip('/'), headers, body
+
+    @staticmethod
+    async def _send(writer, status, payload, headers=()):
+        body = json.dumps(payload, default=str).encode('utf-8')
+        head = [
+            f'HTTP/1.1 {status} {HTTPStatus(status).phrase}', 'Content-Type: application/json',
+            f'Content-Length: {len(body)}', 'Connection: close', *headers
+        ]
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+
+    async def _handle(self, reader, writer):
+        try:
+            method, path, headers, body = await self._read_request(reader)
+            if self.auth_token and not hmac.compare_digest(
+                    headers.get('authorization', '').encode('utf-8'), f'Bearer {self.auth_token}'.encode('utf-8')):
+                raise HttpError(401, 'Missing or wrong bearer token.')
+            parts = path.strip('/').split('/')
+            if method == 'GET' and parts == ['health']:
+                await self._send(writer, 200, {
+                    'status': 'ok', 'queued': self._queue.qsize(), 'running': self.running,
+                    'workers': self.workers, 'sessions': len(self.sessions), 'contexts': len(self.contexts),
+                })
+            elif method == 'POST' and parts == ['sessions']:
+                if not isinstance(body.get('source'), str):
+                    raise HttpError(400, "'source' (the name of a configured source) is required.")
+                app = await self._context(body['source'])
+                session_id = uuid.uuid4().hex
+                self.sessions[session_id] = Session(app.fork(), body['source'])
+                await self._send(writer, 201, {'session_id': session_id})
+            elif method == 'DELETE' and len(parts) == 2 and parts[0] == 'sessions':
+                self._session(parts[1])
+                del self.sessions[parts[1]]
+                await self._send(writer, 200, {'closed': parts[1]})
+            elif method == 'POST' and len(parts) == 3 and parts[0] == 'sessions' and parts[2] in ('query', 'stream'):
+                session = self._session(parts[1])
+                if not isinstance(body.get('question'), str) or not body['question'].strip():
+                    raise HttpError(400, "'question' is required.")
+                if parts[2] == 'query':
+                    await self._query(reader, writer, session, body['question'])
+                else:
+                    await self._stream(reader, writer, session, body['question'])
+            else:
+                raise HttpError(404, 'Not found.')
+        except HttpError as e:
+            await self._send_error(writer, e.status, str(e), e.headers)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            await self._send_error(writer, 500, f'Internal error: {e}')
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _send_error(self, writer, status, message, headers=()):
+        try:
+            await self._send(writer, status, {'error': message}, headers)
+        except ConnectionError:
+            pass
+
+    @staticmethod
+    async def _wait(futures, reader, token, timeout=None):
+        """
+        Waits for the first of `futures` to finish. If the client goes away first, the token is
+        cancelled and ConnectionResetError raised.
+
+        :return: set - The futures done (none on timeout).
+        """
+        disconnected = asyncio.ensure_future(reader.read(1))
+        try:
+            done, _ = await asyncio.wait([*futures, disconnected], timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            disconnected.cancel()
+        if disconnected in done and disconnected.result() == b'' and len(done) == 1:
+            token.cancel()
+            raise ConnectionResetError()
+        return done - {disconnected}
+
+    @staticmethod
+    def _answer(app, question, token, on_delta=None):
+        with cancellation_scope(token), stream_scope(on_delta):
+            return app.run_query(question)
+
+    @staticmethod
+    def _public(response):
+        return {key: value for key, value in response.items() if key != 'refinement'}
+
+    async def _query(self, reader, writer, session, question):
+        token = CancellationToken()
+        async with session.lock:
+            future = self._submit(lambda: self._answer(session.app, question, token), token)
+            try:
+                while not future.done():
+                    await self._wait([future], reader, token)
+            except ConnectionError:
+                # The session stays busy until its cancelled question has stopped
+                await asyncio.wait([future])
+                raise
+            response = future.result()
+        await self._send(writer, 200, self._public(response))
+
+    async def _stream(self, reader, writer, session, question):
+        loop = asyncio.get_running_loop()
+        token = CancellationToken()
+        events = []
+        events_lock = threading.Lock()
+        wakeup = asyncio.Event()
+
+        def push(event, data):
+            # Called from the worker thread too; consecutive deltas are merged for slow clients
+            with events_lock:
+                if event == 'delta' and events and events[-1][0] == 'delta':
+                    events[-1] = ('delta', {'text': events[-1][1]['text'] + data['text']})
+                else:
+                    events.append((event, data))
+            loop.call_soon_threadsafe(wakeup.set)
+
+        async def flush():
+            wakeup.clear()
+            with events_lock:
+                pending = events[:]
+                del events[:]
+            for event, data in pending:
+                writer.write(f'event: {event}\ndata: {json.dumps(data, default=str)}\n\n'.encode('utf-8'))
+            await writer.drain()
+
+        async def relay(future):
+            # Forwards events until the future is done, with a keep-alive comment every 15 seconds
+            while not future.done():
+                waiting = asyncio.ensure_future(wakeup.wait())
+                try:
+                    done = await self._wait([future, waiting], reader, token, timeout=15)
+                finally:
+                    waiting.cancel()
+                if not done:
+                    writer.write(b': keep-alive\n\n')
+                await flush()
+
+        def answer():
+            push('started', {})
+            return self._answer(session.app, question, token, on_delta=lambda text: push('delta', {'text': text}))
+
+        async with session.lock:
+            future = self._submit(answer, token)
+            writer.write((
+                'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n'
+                'Connection: close\r\n\r\n'
+            ).encode('latin-1'))
+            push('queued', {'position': self._queue.qsize()})
+            try:
+                await relay(future)
+            except ConnectionError:
+                await asyncio.wait([future])
+                raise
+        if future.cancelled() or future.exception() is not None:
+            push('error', {'error': 'Cancelled.' if future.cancelled() else str(future.exception())})
+            await flush()
+            return
+        response = future.result()
+        push('result', self._public(response))
+        await flush()
+        if response.get('refinement') is not None:
+            # Estimates are refined in the background; the exact answer follows on the same stream
+            refined = asyncio.wrap_future(response['refinement'])
+            await relay(refined)
+            if refined.exception() is None:
+                push('refined', refined.result())
+            else:
+                push('error', {'error': f'The estimate could not be refined: {refined.exception()}'})
+            await flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve Query Quest and Sheet Scout over HTTP.')
+    parser.add_argument('--sources', required=True, help='JSON file naming the data sources clients may use.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=8, help='Questions processed at the same time.')
+    parser.add_argument('--queue-size', type=int, default=32, help='Questions waiting before new ones are refused.')
+    parser.add_argument('--session-ttl', type=int, default=3600, help='Seconds an idle session is kept.')
+    args = parser.parse_args(argv)
+
+    api_key = os.environ.get('OPENAI_API_KEY')
+    if not api_key:
+        parser.error('Set the OPENAI_API_KEY environment variable.')
+    auth_token = os.environ.get('API_SERVER_TOKEN')
+    if not auth_token and not ApiServer._is_loopback(args.host):
+        parser.error(f"Set the API_SERVER_TOKEN environment variable to listen on '{args.host}'.")
+    with open(args.sources, encoding='utf-8') as f:
+        sources = json.load(f)
+
+    async def serve():
+        server = ApiServer(
+            sources, api_key, workers=args.workers, queue_size=args.queue_size, session_ttl=args.session_ttl,
+            auth_token=auth_token
+        )
+        listener = await server.start(args.host, args.port)
+        print(f'Listening on http://{args.host}:{args.port}', flush=True)
+        async with listener:
+            await listener.serve_forever()
+
+    asyncio.run(serve())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,368 @@
+"""
+Headless batch runner for Query Quest and Sheet Scout.
+
+Runs a file of questions against several data sources (databases and spreadsheet
+extracts) without the Streamlit pages, and streams one JSON line per answer:
+
+    python batch_runner.py --sources sources.json --questions questions.txt --output results.jsonl
+
+The sources file maps a name to a source:
+
+    {
+        "sales": {"type": "database", "db_config": {"db_name": "sales", "user": "report", "password": "${SALES_PASSWORD}",
+                                                     "host": "db", "port": "5432", "schema": "public"}},
+        "extract": {"type": "sheets", "files": ["exports/orders.csv", "exports/targets.xlsx"]}
+    }
+
+Database sources accept the `db_config` and `databases` of `DBChatbotApplication`, with
+`${VAR}` references expanded from the environment. The questions file holds one question
+per line, or JSON lines with 'question' and optionally 'id' and 'sources' (names to run it
+against, all sources by default).
+
+Every source is initialized once and its context shared by all questions, each answered on
+a fork of the application with its own conversation and its own directory for generated files. Rerunning with the same output file
+resumes: answered questions are skipped and only the rest run.
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+from projects.query_quest.app import DBChatbotApplication
+from projects.sheet_scout.app import SheetChatbotApplication
+from projects.sheet_scout.workspace import Workspace
+from utils.cancellation import CancellationToken, cancellation_scope
+
+
+class LimitedDatabase:
+    """
+    Database handle letting at most as many queries run at once as the shared semaphore allows.
+    Everything else is delegated to the database manager.
+    """
+
+    def __init__(self, database_manager, semaphore):
+        self.database_manager = database_manager
+        self.semaphore = semaphore
+
+    def __getattr__(self, name):
+        return getattr(self.database_manager, name)
+
+    def execute_query(self, query, read_only=None, timeout_ms=None):
+        with self.semaphore:
+            return self.database_manager.execute_query(query, read_only=read_only, timeout_ms=timeout_ms)
+
+    def profile_query(self, query, token_budget=400, batch_size=10000, timeout_ms=None):
+        with self.semaphore:
+            return self.database_manager.profile_query(
+                query, token_budget=token_budget, batch_size=batch_size, timeout_ms=timeout_ms
+            )
+
+
+def question_id(question):
+    return hashlib.sha1(question.strip().encode('utf-8')).hexdigest()[:12]
+
+
+def load_questions(path):
+    """
+    Reads the questions file.
+
+    :return: list - Dicts with 'id', 'question' and 'sources' (None for all sources).
+    """
+    questions = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            entry = json.loads(line) if line.startswith('{') else {'question': line}
+            questions.append({
+                'id': str(entry.get('id') or question_id(entry['question'])),
+                'question': entry['question'],
+                'sources': entry.get('sources'),
+            })
+    return questions
+
+
+def _expand(value):
+    if isinstance(value, str):
+        return os.path.expandvars(value)
+    if isinstance(value, dict):
+        return {key: _expand(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_expand(item) for item in value]
+    return value
+
+
+def build_application(config, api_key):
+    """
+    Creates the application of a source, without initializing its context.
+
+    :param config: dict - The source (see the module docstring).
+    :return: DBChatbotApplication or SheetChatbotApplication - The application.
+    """
+    config = _expand(config)
+    if config['type'] == 'database':
+        return DBChatbotApplication(config['db_config'], api_key, databases=config.get('databases'))
+    if config['type'] == 'sheets':
+        workspace = Workspace()
+        for path in config['files']:
+            with open(path, 'rb') as f:
+                workspace.load_file(os.path.basename(path), f.read())
+        return SheetChatbotApplication(df=None, api_key=api_key, workspace=workspace)
+    raise ValueError(f"Unknown source type '{config['type']}'.")
+
+
+class ResultLog:
+    """
+    Append-only JSON lines file of answers. Every line is flushed to disk once written, so a
+    crash loses at most the answers still in progress.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # A line cut short by a crash is completed so the next record starts on its own line
+        if os.path.exists(path) and os.path.getsize(path):
+            with open(path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                truncated = f.read(1) != b'\n'
+            if truncated:
+                with open(path, 'a', encoding='utf-8') as f:
+                    f.write('\n')
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def finished(self, retry_failed=False):
+        """
+        :param retry_failed: bool - Leave out failed and timed out answers, so they run again.
+        :return: set - Ids of the answers already recorded.
+        """
+        finished = set()
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get('status') == 'ok' or not retry_failed:
+                    finished.add(record['id'])
+        return finished
+
+    def write(self, record):
+        line = json.dumps(record, default=str, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+class BatchRunner:
+    """
+    Answers many questions against several sources concurrently, under a limit on the
+    questions in progress and, per database source, on the queries running at once. The
+    number of concurrent OpenAI calls is bounded process-wide by the LLM dispatcher
+    (`LLM_MAX_CONCURRENCY`).
+    """
+
+    def __init__(self, sources, api_key, output_path, artifacts_dir=None, workers=8, db_concurrency=4,
+                 timeout=300, retry_failed=False, follow_ups=False):
+        """
+        :param sources: dict - Source configurations by name (see the module docstring).
+        :param api_key: str - OpenAI API key.
+        :param output_path: str - The JSON lines file answers are appended to.
+        :param artifacts_dir: str - Where generated files are copied (next to the output by default).
+        :param workers: int - Questions answered at the same time.
+        :param db_concurrency: int - Queries running at the same time on each database source.
+        :param timeout: float - Seconds after which a question is cancelled.
+        :param retry_failed: bool - Run failed and timed out questions of a previous run again.
+        :param follow_ups: bool - Also suggest follow-up questions (one more completion per answer).
+        """
+        self.sources = sources
+        self.api_key = api_key
+        self.output_path = output_path
+        self.artifacts_dir = artifacts_dir or os.path.splitext(output_path)[0] + '_artifacts'
+        self.workers = workers
+        self.db_concurrency = db_concurrency
+        self.timeout = timeout
+        self.retry_failed = retry_failed
+        self.follow_ups = follow_ups
+        self.apps = {}
+        self._semaphores = {}
+
+    def _build_app(self, name):
+        app = build_application(self.sources[name], self.api_key)
+        if isinstance(app, DBChatbotApplication):
+            self._semaphores[name] = threading.BoundedSemaphore(self.db_concurrency)
+        else:
+            # Reports need exact figures rather than estimates refined later
+            app.approximate = False
+        app.suggest_followups = self.follow_ups
+        app.initialize_context()
+        return app
+
+    def _fork(self, name):
+        app = self.apps[name].fork()
+        if name in self._semaphores:
+            app.databases = {
+                database: LimitedDatabase(manager, self._semaphores[name]) for database, manager in app.databases.items()
+            }
+            app.database_manager = app.databases[app.database_manager_name]
+        return app
+
+    def _keep_artifact(self, task, path):
+        if not path or not os.path.isfile(path):
+            return None
+        directory = os.path.join(self.artifacts_dir, task['source'])
+        os.makedirs(directory, exist_ok=True)
+        destination = os.path.join(directory, f"{task['question_id']}-{os.path.basename(path)}")
+        shutil.copyfile(path, destination)
+        return destination
+
+    def _answer(self, task):
+        app = self._fork(task['source'])
+        # Questions run side by side, so each one saves its files apart from the others'
+        scratch_dir = tempfile.mkdtemp(prefix=f"batch-{task['question_id']}-")
+        app.llm_interface.output_dir = scratch_dir
+        token = CancellationToken()
+        timer = threading.Timer(self.timeout, token.cancel)
+        timer.start()
+        started = time.perf_counter()
+        try:
+            with cancellation_scope(token):
+                response = app.run_query(task['question'])
+            artifact = self._keep_artifact(task, response.get('file'))
+        finally:
+            timer.cancel()
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+        if response.get('cancelled'):
+            status = 'timeout'
+        elif response.get('error'):
+            status = 'error'
+        else:
+            status = 'ok'
+        return {
+            **task,
+            'status': status,
+            'result': response['result'],
+            'artifact': artifact,
+            'error': response.get('error'),
+            'follow_up_questions': response.get('follow_up_questions') if self.follow_ups else None,
+            'tokens': app.get_openai_usage_tokens(),
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 3),
+            'finished_at': datetime.now(timezone.utc).isoformat(),
+        }
+
+    def run(self, questions, progress=None):
+        """
+        Answers every question not answered yet in the output file.
+
+        :param questions: list - Questions as returned by `load_questions`.
+        :param progress: callable - Called with each record and the counts done and total.
+        :return: dict - Counts by status, 'skipped' and 'elapsed_s'.
+        """
+        started = time.perf_counter()
+        log = ResultLog(self.output_path)
+        finished = log.finished(retry_failed=self.retry_failed)
+        tasks, skipped = [], 0
+        for question in questions:
+            for source in question['sources'] or list(self.sources):
+                if source not in self.sources:
+                    raise ValueError(f"Question '{question['id']}' refers to unknown source '{source}'.")
+                task = {
+                    'id': f"{source}/{question['id']}", 'source': source,
+                    'question_id': question['id'], 'question': question['question'],
+                }
+                if task['id'] in finished:
+                    skipped += 1
+                else:
+                    tasks.append(task)
+        summary = {'ok': 0, 'error': 0, 'timeout': 0, 'skipped': skipped}
+
+        # Sources are initialized once, concurrently; a source that fails fails its questions
+        pending_sources = sorted({task['source'] for task in tasks} - set(self.apps))
+        failures = {}
+        with ThreadPoolExecutor(max_workers=max(len(pending_sources), 1)) as executor:
+            futures = {executor.submit(self._build_app, name): name for name in pending_sources}
+            for future in as_completed(futures):
+                try:
+                    self.apps[futures[future]] = future.result()
+                except Exception as e:
+                    failures[futures[future]] = f'Source initialization failed: {e}'
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='batch') as executor:
+                futures = {}
+                for task in tasks:
+                    if task['source'] in failures:
+                        futures[executor.submit(lambda task=task: {
+                            **task, 'status': 'error', 'result': None, 'error': failures[task['source']],
+                            'finished_at': datetime.now(timezone.utc).isoformat(),
+                        })] = task
+                    else:
+                        futures[executor.submit(self._answer, task)] = task
+                for done, future in enumerate(as_completed(futures), 1):
+                    try:
+                        record = future.result()
+                    except Exception as e:
+                        record = {**futures[future], 'status': 'error', 'result': None, 'error': str(e)}
+                    log.write(record)
+                    summary[record['status']] += 1
+                    if progress is not None:
+                        progress(record, done, len(tasks))
+        finally:
+            log.close()
+        summary['elapsed_s'] = round(time.perf_counter() - started, 3)
+        return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Answer a file of questions against databases and spreadsheets.')
+    parser.add_argument('--sources', required=True, help='JSON file describing the data sources.')
+    parser.add_argument('--questions', required=True, help='Questions, one per line or as JSON lines.')
+    parser.add_argument('--output', required=True, help='JSON lines file the answers are appended to.')
+    parser.add_argument('--artifacts-dir', help='Where generated files are kept.')
+    parser.add_argument('--workers', type=int, default=8, help='Questions answered at the same time.')
+    parser.add_argument('--llm-concurrency', type=int, help='OpenAI calls running at the same time.')
+    parser.add_argument('--db-concurrency', type=int, default=4, help='Queries running at the same time per database.')
+    parser.add_argument('--timeout', type=float, default=300, help='Seconds allowed per question.')
+    parser.add_argument('--retry-failed', action='store_true', help='Run failed questions of a previous run again.')
+    parser.add_argument('--follow-ups', action='store_true', help='Also suggest follow-up questions.')
+    args = parser.parse_args(argv)
+
+    api_key = os.environ.get('OPENAI_API_KEY')
+    if not api_key:
+        parser.error('Set the OPENAI_API_KEY environment variable.')
+    if args.llm_concurrency:
+        # Read when the process-wide dispatcher is created by the first completion
+        os.environ['LLM_MAX_CONCURRENCY'] = str(args.llm_concurrency)
+    with open(args.sources, encoding='utf-8') as f:
+        sources = json.load(f)
+
+    runner = BatchRunner(
+        sources, api_key, args.output, artifacts_dir=args.artifacts_dir, workers=args.workers,
+        db_concurrency=args.db_concurrency, timeout=args.timeout, retry_failed=args.retry_failed,
+        follow_ups=args.follow_ups
+    )
+    summary = runner.run(
+        load_questions(args.questions),
+        progress=lambda record, done, total: print(
+            f"[{done}/{total}] {record['id']}: {record['status']}", file=sys.stderr, flush=True
+        )
+    )
+    print(json.dumps(summary), file=sys.stderr)
+    return 0 if not summary['error'] and not summary['timeout'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,10 +1,14 @@
+import hmac
 import uuid
 from pathlib import Path
 
 import streamlit as st
-import pandas as pd
 from projects.sheet_scout.app import SheetChatbotApplication
 from projects.sheet_scout.llm_interface import LLMInterface
+from projects.sheet_scout.workspace import Workspace
+from utils.cancellation import run_interruptible
+from utils.session_store import get_session_store, secret_digest
+from utils.tracing import format_waterfall
 
 # Set page config
 st.set_page_config(page_title='Sheet Scout', page_icon='📈')
@@ -15,6 +19,62 @@ if Path(style_file):
     with open(style_file) as f:
         st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
 
+
+def _save_session():
+    """
+    Saves the chat so it survives a restart; only what changed since the last save is written,
+    and a dataset is written to the columnar cache once per version.
+    """
+    store = get_session_store()
+    try:
+        store.save(
+            st.session_state['ss_session_id'],
+            {**st.session_state.ss_app.session_state(store.cache), 'key_digest': st.session_state['ss_key_digest']},
+            # Refinements still running are not resumed, their estimates are kept
+            [
+                {'question': question, 'response': {key: value for key, value in response.items() if key != 'refinement'}}
+                for question, response in st.session_state.ss_history
+            ]
+        )
+    except OSError:
+        pass
+
+
+# Resume a saved session (its id is kept in the page URL) once its API key is entered again
+if 'ss_app' not in st.session_state and st.query_params.get('ss_session'):
+    _session_id = st.query_params['ss_session']
+    _saved = get_session_store().load(_session_id)
+    if _saved and 'key_digest' not in _saved['state']:
+        # Saved with its credentials by an earlier version
+        get_session_store().delete(_session_id)
+        _saved = None
+    if _saved:
+        st.title("Sheet Scout 📈")
+        with st.expander("**Resume Conversation**", expanded=True):
+            _resume_key = st.text_input('OpenAI API Key of this conversation', type='password')
+            if st.button('Start a new conversation'):
+                del st.query_params['ss_session']
+                st.rerun()
+        if not _resume_key:
+            st.stop()
+        _key_digest = secret_digest(_resume_key, _session_id)
+        if not hmac.compare_digest(_key_digest, _saved['state']['key_digest']):
+            st.error("This is not the key the conversation was started with.")
+            st.stop()
+        try:
+            _app = SheetChatbotApplication.from_session_state(_saved['state'], get_session_store().cache, _resume_key)
+        except Exception:
+            st.error("The conversation could not be resumed.")
+            st.stop()
+        st.session_state['ss_app'] = _app
+        st.session_state['ss_history'] = [(turn['question'], turn['response']) for turn in _saved['history']]
+        st.session_state['ss_session_id'] = _session_id
+        st.session_state['ss_key_digest'] = _key_digest
+        st.session_state['openai_api_key'] = _resume_key
+        for flag in ('ss_agreed_to_disclaimer', 'ss_api_key_verified', 'ss_app_initialized'):
+            st.session_state[flag] = True
+        st.rerun()
+
 # Page
 if not (st.session_state.get('ss_agreed_to_disclaimer') and st.session_state.get('ss_api_key_verified') and st.session_state.get('ss_app_initialized')):
     st.title("Sheet Scout 📈")
@@ -107,16 +167,20 @@ if st.session_state['ss_agreed_to_disclaimer'] and st.session_state['ss_api_key_
     if 'ss_app' not in st.session_state:
 
         # Upload file and Init
-        uploaded_file = st.file_uploader("Upload CSV document", type="csv")
-        if uploaded_file is not None:
-            data = pd.read_csv(uploaded_file)
-            st.write('Data Snapshot:')
-            st.write(data.head(3))
+        uploaded_files = st.file_uploader("Upload CSV or Excel documents", type=["csv", "xlsx"], accept_multiple_files=True)
+        if uploaded_files:
+            workspace = Workspace()
+            for uploaded_file in uploaded_files:
+                workspace.load_file(uploaded_file.name, uploaded_file.getvalue())
+            for dataset_name, dataset in workspace.datasets.items():
+                st.write(f'Data Snapshot ({dataset_name}):')
+                st.write(dataset.df.head(3))
 
             if st.button("Initialize Chat"):
                 app = SheetChatbotApplication(
-                    df=data,
-                    api_key=st.session_state['openai_api_key']
+                    df=None,
+                    api_key=st.session_state['openai_api_key'],
+                    workspace=workspace
                 )
                 loading_placeholder = st.empty()
                 loading_placeholder.text("Initializing...")
@@ -124,6 +188,10 @@ if st.session_state['ss_agreed_to_disclaimer'] and st.session_state['ss_api_key_
                 app.initialize_context()
                 st.session_state['ss_app'] = app
                 st.session_state['ss_history'] = []
+                st.session_state['ss_session_id'] = uuid.uuid4().hex
+                st.session_state['ss_key_digest'] = secret_digest(st.session_state['openai_api_key'], st.session_state['ss_session_id'])
+                st.query_params['ss_session'] = st.session_state['ss_session_id']
+                _save_session()
 
                 st.session_state['ss_app_initialized'] = True
 
@@ -153,6 +221,21 @@ if st.session_state['ss_app_initialized']:
             Total Tokens: {_token_usage['total_tokens']}
             ''')
 
+        # - Refresh data (appended rows are parsed incrementally, chat history is kept)
+        with st.expander('Refresh data'):
+            dataset_names = list(st.session_state.ss_app.workspace.datasets)
+            refreshed_name = st.selectbox('Dataset', dataset_names, key='ss_refresh_name') if len(dataset_names) > 1 else None
+            refreshed_file = st.file_uploader("Upload updated CSV", type="csv", key='ss_refresh_file')
+            if refreshed_file is not None and st.button('Refresh'):
+                outcome = st.session_state.ss_app.refresh_data(refreshed_file.getvalue(), name=refreshed_name)
+                if outcome['mode'] == 'append':
+                    st.success(f"Added {outcome['new_rows']} new rows.", icon='✅')
+                elif outcome['mode'] == 'reload':
+                    st.info(f"File changed, reloaded {outcome['new_rows']} rows.")
+                else:
+                    st.info('No new rows found.')
+                _save_session()
+
     # Main Chat Panel
     st.markdown('### Talk to your document! 💬')
 
@@ -160,9 +243,18 @@ if st.session_state['ss_app_initialized']:
     user_query = st.chat_input(placeholder="What is your query?", key="chat_input")
 
     # - Process Query
+    # The query runs on a worker thread; stopping or rerunning the script (Stop button, a new
+    # question, a closed tab) interrupts the wait below and cancels the query's SQL and LLM work
     def _process_query(query):
-        _response = st.session_state.ss_app.run_query(query)
+        status = st.empty()
+        st.button('Stop', key='ss_stop')
+        _response = run_interruptible(
+            st.session_state.ss_app.run_query, query,
+            heartbeat=lambda elapsed: status.caption(f'Working on it... {elapsed:.0f}s')
+        )
+        status.empty()
         st.session_state.ss_history.append((query, _response))
+        _save_session()
         return _response
 
 
@@ -174,14 +266,32 @@ if st.session_state['ss_app_initialized']:
     else:
         response = {}
 
+    # - Estimates are replaced by the exact answer once it has been computed in the background
+    def _apply_refinement(response):
+        refinement = response.get('refinement')
+        if refinement is None or not refinement.done():
+            return False
+        del response['refinement']
+        if refinement.cancelled() or refinement.exception() is not None:
+            response['refinement_failed'] = True
+        else:
+            response.update(refinement.result(), approximate=False)
+        return True
+
     # Chat History
     if 'ss_history' in st.session_state:
+        if any([_apply_refinement(response) for _, response in st.session_state['ss_history']]):
+            _save_session()
         for question, response in st.session_state['ss_history']:
             # with st.container():
             with st.chat_message("user"):
                 st.markdown(question)
             with st.chat_message("assistant"):
                 st.markdown(response['result'])
+                if response.get('refinement') is not None:
+                    st.caption('Estimate from a sample, refining over the full data...')
+                elif response.get('refinement_failed'):
+                    st.caption('Estimate from a sample, the exact answer could not be computed.')
                 if response['file']:
                     try:
                         with open(response['file'], 'rb') as f:
@@ -198,3 +308,24 @@ if st.session_state['ss_app_initialized']:
                 if st.button(question):
                     st.session_state['ss_preloaded_question'] = question
                     st.rerun()
+
+    # Rerun when a pending refinement completes
+    if any(response.get('refinement') is not None for _, response in st.session_state.get('ss_history', [])):
+        @st.fragment(run_every=2)
+        def _watch_refinements():
+            if any(
+                response.get('refinement') is not None and response['refinement'].done()
+                for _, response in st.session_state['ss_history']
+            ):
+                st.rerun()
+
+        _watch_refinements()
+
+    # Request timings of the latest query (rendered last so the current request is included)
+    with st.sidebar:
+        st.session_state.ss_app.approximate = st.toggle(
+            'Quick estimates for large datasets', value=True, key='ss_approximate',
+            help='Aggregates over datasets of 2M+ rows are first answered from a sample, then refined.'
+        )
+        if st.toggle('Show request timings', key='ss_show_waterfall'):
+            st.code(format_waterfall(st.session_state.ss_app.get_last_trace()))
@@ -1,3 +1,4 @@
+import hmac
 import uuid
 from pathlib import Path
 
@@ -5,6 +6,9 @@ import streamlit as st
 from projects.query_quest.database_manager import DatabaseManager
 from projects.query_quest.llm_interface import LLMInterface
 from projects.query_quest.app import DBChatbotApplication
+from utils.cancellation import run_interruptible
+from utils.session_store import get_session_store, secret_digest
+from utils.tracing import format_waterfall
 
 # Set page config
 st.set_page_config(page_title='Query Quest', page_icon='💰')
@@ -16,6 +20,63 @@ if Path(style_file):
         st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
 
 
+
+def _save_session():
+    """
+    Saves the chat so it survives a restart; only what changed since the last save is written.
+    """
+    try:
+        get_session_store().save(
+            st.session_state['qq_session_id'],
+            {**st.session_state.qq_app.session_state(), 'key_digest': st.session_state['qq_key_digest']},
+            [{'question': question, 'response': response} for question, response in st.session_state.qq_history]
+        )
+    except OSError:
+        pass
+
+
+# Resume a saved session (its id is kept in the page URL) once its API key and database password are entered again
+if 'qq_app' not in st.session_state and st.query_params.get('qq_session'):
+    _session_id = st.query_params['qq_session']
+    _saved = get_session_store().load(_session_id)
+    if _saved and 'key_digest' not in _saved['state']:
+        # Saved with its credentials by an earlier version
+        get_session_store().delete(_session_id)
+        _saved = None
+    if _saved:
+        st.title("Query Quest 💰")
+        with st.expander("**Resume Conversation**", expanded=True):
+            _resume_key = st.text_input('OpenAI API Key of this conversation', type='password')
+            _resume_password = st.text_input('Database Password', type='password')
+            if st.button('Start a new conversation'):
+                del st.query_params['qq_session']
+                st.rerun()
+        if not (_resume_key and _resume_password):
+            st.stop()
+        _key_digest = secret_digest(_resume_key, _session_id)
+        if not hmac.compare_digest(_key_digest, _saved['state']['key_digest']):
+            st.error("This is not the key the conversation was started with.")
+            st.stop()
+        try:
+            _app = DBChatbotApplication.from_session_state(_saved['state'], _resume_key, _resume_password)
+        except Exception:
+            st.error("The conversation could not be resumed.")
+            st.stop()
+        if not all(database.verify_connection() for database in _app.databases.values()):
+            st.error("Failed to verify connection. Please check the password.")
+            st.stop()
+        st.session_state['qq_app'] = _app
+        st.session_state['qq_history'] = [(turn['question'], turn['response']) for turn in _saved['history']]
+        st.session_state['qq_session_id'] = _session_id
+        st.session_state['qq_key_digest'] = _key_digest
+        st.session_state['db_config'] = _app.db_config
+        st.session_state['qq_databases'] = _app.databases_config
+        st.session_state['openai_api_key'] = _resume_key
+        for flag in ('qq_agreed_to_disclaimer', 'qq_connection_verified', 'qq_api_key_verified', 'qq_app_initialized'):
+            st.session_state[flag] = True
+        st.rerun()
+
+
 # Page
 if not (st.session_state.get('qq_agreed_to_disclaimer') and st.session_state.get('qq_connection_verified') and st.session_state.get('qq_api_key_verified') and st.session_state.get('qq_app_initialized')):
     st.title("Query Quest 💰")
@@ -84,22 +145,44 @@ if not st.session_state['qq_connection_verified']:
         host = st.text_input('Host')
         port = st.text_input('Port', '5432')
         schema = st.text_input('Schema', 'public')
+        replicas_input = st.text_input('Read Replicas (optional)', placeholder='host:port, host:port')
+        routing = st.selectbox('Replica Routing', ['round_robin', 'least_latency'])
+        databases_input = st.text_area(
+            'Additional Databases (optional)',
+            placeholder='One per line as name = database/schema, on the same server with the same credentials'
+        )
 
     if host and user and password and db_name and port and schema:
         if st.button("Verify Connection"):
-            verified = DatabaseManager(
-                db_name=db_name, user=user, password=password, host=host, port=port, schema=schema
-            ).verify_connection()
+            db_config = {
+                'db_name': db_name,
+                'user': user,
+                'password': password,
+                'host': host,
+                'port': port,
+                'schema': schema,
+                'replicas': [
+                    {'host': replica.split(':')[0].strip(), 'port': replica.split(':')[1].strip() if ':' in replica else port}
+                    for replica in replicas_input.split(',') if replica.strip()
+                ],
+                'routing': routing
+            }
+            databases = {}
+            for line in databases_input.splitlines():
+                if '=' in line:
+                    name, target = (part.strip() for part in line.split('=', 1))
+                    database, _, database_schema = target.partition('/')
+                    databases[name] = {**db_config, 'db_name': database or db_name, 'schema': database_schema or schema}
+            if db_name in databases:
+                st.error(f"'{db_name}' is the name of the primary database, please name the additional database differently.")
+                st.stop()
+            verified = all(
+                DatabaseManager(**config).verify_connection() for config in [db_config] + list(databases.values())
+            )
             if verified:
                 st.success("Connection verified successfully!")
-                st.session_state['db_config'] = {
-                    'db_name': db_name,
-                    'user': user,
-                    'password': password,
-                    'host': host,
-                    'port': port,
-                    'schema': schema
-                }
+                st.session_state['db_config'] = db_config
+                st.session_state['qq_databases'] = databases
                 st.session_state['qq_connection_verified'] = True
                 st.rerun()
             else:
@@ -152,7 +235,8 @@ if st.session_state['qq_agreed_to_disclaimer'] and st.session_state['qq_connecti
         if st.button("Initialize Chat"):
             app = DBChatbotApplication(
                 db_config=st.session_state['db_config'],
-                api_key=st.session_state['openai_api_key']
+                api_key=st.session_state['openai_api_key'],
+                databases=st.session_state.get('qq_databases')
             )
             loading_placeholder = st.empty()
             loading_placeholder.text("Initializing...")
@@ -160,6 +244,10 @@ if st.session_state['qq_agreed_to_disclaimer'] and st.session_state['qq_connecti
             app.initialize_context()
             st.session_state['qq_app'] = app
             st.session_state['qq_history'] = []
+            st.session_state['qq_session_id'] = uuid.uuid4().hex
+            st.session_state['qq_key_digest'] = secret_digest(st.session_state['openai_api_key'], st.session_state['qq_session_id'])
+            st.query_params['qq_session'] = st.session_state['qq_session_id']
+            _save_session()
 
             st.session_state['qq_app_initialized'] = True
 
@@ -189,6 +277,69 @@ if st.session_state['qq_app_initialized']:
             Total Tokens: {_token_usage['total_tokens']}
             ''')
 
+        # - Connection health of the primary and read replicas
+        if st.session_state.qq_app.database_manager.replicas:
+            with st.expander('Database health'):
+                if st.button('Check'):
+                    st.dataframe(st.session_state.qq_app.database_manager.check_health(), hide_index=True)
+
+        # - Speculative preparation of the suggested follow-up questions (opt-in, spends tokens)
+        _prefetch = st.toggle('Prefetch suggested follow-ups', key='qq_prefetch')
+        _prefetch_queries = _prefetch and st.checkbox('Also run read-only queries', key='qq_prefetch_queries')
+        _prefetch_config = (_prefetch, _prefetch_queries)
+        if st.session_state.get('qq_prefetch_config', (False, False)) != _prefetch_config:
+            if _prefetch:
+                st.session_state.qq_app.enable_prefetch(execute_queries=_prefetch_queries)
+            else:
+                st.session_state.qq_app.disable_prefetch()
+            st.session_state['qq_prefetch_config'] = _prefetch_config
+
+        # - Several code candidates raced against each other (opt-in, spends tokens)
+        _candidates = st.toggle('Race several code candidates', key='qq_candidates')
+        _candidate_count = st.slider('Candidates', 2, 5, 3, key='qq_candidate_count') if _candidates else 0
+        if st.session_state.get('qq_candidate_config', 0) != _candidate_count:
+            if _candidate_count:
+                st.session_state.qq_app.enable_candidates(count=_candidate_count)
+            else:
+                st.session_state.qq_app.disable_candidates()
+            st.session_state['qq_candidate_config'] = _candidate_count
+        if _candidates and st.session_state.qq_app.candidate_stats['races']:
+            st.caption(f"Winning candidates: {st.session_state.qq_app.candidate_stats['wins']}")
+
+        # - Local columnar snapshot of selected tables (opt-in, needs the duckdb package)
+        with st.expander('Local snapshot'):
+            _app = st.session_state.qq_app
+            if 'qq_table_names' not in st.session_state:
+                st.session_state['qq_table_names'] = [table.split('.', 1)[1] for table in _app.database_manager.list_tables()]
+            _tables = st.multiselect('Tables', st.session_state['qq_table_names'], key='qq_snapshot_tables')
+            _filter = st.text_input('Filter (optional)', placeholder="created_at >= now() - interval '90 days'", key='qq_snapshot_filter')
+            st.caption(
+                'Snapshot queries run on DuckDB, set up to behave like PostgreSQL for integer division and NULL '
+                'ordering. Differences remain: timestamptz values are kept in UTC and division by zero gives '
+                'NULL instead of an error.'
+            )
+            _snapshot_on, _snapshot_off = st.columns(2)
+            if _snapshot_on.button('Snapshot', disabled=not _tables):
+                try:
+                    with st.spinner('Copying tables...'):
+                        _app.enable_snapshot(_tables, filters={table: _filter for table in _tables} if _filter else None)
+                except Exception as e:
+                    st.error(f'Snapshot failed: {e}')
+            if _snapshot_off.button('Turn off', disabled=_app.snapshot is None):
+                _app.disable_snapshot()
+            if _app.snapshot is not None:
+                _status = _app.snapshot_status(check_source=st.checkbox('Check for changes', key='qq_snapshot_check'))
+                st.dataframe(
+                    [{key: entry.get(key) for key in ('table_name', 'row_count', 'filter', 'age_seconds', 'source_changed')} for entry in _status],
+                    hide_index=True
+                )
+                _refresh = st.selectbox('Refresh', ['All tables'] + [entry['table_name'] for entry in _status], key='qq_snapshot_refresh')
+                if st.button('Refresh snapshot'):
+                    with st.spinner('Copying tables...'):
+                        _app.refresh_snapshot(None if _refresh == 'All tables' else _refresh)
+                    st.rerun()
+                st.caption(f"Queries served locally: {_app.snapshot.stats['local']}, from the database: {_app.snapshot.stats['remote']}")
+
     # Main Chat Panel
     st.markdown('### Talk to your database! 💬')
 
@@ -196,9 +347,18 @@ if st.session_state['qq_app_initialized']:
     user_query = st.chat_input(placeholder="What is your query?", key="chat_input")
 
     # - Process Query
+    # The query runs on a worker thread; stopping or rerunning the script (Stop button, a new
+    # question, a closed tab) interrupts the wait below and cancels the query's SQL and LLM work
     def _process_query(query):
-        _response = st.session_state.qq_app.run_query(query)
+        status = st.empty()
+        st.button('Stop', key='qq_stop')
+        _response = run_interruptible(
+            st.session_state.qq_app.run_query, query,
+            heartbeat=lambda elapsed: status.caption(f'Working on it... {elapsed:.0f}s')
+        )
+        status.empty()
         st.session_state.qq_history.append((query, _response))
+        _save_session()
         return _response
 
 
@@ -244,3 +404,8 @@ if st.session_state['qq_app_initialized']:
                 if st.button(question):
                     st.session_state['qq_preloaded_question'] = question
                     st.rerun()
+
+    # Request timings of the latest query (rendered last so the current request is included)
+    with st.sidebar:
+        if st.toggle('Show request timings', key='qq_show_waterfall'):
+            st.code(format_waterfall(st.session_state.qq_app.get_last_trace()))
@@ -1,6 +1,13 @@
+import io
 from pathlib import Path
 
+import pandas as pd
 import streamlit as st
+from projects.lingo_leap.app import STAT_KEYS, TranslationApplication, merge_stats
+from projects.lingo_leap.llm_interface import LLMInterface
+
+LANGUAGES = ['English', 'Spanish', 'French', 'German', 'Italian', 'Portuguese', 'Dutch', 'Polish', 'Russian',
+             'Turkish', 'Arabic', 'Hindi', 'Chinese', 'Japanese', 'Korean']
 
 # Set page config
 st.set_page_config(page_title='Lingo Leap', layout='wide', page_icon='🗣️')
@@ -18,9 +25,96 @@ st.markdown(
     """
 )
 
+# OpenAI API section
+if 'll_api_key_verified' not in st.session_state:
+    st.session_state['ll_api_key_verified'] = False
+
+if not st.session_state['ll_api_key_verified']:
+    with st.expander("**OpenAI API Key**", expanded=True):
+        st.write("Usage of the OpenAI API may incur charges, and users are responsible for managing these costs.")
+        openai_api_key = st.text_input('Key', type='password')
+
+    if openai_api_key:
+        if st.button("Verify Key"):
+            verified = LLMInterface(
+                api_key=openai_api_key
+            ).verify_api_key()
+            if verified:
+                st.success("OpenAI API Key verified successfully!")
+                st.session_state['openai_api_key'] = openai_api_key
+                st.session_state['ll_api_key_verified'] = True
+                st.rerun()
+            else:
+                st.error("Failed to verify API key. Please check your key.")
+                st.stop()
+    st.stop()
+
+if 'll_app' not in st.session_state:
+    st.session_state['ll_app'] = TranslationApplication(api_key=st.session_state['openai_api_key'])
+app = st.session_state['ll_app']
+
+
+def _show_stats(stats):
+    served = stats['memory_exact'] + stats['memory_fuzzy'] + stats['repeated']
+    cols = st.columns(5)
+    cols[0].metric('Segments', stats['segments'])
+    cols[1].metric('Already in target language', stats['already_target'])
+    cols[2].metric('Served from memory', served)
+    cols[3].metric('Model calls', stats['llm_calls'])
+    cols[4].metric('Tokens saved (est.)', stats['tokens_saved'])
+
+
+# Side Panel
 with st.sidebar:
-    st.markdown(
-        """
-        ### Coming Soon ...
-        """
-    )
+    st.success("OpenAI API Key Verified.", icon='✅')
+    target_language = st.selectbox('Target language', LANGUAGES, key='ll_target_language')
+    source_language = st.selectbox('Source language', ['Auto-detect'] + LANGUAGES, key='ll_source_language')
+    source_language = None if source_language == 'Auto-detect' else source_language
+    app.concurrency = st.slider('Parallel requests', 1, 8, app.concurrency, key='ll_concurrency')
+    _token_usage = app.get_token_usage()
+    st.code(f'''
+    Prompt Tokens: {_token_usage['prompt_tokens']}
+    Completion Tokens: {_token_usage['completion_tokens']}
+    Total Tokens: {_token_usage['total_tokens']}
+    ''')
+
+text_tab, table_tab = st.tabs(['Text', 'CSV columns'])
+
+# - Documents are translated in chunks, shown in order as they complete
+with text_tab:
+    uploaded_text = st.file_uploader("Upload a text document", type=["txt", "md"], key='ll_text_file')
+    text = uploaded_text.getvalue().decode('utf-8', errors='replace') if uploaded_text else st.text_area('Text to translate', height=200)
+    if text and st.button('Translate', key='ll_translate_text'):
+        progress = st.progress(0.0)
+        output = st.empty()
+        translated = []
+        total = {key: 0 for key in STAT_KEYS}
+        failed_chunks = 0
+        for chunk in app.translate_stream(text, target_language, source_language=source_language):
+            translated.append(chunk['translation'])
+            merge_stats(total, chunk['stats'])
+            failed_chunks += chunk['error'] is not None
+            progress.progress((chunk['index'] + 1) / chunk['chunks'])
+            output.markdown(''.join(translated))
+        if failed_chunks:
+            st.warning(f"{failed_chunks} part(s) could not be translated and were left in the original language.")
+        _show_stats(total)
+        st.download_button('Download translation', ''.join(translated), file_name='translation.txt')
+
+# - Only the unique values of the selected columns are sent for translation
+with table_tab:
+    uploaded_table = st.file_uploader("Upload a CSV file", type="csv", key='ll_table_file')
+    if uploaded_table:
+        df = pd.read_csv(io.BytesIO(uploaded_table.getvalue()))
+        text_columns = [column for column in df.columns if df[column].dtype == object]
+        columns = st.multiselect('Columns to translate', text_columns, default=text_columns)
+        if columns and st.button('Translate', key='ll_translate_table'):
+            with st.spinner('Translating...'):
+                outcome = app.translate_columns(df, columns, target_language, source_language=source_language)
+            if outcome['failed_values']:
+                st.warning(f"{outcome['failed_values']} value(s) could not be translated and were left unchanged.")
+            _show_stats(outcome['stats'])
+            st.dataframe(outcome['df'].head(50))
+            st.download_button(
+                'Download translated CSV', outcome['df'].to_csv(index=False), file_name=f'translated_{uploaded_table.name}'
+            )
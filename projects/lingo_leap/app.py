@@ -0,0 +1,308 @@
+import os
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from utils.conversation_memory import estimate_tokens
+from utils.tracing import Tracer
+from .language_id import get_language_identifier
+from .llm_interface import LLMInterface, TranslationError
+from .segmenter import UNTRANSLATABLE_PATTERN, Segmenter, normalize_segment
+from .translation_memory import TranslationMemory, substitute_numbers
+
+
+DEFAULT_MEMORY_PATH = os.path.join(os.path.expanduser('~'), '.lingo_leap', 'translation_memory.db')
+STAT_KEYS = (
+    'segments', 'unique_segments', 'already_target', 'memory_exact', 'memory_fuzzy', 'repeated', 'translated',
+    'llm_calls', 'tokens_saved'
+)
+
+
+def merge_stats(total, stats):
+    for key in STAT_KEYS:
+        total[key] = total.get(key, 0) + stats.get(key, 0)
+    return total
+
+
+class TranslationApplication:
+    def __init__(self, api_key, memory_path=None, fuzzy_threshold=0.85, max_batch_tokens=1500,
+                 max_chunk_tokens=1500, concurrency=4, max_retries=2, skip_confidence=0.8):
+        """
+        :param api_key: str - OpenAI API key for LLM interactions.
+        :param memory_path: str - Path of the persistent translation memory.
+        :param fuzzy_threshold: float - Minimum similarity of fuzzy memory matches.
+        :param max_batch_tokens: int - Source tokens sent to the model per call.
+        :param max_chunk_tokens: int - Source tokens per concurrently translated chunk of a document.
+        :param concurrency: int - Chunks translated at the same time.
+        :param max_retries: int - Retries of a failed chunk before its original text is kept.
+        :param skip_confidence: float - Detection confidence above which text in the target language is not translated.
+        """
+        self.tracer = Tracer('lingo_leap')
+        self.llm_interface = LLMInterface(api_key, tracer=self.tracer)
+        self.memory = TranslationMemory(memory_path or os.environ.get('LINGO_LEAP_MEMORY_PATH', DEFAULT_MEMORY_PATH))
+        self.segmenter = Segmenter()
+        self.fuzzy_threshold = fuzzy_threshold
+        self.max_batch_tokens = max_batch_tokens
+        self.max_chunk_tokens = max_chunk_tokens
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.language_identifier = get_language_identifier()
+        self.skip_confidence = skip_confidence
+
+    def get_token_usage(self):
+        return self.llm_interface.token_usage
+
+    def get_last_trace(self):
+        return self.tracer.last_trace
+
+    def _batches(self, sources):
+        batch = []
+        batch_tokens = 0
+        for source in sources:
+            tokens = estimate_tokens(source)
+            if batch and batch_tokens + tokens > self.max_batch_tokens:
+                yield batch
+                batch = []
+                batch_tokens = 0
+            batch.append(source)
+            batch_tokens += tokens
+        if batch:
+            yield batch
+
+    def _translate_batch(self, sources, target_language, source_language, hints):
+        """
+        Translates a batch, splitting it in halves when the model's reply does not line up.
+        """
+        try:
+            return self.llm_interface.translate_segments(
+                sources, target_language, source_language=source_language,
+                hints={i: hints[source] for i, source in enumerate(sources) if source in hints}
+            )
+        except TranslationError:
+            if len(sources) == 1:
+                raise
+            middle = len(sources) // 2
+            return (
+                self._translate_batch(sources[:middle], target_language, source_language, hints)
+                + self._translate_batch(sources[middle:], target_language, source_language, hints)
+            )
+
+    def _translate_sources(self, sources, target_language, source_language=None):
+        """
+        Translates a list of segment texts. Segments already in the target language are
+        kept as they are, and segments found in the translation memory (or repeated in the
+        list) are not sent to the model. The rest are grouped by detected source language
+        and translated in as few batched calls as possible, then added to the memory.
+
+        :param sources: list - Segment texts, None for entries that are not to be translated.
+        :return: tuple - `(translations, stats)`, translations being None where the original is kept.
+        """
+        positions = {}
+        for position, source in enumerate(sources):
+            if source is not None:
+                positions.setdefault(normalize_segment(source), []).append(position)
+
+        stats = {key: 0 for key in STAT_KEYS}
+        stats['segments'] = sum(len(found) for found in positions.values())
+        stats['unique_segments'] = len(positions)
+        resolved = {}
+        languages = {}
+        with self.tracer.span('detect_language') as detect_span:
+            for source, found in positions.items():
+                language, confidence = self.language_identifier.detect(source)
+                if language == target_language and confidence >= self.skip_confidence:
+                    stats['already_target'] += len(found)
+                    stats['tokens_saved'] += len(found) * 2 * estimate_tokens(source)
+                    continue
+                languages[source] = source_language or language
+            # Segments too short to identify go with the text's dominant language
+            detected = Counter(language for language in languages.values() if language)
+            dominant = detected.most_common(1)[0][0] if detected else None
+            languages = {source: language or dominant for source, language in languages.items()}
+            detect_span.set(rows=len(positions) - len(languages), languages=len(detected))
+
+        hints = {}
+        with self.tracer.span('memory_lookup') as lookup_span:
+            for source, language in languages.items():
+                found = positions[source]
+                match = self.memory.lookup(source, language or 'auto', target_language, fuzzy_threshold=self.fuzzy_threshold)
+                if match is None:
+                    continue
+                if match['match'] == 'exact':
+                    resolved[source] = match['target']
+                    stats['memory_exact'] += len(found)
+                    continue
+                adapted = substitute_numbers(source, match['source'], match['target'])
+                if adapted is not None:
+                    resolved[source] = adapted
+                    stats['memory_fuzzy'] += len(found)
+                else:
+                    hints[source] = (match['source'], match['target'])
+            lookup_span.set(rows=len(resolved))
+
+        groups = {}
+        for source, language in languages.items():
+            if source not in resolved:
+                groups.setdefault(language, []).append(source)
+        sent = set()
+        for language, missing in groups.items():
+            for batch in self._batches(missing):
+                with self.tracer.span('translate_batch', rows=len(batch), source_language=language or 'auto'):
+                    batch_translations = self._translate_batch(batch, target_language, language, hints)
+                stats['llm_calls'] += 1
+                resolved.update(zip(batch, batch_translations))
+                self.memory.add_many(list(zip(batch, batch_translations)), language or 'auto', target_language)
+                stats['translated'] += len(batch)
+                sent.update(batch)
+
+        translations = [None] * len(sources)
+        for source, translation in resolved.items():
+            found = positions[source]
+            for position in found:
+                translations[position] = translation
+            # Repeats of a translated segment are sent once; memory matches are not sent at all
+            served = len(found) - 1 if source in sent else len(found)
+            if source in sent:
+                stats['repeated'] += served
+            stats['tokens_saved'] += served * (estimate_tokens(source) + estimate_tokens(translation))
+        return translations, stats
+
+    def _translate_segments(self, segments, target_language, source_language=None):
+        translations, stats = self._translate_sources(
+            [segment['text'] if segment['translatable'] else None for segment in segments],
+            target_language, source_language
+        )
+        return Segmenter.join(segments, translations), stats
+
+    def translate(self, text, target_language, source_language=None):
+        """
+        Translates a text in one pass (see `translate_stream` for long documents).
+
+        :param text: str - The text to translate.
+        :param target_language: str - Name of the target language.
+        :param source_language: str - Name of the source language, or None if unknown.
+        :return: dict - 'translation' and 'stats' (segment counts by origin, model calls, tokens saved).
+        """
+        with self.tracer.span('translate', target_language=target_language) as span:
+            translation, stats = self._translate_segments(self.segmenter.split(text), target_language, source_language)
+            span.set(rows=stats['segments'])
+            span.add(tokens_saved=stats['tokens_saved'])
+        return {'translation': translation, 'stats': stats}
+
+    def split_chunks(self, segments):
+        """
+        Groups segments into chunks of about `max_chunk_tokens`, preferring to end a chunk at
+        a paragraph break so that each chunk is translated with its own context.
+        """
+        chunks = []
+        chunk = []
+        chunk_tokens = 0
+        paragraph_end = 0
+        for segment in segments:
+            chunk.append(segment)
+            chunk_tokens += estimate_tokens(segment['text'])
+            if '\n\n' in segment['separator']:
+                paragraph_end = len(chunk)
+            if chunk_tokens >= self.max_chunk_tokens:
+                # Cut at the last paragraph break if that keeps at least half of the chunk
+                cut = paragraph_end if paragraph_end * 2 >= len(chunk) else len(chunk)
+                chunks.append(chunk[:cut])
+                chunk = chunk[cut:]
+                chunk_tokens = sum(estimate_tokens(remaining['text']) for remaining in chunk)
+                paragraph_end = 0
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    def _with_retries(self, task, *args):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return task(*args)
+            except Exception:
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(0.5 * 2 ** attempt)
+
+    def _run_ordered(self, task, chunks, *args):
+        """
+        Runs `task(chunk, *args)` for every chunk on a bounded pool, retrying each chunk on
+        its own, and yields `(index, result, error)` in chunk order as soon as the next chunk
+        is done. Chunks not yet started are cancelled if the consumer stops early.
+        """
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        try:
+            futures = {executor.submit(self._with_retries, task, chunk, *args): i for i, chunk in enumerate(chunks)}
+            finished = {}
+            next_index = 0
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finished[futures[future]] = future
+                while next_index in finished:
+                    future = finished.pop(next_index)
+                    error = future.exception()
+                    yield next_index, None if error else future.result(), error
+                    next_index += 1
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def translate_stream(self, text, target_language, source_language=None):
+        """
+        Translates a long text as concurrently translated chunks, yielding each chunk in
+        document order as soon as it and all chunks before it are done. A chunk that still
+        fails after its retries keeps its original text and carries the error.
+
+        :return: generator - Dicts with 'index', 'chunks', 'translation', 'stats' and 'error'.
+        """
+        chunks = self.split_chunks(self.segmenter.split(text))
+        for index, result, error in self._run_ordered(self._translate_segments, chunks, target_language, source_language):
+            if error is None:
+                translation, stats = result
+            else:
+                translation = Segmenter.join(chunks[index], [None] * len(chunks[index]))
+                stats = {key: 0 for key in STAT_KEYS}
+            yield {
+                'index': index, 'chunks': len(chunks), 'translation': translation,
+                'stats': stats, 'error': None if error is None else str(error)
+            }
+
+    def translate_columns(self, df, columns, target_language, source_language=None, values_per_chunk=200):
+        """
+        Translates text columns of a DataFrame. Only the unique cell values are sent for
+        translation and the results are mapped back onto every cell.
+
+        :param df: pd.DataFrame - The table.
+        :param columns: list - Columns to translate.
+        :return: dict - 'df' (a translated copy), 'stats' and 'failed_values' (left untranslated).
+        """
+        with self.tracer.span('translate_columns', target_language=target_language) as span:
+            values = set()
+            for column in columns:
+                values.update(
+                    value for value in df[column].dropna().unique()
+                    if isinstance(value, str) and not UNTRANSLATABLE_PATTERN.match(value)
+                )
+            values = sorted(values)
+            chunks = [values[i:i + values_per_chunk] for i in range(0, len(values), values_per_chunk)]
+            span.set(rows=len(df), unique_values=len(values))
+
+            mapping = {}
+            total = {key: 0 for key in STAT_KEYS}
+            failed_values = 0
+            for index, result, error in self._run_ordered(self._translate_sources, chunks, target_language, source_language):
+                if error is not None:
+                    failed_values += len(chunks[index])
+                    continue
+                translations, stats = result
+                # None marks values kept as they are (e.g. already in the target language)
+                mapping.update(
+                    (value, translation) for value, translation in zip(chunks[index], translations)
+                    if translation is not None
+                )
+                merge_stats(total, stats)
+
+            translated = df.copy()
+            for column in columns:
+                translated[column] = df[column].map(lambda value: mapping.get(value, value))
+        return {'df': translated, 'stats': total, 'failed_values': failed_values}
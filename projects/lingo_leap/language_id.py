@@ -0,0 +1,214 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+# Languages written in their own script are identified by Unicode range
+SCRIPT_RANGES = [
+    ('Russian', 0x0400, 0x04FF),
+    ('Arabic', 0x0600, 0x06FF),
+    ('Hindi', 0x0900, 0x097F),
+    ('Japanese', 0x3040, 0x30FF),
+    ('Korean', 0x1100, 0x11FF),
+    ('Korean', 0xAC00, 0xD7AF),
+    ('Chinese', 0x4E00, 0x9FFF),
+]
+
+# Seed text the n-gram profiles of Latin-script languages are computed from
+SEED_TEXTS = {
+    'English': """
+        The agreement shall enter into force on the date of its signature and remain valid for a period of
+        one year. The parties will inform each other of any change in writing. This product is made of high
+        quality materials and is easy to use. Please read the instructions carefully before you start and keep
+        them for future reference. We would like to thank you for your order and hope that you enjoy it.
+        What are you doing this weekend? I think that it would be nice to meet with them and have dinner.
+    """,
+    'Spanish': """
+        El contrato entrará en vigor en la fecha de su firma y será válido durante un período de un año. Las
+        partes se informarán mutuamente de cualquier cambio por escrito. Este producto está hecho con materiales
+        de alta calidad y es fácil de usar. Por favor, lea atentamente las instrucciones antes de empezar y
+        guárdelas para futuras consultas. Queremos agradecerle su pedido y esperamos que lo disfrute. ¿Qué vas a
+        hacer este fin de semana? Creo que sería bueno reunirnos con ellos y cenar juntos.
+    """,
+    'French': """
+        Le contrat entre en vigueur à la date de sa signature et reste valable pour une durée d'un an. Les
+        parties s'informent mutuellement par écrit de toute modification. Ce produit est fabriqué avec des
+        matériaux de haute qualité et il est facile à utiliser. Veuillez lire attentivement les instructions
+        avant de commencer et les conserver pour une consultation ultérieure. Nous vous remercions de votre
+        commande et nous espérons qu'elle vous plaira. Qu'est-ce que tu fais ce week-end ? Je pense que ce
+        serait bien de les rencontrer et de dîner ensemble.
+    """,
+    'German': """
+        Der Vertrag tritt am Tag seiner Unterzeichnung in Kraft und ist für die Dauer von einem Jahr gültig. Die
+        Parteien informieren sich gegenseitig schriftlich über jede Änderung. Dieses Produkt ist aus hochwertigen
+        Materialien gefertigt und einfach zu bedienen. Bitte lesen Sie die Anleitung sorgfältig, bevor Sie
+        beginnen, und bewahren Sie sie für später auf. Wir möchten uns für Ihre Bestellung bedanken und hoffen,
+        dass sie Ihnen gefällt. Was machst du am Wochenende? Ich glaube, es wäre schön, sich mit ihnen zu
+        treffen und zusammen zu essen.
+    """,
+    'Italian': """
+        Il contratto entra in vigore alla data della sua firma e resta valido per un periodo di un anno. Le parti
+        si informano a vicenda per iscritto di qualsiasi modifica. Questo prodotto è realizzato con materiali di
+        alta qualità ed è facile da usare. Si prega di leggere attentamente le istruzioni prima di iniziare e di
+        conservarle per consultazioni future. Vogliamo ringraziarti per il tuo ordine e speriamo che ti piaccia.
+        Che cosa fai questo fine settimana? Penso che sarebbe bello incontrarli e cenare insieme.
+    """,
+    'Portuguese': """
+        O contrato entra em vigor na data da sua assinatura e permanece válido por um período de um ano. As partes
+        informarão uma à outra por escrito sobre qualquer alteração. Este produto é feito com materiais de alta
+        qualidade e é fácil de usar. Por favor, leia as instruções com atenção antes de começar e guarde-as para
+        consultas futuras. Queremos agradecer o seu pedido e esperamos que você goste. O que você vai fazer neste
+        fim de semana? Acho que seria bom encontrar com eles e jantar juntos.
+    """,
+    'Dutch': """
+        De overeenkomst treedt in werking op de datum van ondertekening en blijft geldig voor een periode van een
+        jaar. De partijen stellen elkaar schriftelijk op de hoogte van elke wijziging. Dit product is gemaakt van
+        materialen van hoge kwaliteit en is eenvoudig te gebruiken. Lees de instructies zorgvuldig voordat u begint
+        en bewaar ze voor later gebruik. Wij willen u bedanken voor uw bestelling en hopen dat u ervan geniet. Wat
+        ga je dit weekend doen? Ik denk dat het leuk zou zijn om met hen af te spreken en samen te eten. Het is
+        belangrijk dat de betaling binnen de termijn wordt ontvangen. Neem gerust contact met ons op als u vragen
+        heeft over uw factuur of over onze diensten. Wij zijn van maandag tot en met vrijdag bereikbaar.
+    """,
+    'Polish': """
+        Umowa wchodzi w życie z dniem jej podpisania i obowiązuje przez okres jednego roku. Strony informują się
+        wzajemnie na piśmie o wszelkich zmianach. Ten produkt jest wykonany z materiałów wysokiej jakości i jest
+        łatwy w użyciu. Przed rozpoczęciem prosimy uważnie przeczytać instrukcję i zachować ją na przyszłość.
+        Dziękujemy za zamówienie i mamy nadzieję, że będzie Państwo zadowoleni. Co robisz w ten weekend? Myślę,
+        że byłoby miło spotkać się z nimi i zjeść razem kolację.
+    """,
+    'Turkish': """
+        Sözleşme imza tarihinde yürürlüğe girer ve bir yıllık bir süre için geçerlidir. Taraflar herhangi bir
+        değişikliği birbirlerine yazılı olarak bildirir. Bu ürün yüksek kaliteli malzemelerden yapılmıştır ve
+        kullanımı kolaydır. Lütfen başlamadan önce talimatları dikkatlice okuyun ve daha sonra başvurmak için
+        saklayın. Siparişiniz için teşekkür ederiz ve beğenmenizi umuyoruz. Bu hafta sonu ne yapıyorsun? Bence
+        onlarla buluşup birlikte akşam yemeği yemek güzel olur.
+    """,
+}
+
+
+def _code_points(text):
+    """
+    Lowercased code points of a text with every non-letter turned into a single space.
+
+    :return: tuple - `(codes, letter_count)`.
+    """
+    codes = np.frombuffer(f' {text.lower()} '.encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    letters = ((codes >= 97) & (codes <= 122)) | (
+        (codes >= 0xC0) & (codes != 0xD7) & (codes != 0xF7)
+        # General punctuation and symbols, CJK punctuation, full-width punctuation and digits
+        & ~((codes >= 0x2000) & (codes <= 0x2BFF)) & ~((codes >= 0x3000) & (codes <= 0x303F))
+        & ~((codes >= 0xFF00) & (codes <= 0xFF20))
+    )
+    codes = np.where(letters, codes, np.uint64(32))
+    # Collapse runs of spaces so punctuation and digits do not produce n-grams of their own
+    keep = np.ones(len(codes), dtype=bool)
+    keep[1:] = (codes[1:] != 32) | (codes[:-1] != 32)
+    return codes[keep], int(letters.sum())
+
+
+class LanguageIdentifier:
+    """
+    Local language identifier. Texts in a language with its own script are recognised by
+    Unicode range; Latin-script texts are scored against character 1- to 3-gram profiles.
+
+    N-grams are hashed arithmetically over the code point array into a fixed number of
+    buckets, so feature extraction and scoring of a segment are a few NumPy operations.
+    Results are kept in a bounded cache keyed by the text.
+    """
+
+    def __init__(self, buckets=4096, min_letters=12, min_confidence=0.5, cache_size=50000):
+        """
+        :param buckets: int - Size of the hashed n-gram feature space.
+        :param min_letters: int - Shorter texts are reported as undetermined.
+        :param min_confidence: float - Detections below this confidence are reported as undetermined.
+        :param cache_size: int - Detection results kept in the cache.
+        """
+        self.buckets = buckets
+        self.min_letters = min_letters
+        self.min_confidence = min_confidence
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.languages = list(SEED_TEXTS)
+        self._profiles = np.vstack([self._profile(SEED_TEXTS[language]) for language in self.languages])
+
+    def _features(self, codes):
+        counts = np.zeros(self.buckets, dtype=np.float32)
+        hashes = np.zeros(len(codes), dtype=np.uint64)
+        for n in range(1, 4):
+            if len(codes) < n:
+                break
+            # Rolling polynomial hash of the n-gram ending at each position
+            hashes = hashes[:len(codes) - n + 1] * np.uint64(1000003) + codes[n - 1:]
+            counts += np.bincount((hashes % np.uint64(self.buckets)).astype(np.int64), minlength=self.buckets)
+        return counts
+
+    def _profile(self, text):
+        codes, _ = _code_points(' '.join(text.split()))
+        counts = self._features(codes)
+        return np.log((counts + 0.5) / (counts.sum() + 0.5 * self.buckets))
+
+    @staticmethod
+    def _script_language(codes, letters):
+        # Chinese characters mixed with kana are Japanese
+        kana = np.count_nonzero((codes >= 0x3040) & (codes <= 0x30FF))
+        if kana and (kana + np.count_nonzero((codes >= 0x4E00) & (codes <= 0x9FFF))) * 2 > letters:
+            return 'Japanese'
+        for language, first, last in SCRIPT_RANGES:
+            if np.count_nonzero((codes >= first) & (codes <= last)) * 2 > letters:
+                return language
+        return None
+
+    def _detect(self, text):
+        codes, letters = _code_points(text)
+        if not letters:
+            return None, 0.0
+        language = self._script_language(codes, letters)
+        if language is not None:
+            return language, 1.0
+        if letters < self.min_letters:
+            return None, 0.0
+        scores = self._profiles @ self._features(codes)
+        # Per-n-gram log-likelihood margin between the two best languages, squashed to [0, 1)
+        best, second = np.argsort(-scores)[:2]
+        margin = (scores[best] - scores[second]) / max(len(codes), 1)
+        confidence = float(1 - np.exp(-12 * margin))
+        if confidence < self.min_confidence:
+            return None, confidence
+        return self.languages[best], confidence
+
+    def detect(self, text):
+        """
+        :param text: str - The text to identify.
+        :return: tuple - `(language, confidence)`, language being None when undetermined.
+        """
+        key = ' '.join(text.split())
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        result = self._detect(key)
+        with self._lock:
+            self._cache[key] = result
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+    def detect_many(self, texts):
+        return [self.detect(text) for text in texts]
+
+
+_identifier = None
+_identifier_lock = threading.Lock()
+
+
+def get_language_identifier():
+    """
+    Returns the process-wide identifier, computing its profiles on first use.
+    """
+    global _identifier
+    with _identifier_lock:
+        if _identifier is None:
+            _identifier = LanguageIdentifier()
+        return _identifier
@@ -0,0 +1,113 @@
+import json
+
+from openai import OpenAI, AuthenticationError
+
+from utils.llm_dispatcher import PRIORITY_INTERACTIVE, get_dispatcher
+
+
+class TranslationError(Exception):
+    """
+    Raised when the model's reply does not contain one translation per segment.
+    """
+
+
+class LLMInterface:
+    def __init__(self, api_key, tracer=None):
+        self.client = OpenAI(api_key=api_key)
+        self.tracer = tracer
+        self.token_usage = {
+            'completion_tokens': 0,
+            'prompt_tokens': 0,
+            'total_tokens': 0
+        }
+
+    def _update_token_usage(self, usage_data):
+        """
+        Updates the internal token usage counters based on the usage data from a completion.
+        """
+        self.token_usage['completion_tokens'] += usage_data.completion_tokens
+        self.token_usage['prompt_tokens'] += usage_data.prompt_tokens
+        self.token_usage['total_tokens'] += usage_data.total_tokens
+        if self.tracer is not None:
+            self.tracer.count(
+                completion_tokens=usage_data.completion_tokens,
+                prompt_tokens=usage_data.prompt_tokens,
+                total_tokens=usage_data.total_tokens
+            )
+
+    def _create_chat_completion(self, priority=PRIORITY_INTERACTIVE, **kwargs):
+        """
+        Sends a chat completion through the process-wide dispatcher, which applies the
+        shared rate limits, retries and coalescing of identical in-flight requests.
+        """
+        future = get_dispatcher().submit(self.client.chat.completions.create, priority=priority, **kwargs)
+        response = future.result()
+        if self.tracer is not None:
+            self.tracer.count(queue_wait_ms=round(future.queue_wait_ms, 3))
+        return response
+
+    def verify_api_key(self):
+        """
+        Verifies the OpenAI API key by making a test request.
+        Returns True if successful, False otherwise.
+        """
+        try:
+            response = self.client.completions.create(
+                model="babbage-002",
+                prompt='Hi',
+                max_tokens=5
+            )
+            if not response:
+                return False
+            self._update_token_usage(response.usage)
+            return True
+        except AuthenticationError:
+            return False
+
+    def translate_segments(self, segments, target_language, source_language=None, hints=None):
+        """
+        Translates a batch of segments in one call.
+
+        :param segments: list - The segments to translate.
+        :param target_language: str - Name of the target language.
+        :param source_language: str - Name of the source language, or None to let the model detect it.
+        :param hints: dict - Segment position to `(source, target)` of a similar, already translated segment.
+        :return: list - One translation per segment, in order.
+        """
+        source = f'from {source_language} ' if source_language else ''
+        system_prompt = f"""
+        You are a professional translator. Translate each numbered segment {source}into {target_language}.
+        Segments are consecutive parts of one document; keep terminology consistent across them.
+        Preserve numbers, codes, placeholders, URLs and inline formatting exactly.
+        Translate every segment on its own, without merging, splitting, adding or omitting any.
+        When a segment comes with a reference translation of a similar segment, follow its wording and terminology.
+        Reply with a JSON object {{"translations": [...]}} holding exactly {len(segments)} strings, in segment order.
+        """
+        lines = []
+        for position, segment in enumerate(segments):
+            lines.append(f'{position + 1}. {json.dumps(segment, ensure_ascii=False)}')
+            if hints and position in hints:
+                reference_source, reference_target = hints[position]
+                lines.append(
+                    f'   Reference: {json.dumps(reference_source, ensure_ascii=False)} -> '
+                    f'{json.dumps(reference_target, ensure_ascii=False)}'
+                )
+        response = self._create_chat_completion(
+            model="gpt-3.5-turbo",
+            messages=[
+                {'role': 'system', 'content': system_prompt},
+                {'role': 'user', 'content': 'Segments:\n' + '\n'.join(lines)}
+            ],
+            temperature=0,
+            response_format={'type': 'json_object'}
+        )
+        self._update_token_usage(response.usage)
+        try:
+            translations = json.loads(response.choices[0].message.content)['translations']
+        except (json.JSONDecodeError, KeyError, TypeError) as e:
+            raise TranslationError(f"Unreadable translation reply: {e}") from e
+        if not isinstance(translations, list):
+            raise TranslationError("Translation reply did not contain a list.")
+        if len(translations) != len(segments):
+            raise TranslationError(f"Expected {len(segments)} translations, got {len(translations)}.")
+        return [str(translation) for translation in translations]
@@ -0,0 +1,93 @@
+import re
+
+
+# Sentence ends (Latin and CJK punctuation) followed by whitespace, or line breaks
+BOUNDARY_PATTERN = re.compile(r'(?<=[.!?;:。！？；])\s+|\n+')
+# Common abbreviations whose trailing period does not end a sentence
+ABBREVIATIONS = {'e.g.', 'i.e.', 'etc.', 'vs.', 'mr.', 'mrs.', 'ms.', 'dr.', 'no.', 'art.', 'sec.', 'inc.', 'ltd.', 'co.'}
+# Segments with nothing to translate (numbers, codes, punctuation)
+UNTRANSLATABLE_PATTERN = re.compile(r'^[\W\d_]*$')
+
+
+def normalize_segment(text):
+    """
+    Canonical form used as translation memory key: collapsed whitespace.
+    """
+    return ' '.join(text.split())
+
+
+class Segmenter:
+    """
+    Splits text into sentence-level segments while keeping the exact separators, so the
+    translated document can be reassembled with its original layout.
+    """
+
+    def __init__(self, max_segment_chars=1000):
+        """
+        :param max_segment_chars: int - Longer sentences are split further at commas or spaces.
+        """
+        self.max_segment_chars = max_segment_chars
+
+    def split(self, text):
+        """
+        :param text: str - The input text.
+        :return: list - Dicts with 'text', the 'separator' that followed it and 'translatable'.
+        """
+        segments = []
+        position = 0
+        pending = ''
+        for match in BOUNDARY_PATTERN.finditer(text):
+            piece = pending + text[position:match.start()]
+            words = piece.split()
+            if words and words[-1].lower() in ABBREVIATIONS and '\n' not in match.group():
+                pending = piece + match.group()
+            else:
+                pending = ''
+                self._append(segments, piece, match.group())
+            position = match.end()
+        self._append(segments, pending + text[position:], '')
+        return segments
+
+    def _append(self, segments, piece, separator):
+        leading = piece[:len(piece) - len(piece.lstrip())]
+        if leading:
+            # Leading whitespace belongs to the previous separator
+            if segments:
+                segments[-1]['separator'] += leading
+            else:
+                segments.append({'text': '', 'separator': leading, 'translatable': False})
+            piece = piece[len(leading):]
+        for part, part_separator in self._split_long(piece):
+            segments.append({
+                'text': part, 'separator': part_separator, 'translatable': not UNTRANSLATABLE_PATTERN.match(part)
+            })
+        if segments:
+            segments[-1]['separator'] += separator
+        elif separator:
+            segments.append({'text': '', 'separator': separator, 'translatable': False})
+
+    def _split_long(self, piece):
+        parts = []
+        while len(piece) > self.max_segment_chars:
+            cut = max(piece.rfind(', ', 0, self.max_segment_chars) + 1, piece.rfind(' ', 0, self.max_segment_chars))
+            if cut <= 0:
+                cut = self.max_segment_chars
+            part = piece[:cut].rstrip()
+            rest = piece[cut:]
+            parts.append((part, piece[len(part):len(piece) - len(rest.lstrip())]))
+            piece = rest.lstrip()
+        if piece:
+            parts.append((piece, ''))
+        return parts
+
+    @staticmethod
+    def join(segments, translations):
+        """
+        Reassembles a document from its segments and their translations.
+
+        :param translations: list - Translated text per segment (None keeps the original).
+        """
+        return ''.join(
+            (segment['text'] if translation is None else translation) + segment['separator']
+            for segment, translation in zip(segments, translations)
+        )
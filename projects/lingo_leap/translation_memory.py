@@ -0,0 +1,185 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+
+from .segmenter import normalize_segment
+
+
+NUMBER_PATTERN = re.compile(r'\d+(?:[.,]\d+)*')
+
+
+def edit_distance(a, b, limit=None):
+    """
+    Levenshtein distance between two strings. With `limit`, gives up early and returns
+    `limit + 1` once the distance is known to exceed it.
+    """
+    if len(a) < len(b):
+        a, b = b, a
+    if limit is not None and len(a) - len(b) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, start=1):
+        current = [i]
+        for j, char_b in enumerate(b, start=1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if limit is not None and min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def similarity(a, b, threshold=0.0):
+    """
+    Edit-distance similarity in [0, 1] (1 means identical).
+    """
+    longest = max(len(a), len(b)) or 1
+    limit = int((1 - threshold) * longest)
+    return 1 - edit_distance(a, b, limit=limit) / longest
+
+
+def substitute_numbers(query, source, target):
+    """
+    Adapts a stored translation when its source differs from the query only in numbers
+    (amounts, dates, article numbers), as is typical of templated documents.
+
+    :return: str - The adapted translation, or None if the match cannot be adapted safely.
+    """
+    if NUMBER_PATTERN.sub('#', query) != NUMBER_PATTERN.sub('#', source):
+        return None
+    old_numbers = NUMBER_PATTERN.findall(source)
+    new_numbers = NUMBER_PATTERN.findall(query)
+    if NUMBER_PATTERN.findall(target) != old_numbers:
+        return None
+    replacements = iter(new_numbers)
+    return NUMBER_PATTERN.sub(lambda match: next(replacements), target)
+
+
+class TranslationMemory:
+    """
+    Persistent store of translated segments per language pair.
+
+    Exact lookups go through a hash of the normalized segment. Fuzzy lookups use an
+    in-memory inverted index of character trigrams (loaded per language pair on first use)
+    to shortlist candidates, which are then ranked by edit distance.
+    """
+
+    def __init__(self, path, ngram=3, max_candidates=20):
+        """
+        :param path: str - Path of the SQLite database (created if missing).
+        :param ngram: int - Character n-gram length of the fuzzy index.
+        :param max_candidates: int - Shortlisted candidates compared by edit distance.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.ngram = ngram
+        self.max_candidates = max_candidates
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS segments (
+                    id INTEGER PRIMARY KEY,
+                    source_language TEXT NOT NULL,
+                    target_language TEXT NOT NULL,
+                    source_hash BLOB NOT NULL,
+                    source TEXT NOT NULL,
+                    target TEXT NOT NULL,
+                    UNIQUE (source_language, target_language, source_hash)
+                )
+                """
+            )
+        self._indexes = {}
+
+    @staticmethod
+    def _hash(text):
+        return hashlib.sha256(text.encode()).digest()
+
+    def _ngrams(self, text):
+        text = f' {text.lower()} '
+        return {text[i:i + self.ngram] for i in range(max(len(text) - self.ngram + 1, 1))}
+
+    def _index(self, source_language, target_language):
+        key = (source_language, target_language)
+        if key not in self._indexes:
+            index = {'postings': {}, 'entries': {}}
+            rows = self._connection.execute(
+                "SELECT id, source, target FROM segments WHERE source_language = ? AND target_language = ?", key
+            ).fetchall()
+            for row_id, source, target in rows:
+                self._index_entry(index, row_id, source, target)
+            self._indexes[key] = index
+        return self._indexes[key]
+
+    def _index_entry(self, index, row_id, source, target):
+        index['entries'][row_id] = (source, target)
+        for gram in self._ngrams(source):
+            index['postings'].setdefault(gram, []).append(row_id)
+
+    def __len__(self):
+        return self._connection.execute("SELECT COUNT(*) FROM segments").fetchone()[0]
+
+    def lookup(self, segment, source_language, target_language, fuzzy_threshold=0.85):
+        """
+        :param segment: str - The segment to translate.
+        :param source_language: str - Source language code (or 'auto').
+        :param target_language: str - Target language code.
+        :param fuzzy_threshold: float - Minimum similarity of a fuzzy match (None disables fuzzy lookup).
+        :return: dict - 'match' ('exact' or 'fuzzy'), 'source', 'target' and 'similarity', or None.
+        """
+        source = normalize_segment(segment)
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT target FROM segments WHERE source_language = ? AND target_language = ? AND source_hash = ?",
+                (source_language, target_language, self._hash(source))
+            ).fetchone()
+            if row is not None:
+                return {'match': 'exact', 'source': source, 'target': row[0], 'similarity': 1.0}
+            if fuzzy_threshold is None:
+                return None
+            index = self._index(source_language, target_language)
+            grams = self._ngrams(source)
+            shared = Counter()
+            for gram in grams:
+                shared.update(index['postings'].get(gram, ()))
+
+        best = None
+        for row_id, count in shared.most_common(self.max_candidates):
+            candidate_source, candidate_target = index['entries'][row_id]
+            # Skip candidates whose n-gram overlap (Dice coefficient) makes a close match unlikely
+            if 2 * count / (len(grams) + len(self._ngrams(candidate_source))) < fuzzy_threshold - 0.2:
+                continue
+            score = similarity(source, candidate_source, threshold=fuzzy_threshold)
+            if score >= fuzzy_threshold and (best is None or score > best['similarity']):
+                best = {'match': 'fuzzy', 'source': candidate_source, 'target': candidate_target, 'similarity': score}
+        return best
+
+    def add_many(self, entries, source_language, target_language):
+        """
+        Stores translated segments.
+
+        :param entries: list - `(source, target)` pairs.
+        """
+        with self._lock, self._connection:
+            index = self._indexes.get((source_language, target_language))
+            for source, target in entries:
+                source = normalize_segment(source)
+                self._connection.execute(
+                    """
+                    INSERT INTO segments (source_language, target_language, source_hash, source, target)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (source_language, target_language, source_hash) DO UPDATE SET target = excluded.target
+                    """,
+                    (source_language, target_language, self._hash(source), source, target)
+                )
+                if index is not None:
+                    row_id = self._connection.execute(
+                        "SELECT id FROM segments WHERE source_language = ? AND target_language = ? AND source_hash = ?",
+                        (source_language, target_language, self._hash(source))
+                    ).fetchone()[0]
+                    if row_id in index['entries']:
+                        index['entries'][row_id] = (source, target)
+                    else:
+                        self._index_entry(index, row_id, source, target)
@@ -1,7 +1,119 @@
+import copy
+import re
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 
-from .database_manager import DatabaseManager
+import openai
+import pandas as pd
+
+from utils.cancellation import current_token
+from utils.llm_dispatcher import PRIORITY_BACKGROUND
+from utils.plotting import plotting
+from utils.prefetcher import Prefetcher
+from utils.sandbox import preload, race
+from utils.tracing import Tracer
+from .database_manager import DatabaseManager, is_read_only
 from .llm_interface import LLMInterface
+from .snapshot import SnapshotDatabase, SnapshotStore
+
+
+# Generated code that saves files or draws charts; not run speculatively, since its output is only wanted if asked for
+SIDE_EFFECT_PATTERN = re.compile(r'\b(?:matplotlib|plt|savefig|to_csv|to_excel|to_parquet|to_json)\b|\bopen\s*\(')
+
+
+class WriteRefused(Exception):
+    """
+    Raised when code running speculatively or in a sandbox issues a statement that is not read-only.
+    """
+
+
+class GuardedDatabase:
+    """
+    Database handle given to code that must not change data: it runs read-only statements
+    only, with a statement timeout, after an optional check (e.g. a query budget).
+    """
+
+    def __init__(self, database_manager, timeout_ms, before_query=None):
+        self.database_manager = database_manager
+        self.timeout_ms = timeout_ms
+        self.before_query = before_query
+        self.refused_writes = 0
+
+    def execute_query(self, query, read_only=None, timeout_ms=None):
+        if not is_read_only(query):
+            self.refused_writes += 1
+            raise WriteRefused("Only read-only queries can run here.")
+        if self.before_query is not None:
+            self.before_query()
+        return self.database_manager.execute_query(query, read_only=True, timeout_ms=self.timeout_ms)
+
+    def profile_query(self, query, token_budget=400, batch_size=10000, timeout_ms=None):
+        if not is_read_only(query):
+            self.refused_writes += 1
+            raise WriteRefused("Only read-only queries can run here.")
+        if self.before_query is not None:
+            self.before_query()
+        return self.database_manager.profile_query(
+            query, token_budget=token_budget, batch_size=batch_size, timeout_ms=self.timeout_ms
+        )
+
+
+class GuardedScope:
+    """
+    Stands in for the application as `self` of generated code, with every database guarded.
+    """
+
+    def __init__(self, databases, primary_name, timeout_ms, before_query=None):
+        """
+        :param databases: dict - Database managers by name.
+        :param primary_name: str - Name of the one exposed as `self.database_manager`.
+        """
+        self.databases = {
+            name: GuardedDatabase(manager, timeout_ms, before_query) for name, manager in databases.items()
+        }
+        self.database_manager = self.databases[primary_name]
+
+    @property
+    def refused_writes(self):
+        return sum(database.refused_writes for database in self.databases.values())
+
+
+def execute_code(snippet, scope):
+    """
+    Executes generated code with `scope` as its `self` and returns its `final_result`.
+    """
+    # Local scope to execute the code safely
+    local_scope = {'self': scope}
+
+    # Execute the code within the local scope
+    try:
+        snippet = snippet.strip('```python').strip('```')
+        with plotting(snippet):
+            exec(snippet, {}, local_scope)
+        return local_scope['final_result']
+    except Exception as e:
+        return {'error': str(e), 'is_code_generated': False}
+
+
+def execute_candidate(payload):
+    """
+    Runs one code candidate in its own sandboxed process, on database connections of its own
+    and without exporting spans. Candidates run side by side, so they may only read: a
+    candidate that writes is rejected here and re-run alone.
+
+    :param payload: dict - 'code', 'databases' (connection settings by name), 'primary' and 'timeout_ms'.
+    """
+    tracer = Tracer('query_quest', exporters=[])
+    databases = {name: DatabaseManager(**config, tracer=tracer) for name, config in payload['databases'].items()}
+    scope = GuardedScope(databases, payload['primary'], payload['timeout_ms'])
+    outcome = execute_code(payload['code'], scope)
+    if scope.refused_writes:
+        outcome = {'error': 'The candidate writes to the database.', 'is_code_generated': False, 'writes': True}
+    return outcome
+
+
+def _without_password(config):
+    return {key: value for key, value in config.items() if key != 'password'}
 
 
 class DBChatbotApplication:
@@ -10,54 +122,364 @@ class DBChatbotApplication:
     processing queries, and formatting responses.
     """
 
-    def __init__(self, db_config, api_key):
+    def __init__(self, db_config, api_key, databases=None):
         """
         Initializes the core components needed for the chatbot.
 
-        :param db_config: dict - Configuration parameters for the database.
+        :param db_config: dict - Configuration parameters for the database (optionally with 'replicas' and 'routing').
         :param api_key: str - OpenAI API key for LLM interactions.
+        :param databases: dict - Further databases or schemas to query in the same session, by name.
         """
-        self.database_manager = DatabaseManager(**db_config)
-        self.llm_interface = LLMInterface(api_key)
+        self.tracer = Tracer('query_quest')
+        self.db_config = db_config
+        self.databases_config = databases or {}
+        self.database_manager = DatabaseManager(**db_config, tracer=self.tracer)
+        self.database_manager_name = db_config['db_name']
+        self.databases = {self.database_manager_name: self.database_manager}
+        for name, config in (databases or {}).items():
+            if name in self.databases:
+                raise ValueError(f"Database name '{name}' is already used by the primary database.")
+            self.databases[name] = DatabaseManager(**config, tracer=self.tracer)
+        self.prefetcher = None
+        self.prefetch_queries = False
+        self.prefetch_timeout_ms = None
+        self.prefetch_wait = None
+        self._turns = 0
+        self.candidates = None
+        self.candidate_stats = {'races': 0, 'no_winner': 0, 'fallbacks': 0, 'wins': {}}
+        self.snapshot = None
+        self.suggest_followups = True
+        self.llm_interface = LLMInterface(api_key, tracer=self.tracer)
 
-    def initialize_context(self):
-        tables_context = []
-        tables = self.database_manager.list_tables()
-        for table in tables:
-            table_definition = self.database_manager.get_table_definition(table)
-            tables_context.append(
-                {
-                    'table_name': table,
-                    'table_columns': table_definition['columns'],
-                    'table_constraints': table_definition['constraints'],
-                    'table_top_3_rows': self.database_manager.get_top_rows(table, row_count=3)
-                }
-            )
-        context_to_format_1 = """Columns of the table '{table_name}':\n{table_columns}\n\nConstraints of the table '{table_name}':\n{table_constraints}\n\nTop 3 rows from the table '{table_name}':\n{table_top_3_rows}\n\n\n"""
-        self.llm_interface.code_reference_context = '\n'.join(map(lambda x: context_to_format_1.format(**x), tables_context))
+    @staticmethod
+    def _format_statistics(table_statistics):
+        """
+        Renders the planner statistics of one table as a compact text table.
+        """
+        rows = []
+        row_estimate = table_statistics['row_estimate']
+        for column in table_statistics['columns']:
+            n_distinct = column['n_distinct']
+            if n_distinct is None:
+                distinct = ''
+            elif n_distinct == -1:
+                distinct = 'unique'
+            elif n_distinct < 0:
+                # Negative values are a fraction of the row count
+                distinct = f'~{int(-n_distinct * row_estimate)}' if row_estimate else f'{-n_distinct:.0%} of rows'
+            else:
+                distinct = f'~{int(n_distinct)}'
+            rows.append({
+                'column': column['column_name'],
+                'distinct': distinct,
+                'nulls': '' if column['null_frac'] is None else f"{column['null_frac']:.0%}",
+                'common values': ', '.join(column['common_values'] or []),
+                'range': f"{column['min_value']} .. {column['max_value']}" if column['min_value'] is not None else '',
+            })
+        return pd.DataFrame(rows).to_string(index=False)
 
+    def _introspect(self, database_manager):
+        """
+        Builds the reference context of one database.
+        """
+        with self.tracer.span('introspect_database', schema=database_manager.schema) as span:
+            tables_context = []
+            tables = database_manager.list_tables()
+            statistics = database_manager.get_column_statistics()
+            for table in tables:
+                table_definition = database_manager.get_table_definition(table.split('.', 1)[-1])
+                table_statistics = statistics.get(table.split('.', 1)[-1])
+                if table_statistics and any(column['null_frac'] is not None for column in table_statistics['columns']):
+                    row_estimate = table_statistics['row_estimate']
+                    table_data = (
+                        f"Estimated rows: {row_estimate if row_estimate is not None else 'unknown'}\n"
+                        f"{self._format_statistics(table_statistics)}"
+                    )
+                elif table_statistics and table_statistics['kind'] in ('r', 'm', 'p'):
+                    # Never analyzed: fall back to a few truncated sample rows
+                    table_data = "No statistics available, sample rows:\n" + database_manager.get_sample_rows(
+                        table, [column['column_name'] for column in table_statistics['columns']]
+                    )
+                else:
+                    table_data = 'No statistics available.'
+                tables_context.append(
+                    {
+                        'table_name': table,
+                        'table_columns': table_definition['columns'],
+                        'table_constraints': table_definition['constraints'],
+                        'table_statistics': table_data
+                    }
+                )
+            span.set(tables=len(tables))
+        context_to_format_1 = """Columns of the table '{table_name}':\n{table_columns}\n\nConstraints of the table '{table_name}':\n{table_constraints}\n\nColumn statistics of the table '{table_name}':\n{table_statistics}\n\n\n"""
         # context_to_format_2 = """Columns of the table '{table_name}':\n{table_columns}\n\nConstraints of the table '{table_name}':\n{table_constraints}\n\n\n"""
-        # self.llm_interface.code_reference_context = '\n'.join(map(lambda x: context_to_format_2.format(**x), tables_context))
+        # return '\n'.join(map(lambda x: context_to_format_2.format(**x), tables_context))
+        return '\n'.join(map(lambda x: context_to_format_1.format(**x), tables_context))
+
+    def initialize_context(self):
+        with self.tracer.span('initialize_context') as span:
+            if len(self.databases) == 1:
+                self.llm_interface.code_reference_context = self._introspect(self.database_manager)
+            else:
+                # Databases are introspected in parallel, each on its own connections
+                with ThreadPoolExecutor(max_workers=len(self.databases)) as executor:
+                    contexts = dict(zip(self.databases, executor.map(self._introspect, self.databases.values())))
+                self.llm_interface.multiple_databases = True
+                self.llm_interface.code_reference_context = '\n'.join(
+                    f"Database '{name}' (query with `self.databases['{name}'].execute_query()`):\n\n{context}"
+                    for name, context in contexts.items()
+                )
+            span.set(databases=len(self.databases))
 
-    def _execute_generated_code(self, snippet):
+    def _execute_generated_code(self, snippet, scope=None):
         """
         Safely executes dynamically generated Python code and returns its output.
         This method limits the execution environment to prevent security risks.
+
+        :param scope: object - What the code sees as `self` (the application by default).
         """
-        # Local scope to execute the code safely
-        local_scope = {'self': self}
+        return execute_code(snippet, scope or self)
 
-        # Execute the code within the local scope
-        try:
-            snippet = snippet.strip('```python').strip('```')
-            exec(snippet, {}, local_scope)
-            return local_scope['final_result']
-        except Exception as e:
-            return {'error': str(e), 'is_code_generated': False}
+    def fork(self):
+        """
+        Returns an application sharing this one's databases and introspected context, with its
+        own conversation and token usage, so independent questions can be answered concurrently.
+        """
+        forked = copy.copy(self)
+        forked.llm_interface = self.llm_interface.fork()
+        forked.databases = dict(self.databases)
+        forked.prefetcher = None
+        forked.candidate_stats = {'races': 0, 'no_winner': 0, 'fallbacks': 0, 'wins': {}}
+        forked._turns = 0
+        return forked
+
+    def session_state(self):
+        """
+        Returns what is needed to resume the conversation as JSON-serializable parts: the
+        connection settings, the introspected context, the conversation and the snapshot tables.
+        """
+        snapshot = None
+        if self.snapshot is not None:
+            snapshot = {
+                'path': self.snapshot.store.path,
+                'filters': {entry['table_name']: entry['filter'] for entry in self.snapshot.store.status()},
+            }
+        return {
+            # The API key and database passwords are not saved
+            'config': {
+                'db_config': _without_password(self.db_config),
+                'databases': {name: _without_password(config) for name, config in self.databases_config.items()},
+            },
+            **self.llm_interface.session_state(),
+            'turns': self._turns,
+            'snapshot': snapshot,
+        }
+
+    @classmethod
+    def from_session_state(cls, state, api_key, password):
+        """
+        Resumes a conversation saved with `session_state` without introspecting the databases
+        again. The local snapshot is reopened as it was, and left off if it cannot be.
+
+        :param api_key: str - OpenAI API key, which is not saved.
+        :param password: str - Password of the databases (all use the same credentials), which is not saved.
+        """
+        config = state['config']
+        app = cls(
+            {**config['db_config'], 'password': password}, api_key,
+            databases={name: {**database, 'password': password} for name, database in (config.get('databases') or {}).items()}
+        )
+        app.llm_interface.load_session_state(state)
+        app._turns = state.get('turns', 0)
+        snapshot = state.get('snapshot')
+        if snapshot:
+            try:
+                app.enable_snapshot(list(snapshot['filters']), filters=snapshot['filters'], path=snapshot['path'], reuse=True)
+            except Exception:
+                app.disable_snapshot()
+        return app
 
     def get_openai_usage_tokens(self):
         return self.llm_interface.token_usage
 
+    def get_last_trace(self):
+        """
+        Returns the spans recorded for the most recent request.
+        """
+        return self.tracer.last_trace
+
+    def enable_prefetch(self, execute_queries=False, token_budget=6000, query_budget=5, ttl=120, timeout_ms=5000, wait=2.0):
+        """
+        Starts preparing the suggested follow-up questions in the background after each answer.
+
+        :param execute_queries: bool - Also run the prefetched code (read-only queries only, and no
+            files or charts) and summarize it.
+        :param token_budget: int - LLM tokens the prefetches of one answer may spend.
+        :param query_budget: int - Database queries the prefetches of one answer may run.
+        :param ttl: int - Seconds a prefetched result stays usable.
+        :param timeout_ms: int - Statement timeout of prefetched queries.
+        :param wait: float - Seconds a question waits for its unfinished prefetch before it is answered afresh.
+        """
+        self.disable_prefetch()
+        self.prefetcher = Prefetcher(ttl=ttl, token_budget=token_budget, query_budget=query_budget)
+        self.prefetch_queries = execute_queries
+        self.prefetch_timeout_ms = timeout_ms
+        self.prefetch_wait = wait
+
+    def disable_prefetch(self):
+        if self.prefetcher is not None:
+            self.prefetcher.shutdown()
+            self.prefetcher = None
+
+    def _prefetch(self, question, ticket):
+        """
+        Prepares the answer to a suggested question without touching the conversation state.
+        """
+        ticket.check()
+        code, usage = self.llm_interface.request_code(question, priority=PRIORITY_BACKGROUND)
+        ticket.charge_tokens(usage.total_tokens)
+        prefetched = {'code': code}
+        if not self.prefetch_queries or SIDE_EFFECT_PATTERN.search(code):
+            return prefetched
+
+        ticket.check()
+        outcome = self._execute_generated_code(code, scope=GuardedScope(
+            self.databases, self.database_manager_name, self.prefetch_timeout_ms, ticket.take_query
+        ))
+        if outcome.get('error'):
+            return prefetched
+        ticket.check()
+        summary, usage = self.llm_interface.request_summary(question, outcome, priority=PRIORITY_BACKGROUND)
+        ticket.charge_tokens(usage.total_tokens)
+        prefetched.update(outcome=outcome, summary=summary)
+        return prefetched
+
+    def _take_prefetched(self, question):
+        """
+        Returns the prefetched work for a question (waiting briefly if it is still running), or
+        None. Asking anything else cancels the pending prefetches.
+        """
+        if self.prefetcher is None:
+            return None
+        return self.prefetcher.wait(question, context_version=self._turns, timeout=self.prefetch_wait)
+
+    def enable_candidates(self, count=3, strategy='n', timeout=20, timeout_ms=10000):
+        """
+        Generates several code candidates per question and runs them concurrently, each in a
+        sandboxed process, keeping the first one that produces a valid `final_result`.
+
+        :param count: int - Candidates per question.
+        :param strategy: str - 'n' (one completion with several choices) or 'parallel' (separate requests).
+        :param timeout: float - Seconds after which unfinished candidates are killed.
+        :param timeout_ms: int - Statement timeout of the candidates' queries.
+        """
+        # Candidate processes start from a fork server with these already imported
+        preload(['pandas', __name__])
+        self.candidates = {'count': count, 'strategy': strategy, 'timeout': timeout, 'timeout_ms': timeout_ms}
+
+    def disable_candidates(self):
+        self.candidates = None
+
+    @staticmethod
+    def _is_valid_outcome(outcome):
+        return isinstance(outcome, dict) and not outcome.get('error') and 'is_code_generated' in outcome
+
+    def _run_candidates(self, question):
+        """
+        Generates and races the code candidates of a question.
+
+        :return: tuple - The code and the outcome of the winning candidate (or of the first one if none won).
+        """
+        with self.tracer.span('generate_candidates') as span:
+            codes = self.llm_interface.request_code_candidates(
+                question, count=self.candidates['count'], strategy=self.candidates['strategy']
+            )
+            span.set(candidates=len(codes))
+
+        # Candidates writing files would race on the same output path, so only the others race
+        # and one that writes files runs once, in the application process, if none of them wins
+        racing = [index for index, code in enumerate(codes) if not SIDE_EFFECT_PATTERN.search(code)]
+        with self.tracer.span('race_candidates', candidates=len(racing)) as span:
+            # Candidates connect to the databases themselves, bypassing a local snapshot
+            databases = {self.database_manager_name: self.db_config, **self.databases_config}
+            payloads = [
+                {'code': codes[index], 'databases': databases, 'primary': self.database_manager_name,
+                 'timeout_ms': self.candidates['timeout_ms']}
+                for index in racing
+            ]
+            result = race(
+                payloads, execute_candidate, self._is_valid_outcome,
+                timeout=self.candidates['timeout'], cancel_token=current_token()
+            ) if payloads else {'winner': None, 'outcomes': {}, 'timed_out': []}
+            winner = result['winner']
+            span.set(winner=winner if winner is None else racing[winner],
+                     finished=len(result['outcomes']), timed_out=len(result['timed_out']))
+            self.candidate_stats['races'] += 1
+            if winner is not None:
+                winner_index = racing[winner]
+                self.candidate_stats['wins'][winner_index] = self.candidate_stats['wins'].get(winner_index, 0) + 1
+                return codes[winner_index], result['outcomes'][winner]
+
+            self.candidate_stats['no_winner'] += 1
+            writers = [racing[index] for index, outcome in sorted(result['outcomes'].items()) if outcome.get('writes')]
+            writers += [index for index in range(len(codes)) if index not in racing]
+            if writers:
+                # Statements that change data, and code that writes files, run once in the application process
+                writers.sort()
+                self.candidate_stats['fallbacks'] += 1
+                span.set(fallback=writers[0])
+                return codes[writers[0]], self._execute_generated_code(snippet=codes[writers[0]])
+            outcome = result['outcomes'].get(0) or {'error': 'Code execution timed out.', 'is_code_generated': False}
+            return codes[racing[0]], outcome
+
+    def enable_snapshot(self, tables, filters=None, path=None, reuse=True):
+        """
+        Serves read-only queries on the given tables of the primary database from a local
+        columnar copy; anything the copy cannot answer still goes to the database.
+
+        :param tables: list - Tables to copy.
+        :param filters: dict - Optional SQL condition per table, to copy a subset of its rows.
+        :param path: str - The snapshot file (see `SnapshotStore`).
+        :param reuse: bool - Keep copies already in the file when their filter is unchanged.
+        :return: list - The freshness of every copied table.
+        """
+        self.disable_snapshot()
+        filters = filters or {}
+        store = SnapshotStore(self.database_manager, path=path)
+        existing = {entry['table_name']: entry for entry in store.status()}
+        with self.tracer.span('enable_snapshot', tables=len(tables)):
+            for table in set(existing) - set(tables):
+                store.drop(table)
+            for table in tables:
+                if not (reuse and table in existing and existing[table]['filter'] == filters.get(table)):
+                    store.snapshot_table(table, where=filters.get(table))
+        self.snapshot = SnapshotDatabase(self.database_manager, store, self.tracer)
+        self.database_manager = self.databases[self.database_manager_name] = self.snapshot
+        self.llm_interface.snapshot_context = store.describe()
+        return self.snapshot_status()
+
+    def refresh_snapshot(self, table=None):
+        """
+        Copies one snapshotted table again (or all of them).
+        """
+        with self.tracer.span('refresh_snapshot', table=table):
+            self.snapshot.store.refresh(table)
+        self.llm_interface.snapshot_context = self.snapshot.store.describe()
+        return self.snapshot_status()
+
+    def snapshot_status(self, check_source=False):
+        """
+        :return: list - Freshness of every snapshotted table (empty when snapshot mode is off).
+        """
+        return self.snapshot.store.status(check_source=check_source) if self.snapshot else []
+
+    def disable_snapshot(self):
+        if self.snapshot is not None:
+            self.database_manager = self.databases[self.database_manager_name] = self.snapshot.database_manager
+            self.snapshot.store.close()
+            self.snapshot = None
+            self.llm_interface.snapshot_context = None
+
     def run_query(self, question):
         """
         Runs a user query, processing it through various components.
@@ -65,34 +487,73 @@ class DBChatbotApplication:
         :param question: str - The user's query.
         :return: dict - Processed results and response details.
         """
-        try:
-            # Generate SQL query from LLM
-            code_snippet = self.llm_interface.generate_code(question=question)
+        with self.tracer.span('run_query', question=question[:200]) as span:
+            try:
+                prefetched = self._take_prefetched(question) or {}
+                span.set(prefetched=bool(prefetched))
 
-            # Execute SQL query
-            code_outcome = self._execute_generated_code(snippet=code_snippet)
-            if code_outcome.get('error'):
-                raise code_outcome['error']
+                if self.candidates is not None and 'code' not in prefetched:
+                    # Generate several candidates and keep the first that runs
+                    code_snippet, code_outcome = self._run_candidates(question)
+                    self.llm_interface._last_code = code_snippet
+                else:
+                    # Generate SQL query from LLM
+                    with self.tracer.span('generate_code', prefetched='code' in prefetched):
+                        if 'code' in prefetched:
+                            code_snippet = self.llm_interface._last_code = prefetched['code']
+                        else:
+                            code_snippet = self.llm_interface.generate_code(question=question)
 
-            # Interpret/Summarize Outcome
-            summary = self.llm_interface.summarize_results(question=question, results=code_outcome)
+                    # Execute SQL query
+                    with self.tracer.span('execute_code', prefetched='outcome' in prefetched) as execute_span:
+                        code_outcome = prefetched.get('outcome') or self._execute_generated_code(snippet=code_snippet)
+                        execute_span.set(total_rows=code_outcome.get('total_rows'))
+                if code_outcome.get('error'):
+                    raise code_outcome['error']
 
-            # Followup Question Suggestions
-            followup_suggestions = []
-            if code_outcome.get('is_code_generated'):
-                followup_suggestions = self.llm_interface.suggest_followup_questions(question=question, response=summary)
+                # Interpret/Summarize Outcome
+                with self.tracer.span('summarize_results', prefetched='summary' in prefetched):
+                    if 'summary' in prefetched:
+                        summary = prefetched['summary']
+                        self.llm_interface.record_turn(question, summary, code_outcome)
+                    else:
+                        summary = self.llm_interface.summarize_results(question=question, results=code_outcome)
+                self._turns += 1
 
-            return {
-                'result': summary,
-                'file': code_outcome.get('file_path') if code_outcome else None,
-                'follow_up_questions': followup_suggestions
-            }
-        except Exception as e:
-            # print(f"Error: {str(e)}")
-            # traceback.print_exc()
-            return {
-                'result': 'Encountered internal error, please try again.',
-                'file': None,
-                'follow_up_questions': [question],
-                'error': str(e)
-            }
+                # Followup Question Suggestions
+                followup_suggestions = []
+                if code_outcome.get('is_code_generated') and self.suggest_followups:
+                    with self.tracer.span('suggest_followup_questions'):
+                        followup_suggestions = self.llm_interface.suggest_followup_questions(question=question, response=summary)
+                    if self.prefetcher is not None and followup_suggestions:
+                        self.prefetcher.prefetch(followup_suggestions, self._prefetch, context_version=self._turns)
+
+                return {
+                    'result': summary,
+                    'file': code_outcome.get('file_path') if code_outcome else None,
+                    'follow_up_questions': followup_suggestions
+                }
+            except Exception as e:
+                # print(f"Error: {str(e)}")
+                # traceback.print_exc()
+                token = current_token()
+                if token is not None and token.cancelled:
+                    span.status = 'cancelled'
+                    return {
+                        'result': 'Stopped.',
+                        'file': None,
+                        'follow_up_questions': [question],
+                        'cancelled': True
+                    }
+                span.status = 'error'
+                span.error = str(e)
+                if isinstance(e, openai.RateLimitError):
+                    message = 'The assistant is handling too many requests right now, please try again in a moment.'
+                else:
+                    message = 'Encountered internal error, please try again.'
+                return {
+                    'result': message,
+                    'file': None,
+                    'follow_up_questions': [question],
+                    'error': str(e)
+                }
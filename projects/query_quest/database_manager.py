@@ -1,17 +1,81 @@
+import itertools
+import re
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
 import pandas as pd
 import psycopg2
-from contextlib import contextmanager
+
+from utils.cancellation import current_token
+from utils.result_profiler import ResultProfiler
+from utils.tracing import Tracer, traced
+
+
+# Statements that can be served by a read replica
+READ_ONLY_PATTERN = re.compile(r'^(select|with|show|explain|values|table)\b', re.IGNORECASE)
+WRITE_PATTERN = re.compile(
+    r'\b(insert|update|delete|merge|create|alter|drop|truncate|grant|revoke|into|for\s+(no\s+key\s+)?update|for\s+(key\s+)?share|nextval|setval)\b',
+    re.IGNORECASE
+)
+COMMENT_PATTERN = re.compile(r'--[^\n]*|/\*.*?\*/', re.DOTALL)
+
+
+def is_read_only(query):
+    """
+    Conservatively tells whether a statement only reads data, so it may run on a replica.
+    """
+    statement = COMMENT_PATTERN.sub(' ', query).strip()
+    return bool(READ_ONLY_PATTERN.match(statement)) and not WRITE_PATTERN.search(statement)
+
+
+class Endpoint:
+    """
+    A database server (primary or replica) with its health and observed latency.
+    """
+
+    def __init__(self, connection_params, role):
+        self.connection_params = connection_params
+        self.role = role
+        self.latency_ms = None
+        self.down_until = 0.0
+        self.failures = 0
+
+    @property
+    def healthy(self):
+        return time.monotonic() >= self.down_until
+
+    def record_success(self, latency_ms):
+        # Exponentially weighted so a single slow connection does not dominate
+        self.latency_ms = latency_ms if self.latency_ms is None else 0.8 * self.latency_ms + 0.2 * latency_ms
+        self.failures = 0
+
+    def record_failure(self, retry_after):
+        self.failures += 1
+        # Back off longer for endpoints that keep failing
+        self.down_until = time.monotonic() + retry_after * min(2 ** (self.failures - 1), 8)
 
 
 class DatabaseManager:
     """
     Manages database connections and queries. It ensures connections are properly opened and closed,
     and it handles the execution of queries.
+
+    With read replicas configured, catalog and read-only queries are routed across the healthy
+    replicas (round-robin or least-latency) and fail over to the next replica, then to the primary.
+    Writes always go to the primary.
     """
 
-    def __init__(self, db_name, user, password, host, port, schema):
+    def __init__(self, db_name, user, password, host, port, schema, tracer=None, replicas=None,
+                 routing='round_robin', retry_after=30, connect_timeout=5):
         """
         Initializes database configuration.
+
+        :param tracer: Tracer - Optional tracer recording a span for every database call.
+        :param replicas: list - Read replicas as dicts with 'host' and 'port' (and optionally other connection parameters).
+        :param routing: str - 'round_robin' or 'least_latency' replica selection.
+        :param retry_after: int - Seconds a failed endpoint is skipped before being tried again.
+        :param connect_timeout: int - Seconds to wait for a connection.
         """
         self.connection_params = {
             "dbname": db_name,
@@ -21,13 +85,60 @@ class DatabaseManager:
             "port": port
         }
         self.schema = schema
+        self.tracer = tracer or Tracer('query_quest')
+        if routing not in ('round_robin', 'least_latency'):
+            raise ValueError("routing must be 'round_robin' or 'least_latency'.")
+        self.routing = routing
+        self.retry_after = retry_after
+        self.connect_timeout = connect_timeout
+        self.primary = Endpoint(self.connection_params, 'primary')
+        self.replicas = [Endpoint({**self.connection_params, **replica}, 'replica') for replica in replicas or []]
+        self._next_replica = itertools.count()
+        self._lock = threading.Lock()
+
+    def _route(self, read_only):
+        """
+        Returns the endpoints to try, in order.
+        """
+        if not read_only or not self.replicas:
+            return [self.primary]
+        with self._lock:
+            healthy = [replica for replica in self.replicas if replica.healthy]
+            if self.routing == 'least_latency':
+                # Unmeasured replicas first so every replica gets a latency sample
+                healthy.sort(key=lambda replica: -1 if replica.latency_ms is None else replica.latency_ms)
+            elif healthy:
+                start = next(self._next_replica) % len(healthy)
+                healthy = healthy[start:] + healthy[:start]
+        return healthy + [self.primary]
+
+    def _open(self, read_only):
+        endpoints = self._route(read_only)
+        for i, endpoint in enumerate(endpoints):
+            params = endpoint.connection_params
+            with self.tracer.span('db.connect', host=params['host'], role=endpoint.role) as span:
+                started = time.perf_counter()
+                try:
+                    conn = psycopg2.connect(**params, connect_timeout=self.connect_timeout)
+                except psycopg2.OperationalError:
+                    if i == len(endpoints) - 1:
+                        raise
+                    span.set(failover=True)
+                    with self._lock:
+                        endpoint.record_failure(self.retry_after)
+                    continue
+            with self._lock:
+                endpoint.record_success((time.perf_counter() - started) * 1000)
+            return conn
 
     @contextmanager
-    def connect(self):
+    def connect(self, read_only=False):
         """
         Context manager for database connections.
+
+        :param read_only: bool - Whether the connection may go to a read replica.
         """
-        conn = psycopg2.connect(**self.connection_params)
+        conn = self._open(read_only)
         try:
             with conn.cursor() as cursor:
                 cursor.execute(f"SET search_path TO {self.schema};")
@@ -35,31 +146,174 @@ class DatabaseManager:
         finally:
             conn.close()
 
-    def execute_query(self, query):
+    def check_health(self):
         """
-        Executes a SQL query using the managed connection.
+        Pings every endpoint, updating its health and latency.
+
+        :return: list - Dicts with 'host', 'port', 'role', 'healthy' and 'latency_ms'.
         """
-        with self.connect() as conn:
-            with conn.cursor() as cursor:
-                cursor.execute(query)
+        report = []
+        for endpoint in [self.primary] + self.replicas:
+            started = time.perf_counter()
+            try:
+                conn = psycopg2.connect(**endpoint.connection_params, connect_timeout=self.connect_timeout)
                 try:
-                    results = cursor.fetchall()
-                    result = [
-                        dict(
-                            zip([desc[0] for desc in cursor.description], row)
-                        ) for row in results
-                    ]
-                    return result
-                except psycopg2.ProgrammingError:
-                    return []  # Handling cases where there are no results to fetch
+                    with conn.cursor() as cursor:
+                        cursor.execute("SELECT 1")
+                finally:
+                    conn.close()
+                with self._lock:
+                    endpoint.record_success((time.perf_counter() - started) * 1000)
+                    endpoint.down_until = 0.0
+            except psycopg2.Error:
+                with self._lock:
+                    endpoint.record_failure(self.retry_after)
+            report.append({
+                'host': endpoint.connection_params['host'], 'port': endpoint.connection_params['port'],
+                'role': endpoint.role, 'healthy': endpoint.healthy, 'latency_ms': endpoint.latency_ms
+            })
+        return report
+
+    def execute_query(self, query, read_only=None, timeout_ms=None):
+        """
+        Executes a SQL query using the managed connection.
+
+        :param read_only: bool - Whether the query may run on a replica (detected from the statement if None).
+        :param timeout_ms: int - Optional statement timeout.
+        """
+        if read_only is None:
+            read_only = is_read_only(query)
+        token = current_token()
+        if token is not None:
+            token.check()
+        with self.tracer.span('db.execute_query', query=query[:200]) as span:
+            with self.connect(read_only=read_only) as conn:
+                with conn.cursor() as cursor:
+                    if timeout_ms:
+                        cursor.execute(f"SET statement_timeout = {int(timeout_ms)}")
+                    if token is None:
+                        cursor.execute(query)
+                    else:
+                        # Cancelling sends a cancel request for the running statement (as pg_cancel_backend does)
+                        try:
+                            with token.on_cancel(conn.cancel):
+                                cursor.execute(query)
+                        except psycopg2.extensions.QueryCanceledError:
+                            token.check()
+                            raise
+                    try:
+                        results = cursor.fetchall()
+                        result = [
+                            dict(
+                                zip([desc[0] for desc in cursor.description], row)
+                            ) for row in results
+                        ]
+                        span.set(rows=len(result), bytes=sum(len(repr(row)) for row in results))
+                        return result
+                    except psycopg2.ProgrammingError:
+                        span.set(rows=0, bytes=0)
+                        return []  # Handling cases where there are no results to fetch
+
+    def profile_query(self, query, token_budget=400, batch_size=10000, timeout_ms=None):
+        """
+        Runs a read-only query and profiles its complete result as the rows stream in, through
+        a server-side cursor, so large results are described without being held in memory.
+
+        :param query: str - The (un-LIMITed) query to profile.
+        :param token_budget: int - Approximate size of the digest in tokens.
+        :param batch_size: int - Rows fetched per round trip.
+        :param timeout_ms: int - Optional statement timeout.
+        :return: dict - 'total_rows' and 'digest' (per-column aggregates, quantiles, top values and trends).
+        """
+        if not is_read_only(query):
+            raise ValueError("Only read-only queries can be profiled.")
+        token = current_token()
+        profiler = ResultProfiler()
+        with self.tracer.span('db.profile_query', query=query[:200]) as span:
+            with self.connect(read_only=True) as conn:
+                if timeout_ms:
+                    with conn.cursor() as cursor:
+                        cursor.execute(f"SET statement_timeout = {int(timeout_ms)}")
+                with conn.cursor(name='profile_query') as cursor:
+                    cursor.itersize = batch_size
+                    # A server-side cursor runs the query on the first FETCH (e.g. a sort over the
+                    # whole table), so the cancel request covers the fetches as well
+                    try:
+                        with token.on_cancel(conn.cancel) if token is not None else nullcontext():
+                            cursor.execute(query)
+                            columns = None
+                            while True:
+                                if token is not None:
+                                    token.check()
+                                rows = cursor.fetchmany(batch_size)
+                                if not rows:
+                                    break
+                                columns = columns or [desc[0] for desc in cursor.description]
+                                profiler.update(pd.DataFrame.from_records(rows, columns=columns))
+                    except psycopg2.extensions.QueryCanceledError:
+                        if token is not None:
+                            token.check()
+                        raise
+            span.set(rows=profiler.rows)
+        return {'total_rows': profiler.rows, 'digest': profiler.digest(token_budget)}
+
+    def copy_out(self, query, sink, buffer_size=1 << 20):
+        """
+        Streams the result of a read-only query in the binary COPY format into `sink.write`,
+        without materializing it in Python.
+
+        :param query: str - The SELECT whose rows are copied.
+        :param sink: object - Receives the raw COPY stream through `write(bytes)`.
+        """
+        if not is_read_only(query):
+            raise ValueError("Only read-only queries can be copied.")
+        token = current_token()
+        with self.tracer.span('db.copy_out', query=query[:200]) as span:
+            with self.connect(read_only=True) as conn:
+                with conn.cursor() as cursor:
+                    if token is None:
+                        cursor.copy_expert(f"COPY ({query}) TO STDOUT (FORMAT binary)", sink, size=buffer_size)
+                    else:
+                        with token.on_cancel(conn.cancel):
+                            cursor.copy_expert(f"COPY ({query}) TO STDOUT (FORMAT binary)", sink, size=buffer_size)
+                    span.set(rows=cursor.rowcount)
+
+    @traced('db.get_column_types')
+    def get_column_types(self, table_name):
+        """
+        Returns the columns of a table with their type name and formatted type, in order.
+        """
+        query = f"""
+        SELECT a.attname AS column_name, t.typname AS type_name, format_type(a.atttypid, a.atttypmod) AS formatted_type
+        FROM pg_attribute a
+        JOIN pg_type t ON t.oid = a.atttypid
+        WHERE a.attrelid = '{self.schema}.{table_name}'::regclass AND a.attnum > 0 AND NOT a.attisdropped
+        ORDER BY a.attnum
+        """
+        return self.execute_query(query, read_only=True)
+
+    @traced('db.get_modification_counts')
+    def get_modification_counts(self):
+        """
+        Returns the cumulative inserted, updated and deleted row counts of the tables of the
+        schema, from the statistics collector (approximate and slightly delayed). Read from
+        the primary, as replicas do not count replayed changes.
+        """
+        query = f"""
+        SELECT relname AS table_name, n_tup_ins + n_tup_upd + n_tup_del AS modifications
+        FROM pg_stat_user_tables
+        WHERE schemaname = '{self.schema}'
+        """
+        return {row['table_name']: row['modifications'] for row in self.execute_query(query, read_only=False)}
 
     def verify_connection(self):
         try:
-            with self.connect() as conn:
-                with conn.cursor() as cursor:
-                    cursor.execute("SELECT 1")
-                    if cursor.fetchone():
-                        return True
+            with self.tracer.span('db.verify_connection'):
+                with self.connect() as conn:
+                    with conn.cursor() as cursor:
+                        cursor.execute("SELECT 1")
+                        if cursor.fetchone():
+                            return True
         except psycopg2.Error:
             return False
 
@@ -67,14 +321,17 @@ class DatabaseManager:
         """
         Returns a list of all tables in the current database schema.
         """
-        query = f"SELECT table_name FROM information_schema.tables WHERE table_schema = '{self.schema}'"
-        tables = self.execute_query(query)
+        with self.tracer.span('db.list_tables') as span:
+            query = f"SELECT table_name FROM information_schema.tables WHERE table_schema = '{self.schema}'"
+            tables = self.execute_query(query)
 
-        tables_formatted = []
-        for table in tables:
-            tables_formatted.append(f"{self.schema}.{table['table_name']}")
-        return tables_formatted
+            tables_formatted = []
+            for table in tables:
+                tables_formatted.append(f"{self.schema}.{table['table_name']}")
+            span.set(rows=len(tables_formatted))
+            return tables_formatted
 
+    @traced('db.get_table_definition')
     def get_table_definition(self, table_name):
         """
         Returns the column names and data types for a given table.
@@ -108,6 +365,7 @@ class DatabaseManager:
         }
         return result
 
+    @traced('db.get_top_rows')
     def get_top_rows(self, table_name, row_count=3):
         """
         Returns the top N rows from a specified table.
@@ -115,3 +373,64 @@ class DatabaseManager:
         query = f"SELECT * FROM {table_name} LIMIT {row_count}"
         top_rows = self.execute_query(query)
         return pd.DataFrame(top_rows).to_string(index=False)
+
+    @traced('db.get_column_statistics')
+    def get_column_statistics(self, max_common_values=5, max_value_chars=40):
+        """
+        Reads the planner statistics Postgres already keeps for every table and view of the
+        schema in one catalog query: estimated row counts (`reltuples`) and per column the
+        null fraction, distinct count, most common values and histogram range (`pg_stats`).
+        Values are truncated in the database so wide text or JSON never leaves it in full.
+
+        :param max_common_values: int - Most common values kept per column.
+        :param max_value_chars: int - Characters kept of each value.
+        :return: dict - Table name to 'kind', 'row_estimate' and a list of column statistics.
+        """
+        query = f"""
+        SELECT c.relname AS table_name, c.relkind AS kind, c.reltuples::bigint AS row_estimate,
+               a.attname AS column_name, format_type(a.atttypid, a.atttypmod) AS data_type,
+               s.null_frac, s.n_distinct, s.avg_width,
+               CASE WHEN t.typcategory <> 'A' THEN (
+                   SELECT array_agg(left(value, {max_value_chars}))
+                   FROM unnest((s.most_common_vals::text::text[])[1:{max_common_values}]) AS value
+               ) END AS common_values,
+               CASE WHEN t.typcategory <> 'A' THEN left((s.histogram_bounds::text::text[])[1], {max_value_chars}) END AS min_value,
+               CASE WHEN t.typcategory <> 'A' THEN left(
+                   (s.histogram_bounds::text::text[])[array_length(s.histogram_bounds::text::text[], 1)], {max_value_chars}
+               ) END AS max_value
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+        JOIN pg_type t ON t.oid = a.atttypid
+        LEFT JOIN LATERAL (
+            -- Inheritance parents can have both plain and inherited statistics
+            SELECT * FROM pg_stats
+            WHERE schemaname = n.nspname AND tablename = c.relname AND attname = a.attname
+            ORDER BY inherited DESC
+            LIMIT 1
+        ) s ON true
+        WHERE n.nspname = '{self.schema}' AND c.relkind IN ('r', 'v', 'm', 'p', 'f')
+        ORDER BY c.relname, a.attnum
+        """
+        statistics = {}
+        for row in self.execute_query(query):
+            table = statistics.setdefault(row['table_name'], {
+                'kind': row['kind'],
+                # -1 means the table was never analyzed
+                'row_estimate': row['row_estimate'] if row['row_estimate'] is not None and row['row_estimate'] >= 0 else None,
+                'columns': []
+            })
+            table['columns'].append({key: row[key] for key in (
+                'column_name', 'data_type', 'null_frac', 'n_distinct', 'avg_width', 'common_values', 'min_value', 'max_value'
+            )})
+        return statistics
+
+    @traced('db.get_sample_rows')
+    def get_sample_rows(self, table_name, columns, row_count=3, max_value_chars=40):
+        """
+        Returns a few rows with every value cast to text and truncated in the database.
+        Used for tables without planner statistics.
+        """
+        select_list = ', '.join(f'left("{column}"::text, {max_value_chars}) AS "{column}"' for column in columns)
+        query = f"SELECT {select_list} FROM {table_name} LIMIT {row_count}"
+        return pd.DataFrame(self.execute_query(query)).to_string(index=False)
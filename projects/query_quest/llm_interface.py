@@ -1,26 +1,90 @@
+import copy
+
 import openai
 
+from utils.cancellation import current_token
+from utils.conversation_memory import ConversationMemory, extract_sql_entities
+from utils.llm_dispatcher import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, current_stream, get_dispatcher
+
 
 class LLMInterface:
     """
     Interface for OpenAI LLM to generate SQL queries, suggest follow-up questions,
     and generate scripts for data processing.
     """
-    def __init__(self, api_key):
+    def __init__(self, api_key, tracer=None):
         """
         Initialize with the OpenAI API key.
+
+        :param tracer: Tracer - Optional tracer the token usage of every completion is recorded on.
         """
         self.api_key = api_key
+        self.tracer = tracer
         openai.api_key = self.api_key
         self.code_reference_context = None
         self.suggestions_reference_context = None
-        self.chat_summary_history = []
+        self.multiple_databases = False
+        self.snapshot_context = None
+        # Where generated code saves its files
+        self.output_dir = '/tmp'
+        self.chat_summary_history = ConversationMemory(
+            summarizer=self._condense_history,
+            window=4,
+            entity_extractor=extract_sql_entities
+        )
+        self._last_code = None
         self.token_usage = {
             'completion_tokens': 0,
             'prompt_tokens': 0,
             'total_tokens': 0
         }
 
+    def fork(self):
+        """
+        Returns an interface sharing this one's reference context, with an empty conversation
+        and its own token usage, to answer an independent question alongside others.
+        """
+        forked = copy.copy(self)
+        forked.chat_summary_history = ConversationMemory(
+            summarizer=forked._condense_history,
+            window=self.chat_summary_history.window,
+            entity_extractor=extract_sql_entities
+        )
+        forked._last_code = None
+        forked.token_usage = dict.fromkeys(self.token_usage, 0)
+        return forked
+
+    def session_state(self):
+        """
+        Returns the reference context and the conversation as JSON-serializable parts, so the
+        large, rarely changing context is saved apart from the conversation growing every turn.
+        """
+        return {
+            'context': {
+                'code_reference_context': self.code_reference_context,
+                'suggestions_reference_context': self.suggestions_reference_context,
+                'multiple_databases': self.multiple_databases,
+            },
+            'conversation': {
+                'memory': self.chat_summary_history.to_state(),
+                'token_usage': dict(self.token_usage),
+                'last_code': self._last_code,
+            },
+        }
+
+    def load_session_state(self, state):
+        """
+        Restores what `session_state` returned, without introspecting the databases again.
+        """
+        context = state.get('context', {})
+        self.code_reference_context = context.get('code_reference_context')
+        self.suggestions_reference_context = context.get('suggestions_reference_context')
+        self.multiple_databases = context.get('multiple_databases', False)
+        conversation = state.get('conversation', {})
+        self.chat_summary_history.load_state(conversation.get('memory', {}))
+        self.token_usage.update(conversation.get('token_usage', {}))
+        self._last_code = conversation.get('last_code')
+
     def _update_token_usage(self, usage_data):
         """
         Updates the internal token usage counters based on the usage data from a completion.
@@ -28,6 +92,28 @@ class LLMInterface:
         self.token_usage['completion_tokens'] += usage_data.completion_tokens
         self.token_usage['prompt_tokens'] += usage_data.prompt_tokens
         self.token_usage['total_tokens'] += usage_data.total_tokens
+        if self.tracer is not None:
+            self.tracer.count(
+                completion_tokens=usage_data.completion_tokens,
+                prompt_tokens=usage_data.prompt_tokens,
+                total_tokens=usage_data.total_tokens
+            )
+
+    def _create_chat_completion(self, priority=PRIORITY_INTERACTIVE, on_delta=None, **kwargs):
+        """
+        Sends a chat completion through the process-wide dispatcher, which applies the
+        shared rate limits, retries and coalescing of identical in-flight requests.
+        Within a cancellation scope the completion is streamed and aborted on cancellation.
+
+        :param on_delta: callable - Receives the text of the completion as it is generated.
+        """
+        future = get_dispatcher().submit(
+            openai.chat.completions.create, priority=priority, cancel_token=current_token(), on_delta=on_delta, **kwargs
+        )
+        response = future.result()
+        if self.tracer is not None:
+            self.tracer.count(queue_wait_ms=round(future.queue_wait_ms, 3))
+        return response
 
     def verify_api_key(self):
         """
@@ -48,35 +134,123 @@ class LLMInterface:
             return False
 
     def generate_code(self, question: str) -> str:
+        """
+        Generates the code answering a question and records it as the code of the current turn.
+
+        :param question: str - The user's question.
+        :return: str - The generated code snippet.
+        """
+        code, _ = self.request_code(question)
+        self._last_code = code
+        return code
+
+    def request_code(self, question, priority=PRIORITY_INTERACTIVE):
         """
         Generates an SQL query based on the provided question and context.
 
         :param question: str - The user's question.
-        :return: str - The generated SQL query
+        :param priority: int - Dispatcher priority (background for speculative requests).
+        :return: tuple - The generated code and the completion's token usage.
+        """
+        response = self._create_chat_completion(
+            priority=priority,
+            model="gpt-3.5-turbo",
+            messages=self._code_messages(question),
+            seed=11,
+            temperature=0
+        )
+        response_content = response.choices[0].message.content.strip()
+        self._update_token_usage(response.usage)
+        return response_content, response.usage
+
+    def request_code_candidates(self, question, count=3, strategy='n', temperature=0.8):
+        """
+        Generates several alternative code snippets for a question.
+
+        With the 'n' strategy one completion returns all candidates, so the prompt is paid
+        for once. With 'parallel' the candidates are separate concurrent requests with
+        increasing temperatures, the first one being the usual deterministic completion.
+
+        :param question: str - The user's question.
+        :param count: int - Number of candidates.
+        :param strategy: str - 'n' or 'parallel'.
+        :param temperature: float - Sampling temperature ('n') or highest temperature ('parallel').
+        :return: list - The distinct code snippets, in candidate order.
         """
+        messages = self._code_messages(question)
+        if strategy == 'n':
+            response = self._create_chat_completion(
+                model="gpt-3.5-turbo",
+                messages=messages,
+                n=count,
+                temperature=temperature
+            )
+            self._update_token_usage(response.usage)
+            candidates = [choice.message.content.strip() for choice in response.choices]
+        elif strategy == 'parallel':
+            futures = [
+                get_dispatcher().submit(
+                    openai.chat.completions.create,
+                    priority=PRIORITY_INTERACTIVE,
+                    cancel_token=current_token(),
+                    model="gpt-3.5-turbo",
+                    messages=messages,
+                    seed=11 + i,
+                    temperature=temperature * i / max(count - 1, 1)
+                )
+                for i in range(count)
+            ]
+            candidates = []
+            for future in futures:
+                response = future.result()
+                self._update_token_usage(response.usage)
+                candidates.append(response.choices[0].message.content.strip())
+        else:
+            raise ValueError("strategy must be 'n' or 'parallel'.")
+        # Identical candidates would only fail or succeed together
+        return list(dict.fromkeys(candidates))
+
+    def _code_messages(self, question):
         if not self.code_reference_context:
             raise AttributeError("Reference context was not set.")
 
+        database_guidelines = ''
+        if self.multiple_databases:
+            database_guidelines = """
+Several databases are connected and the context lists the tables of each under its name.
+Query each database with `self.databases['<name>'].execute_query()` using the names given in the context; `self.database_manager` is only the first one.
+A single SQL query can only read tables of one database, so combine results from different databases with pandas.
+"""
+        if self.snapshot_context:
+            database_guidelines += f"""
+These tables are read from a local snapshot, copied at the times below (rows matching the filter only, where one is given):
+{self.snapshot_context}
+Keep to standard SQL so queries run both on the snapshot and on PostgreSQL. On the snapshot, timestamptz columns hold UTC timestamps without a time zone and division by zero gives NULL rather than an error (guard divisors with NULLIF). When the answer depends on these tables, mention in 'summary_message' that it reflects the data as of the copy time, and the filter if the question reaches beyond it.
+"""
+
         system_prompt = f"""
 You are a helpful code generator assistant, 'Assistant 1'.
 Generate a Python code snippet that effectively addresses the user's question using the provided PostgreSQL database context.
 Assume the database connection is already established and use the function `self.database_manager.execute_query()` for executing SQL queries, which accepts queries in string format and returns results as a list of dictionaries which can further loaded into pandas dataframe.
 Ensure to have necessary import statements in the code for necessary packages like pandas, matplotlib, os etc,..
 
-Database context, including columns and constraints, and the top three rows for each table, is detailed in: {self.code_reference_context}.
+Database context, including columns, constraints and column statistics (estimated row counts, distinct counts, common values and value ranges) for each table, is detailed in: {self.code_reference_context}.
 
 Adhere to these SQL query guidelines:
 - Utilize the SQL LIMIT clause to fetch at most 10 results.
+- For questions about distributions, typical or extreme values, shares or trends over many rows, also call `self.database_manager.profile_query()` with the same query without LIMIT. It profiles the complete result without loading it and returns a dictionary whose 'digest' (column aggregates, quantiles, top values and trends) must be stored in 'result_profile'.
 - Select only the necessary columns to answer the query, avoiding the selection of all columns from a table.
 - Confirm that only column names listed in the context are queried to prevent errors from non-existent columns.  
 
-If file generation (CSVs, graphs, or charts) is requested, ensure files are saved in the '/tmp' directory.
+{database_guidelines}
+If file generation (CSVs, graphs, or charts) is requested, ensure files are saved in the '{self.output_dir}' directory.
 Ensure the generated code snippet to return 'final_result' variable which is a python dictionary always containing the following:
 - 'total_rows': Dynamically calculated count of rows of the result relevant to the query.
 - 'top_ten_rows': Dynamically derived from the first ten rows of the result, formatted as strings if necessary.
 - 'file_path': Dynamically set to the path of any generated files, if applicable.
 - 'summary_message': A message summarizing the outcome, which could be constructed using f-strings.
 - 'is_code_generated': A boolean indicating whether SQL query was actually generated. Set to True if SQL code was executed, regardless of the result presence.
+- 'result_profile': The 'digest' returned by `profile_query()`, only if it was called.
 
 Handle different query outcomes as follows:
 - For irrelevant queries where no SQL code is executed, set 'total_rows' and 'top_ten_rows' to 0 and [], respectively; 'file_path' to None; 'summary_message' to 'Query not relevant to the database content.'; and 'is_code_generated' to False.
@@ -92,25 +266,34 @@ Ensure there has to be 'final_result' (not 'final_resul') dictionary returned at
             {"role": "system", "content": system_prompt},
         ]
         user_prompt = f"Question:\n{question}\n"
-        messages = dialogues + self.chat_summary_history[-4:] + [{"role": "user", "content": user_prompt}]
-        response = openai.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=messages,
-            seed=11,
-            temperature=0
-        )
-        response_content = response.choices[0].message.content.strip()
-        self._update_token_usage(response.usage)
-        return response_content
+        return dialogues + self.chat_summary_history.to_messages() + [{"role": "user", "content": user_prompt}]
 
     def summarize_results(self, question, results) -> str:
         """
-        Summarizes the results obtained by code generation assistant in a concise and readable format.
+        Summarizes the results obtained by code generation assistant in a concise and readable format,
+        and records the turn in the conversation memory.
 
         :param question: str - User's question.
         :param results: str - The outcome of generated code.
         :return: str - The summarized interpretation of the results.
         """
+        summary, _ = self.request_summary(question, results)
+        self.record_turn(question, summary, results)
+        return summary
+
+    def record_turn(self, question, summary, results):
+        """
+        Adds a completed question and answer to the conversation memory.
+        """
+        if results['is_code_generated']:
+            self.chat_summary_history.add_turn(question, summary, code=self._last_code)
+
+    def request_summary(self, question, results, priority=PRIORITY_INTERACTIVE):
+        """
+        Requests the summary of a code outcome without recording the turn.
+
+        :return: tuple - The summary and the completion's token usage.
+        """
         system_prompt = """
         You are a helpful assistant, 'Assistant 2'.
         Using the results returned by the previously executed python SQL program, interpret and summarize the outcome in a straightforward and statistical manner. Assume the results are stored in a dictionary with the following keys:
@@ -119,6 +302,7 @@ Ensure there has to be 'final_result' (not 'final_resul') dictionary returned at
         - 'file_path': The location of any file that was generated during the process, if applicable.
         - 'summary_message': A message provided by the previous assistant, summarizing the outcome of the query.
         - 'is_code_generated': A boolean that confirms whether SQL code was executed.
+        - 'result_profile': If present, a profile of the complete result (aggregates, quantiles, top values and trends per column); prefer it over 'top_ten_rows' for statements about the whole result.
 
         Your task is to provide a summary based on the user's question and results obtained.
         
@@ -140,21 +324,44 @@ Ensure there has to be 'final_result' (not 'final_resul') dictionary returned at
             {'role': 'assistant', 'content': 'Hello! How can I assist you?'},
         ]
         messages = dialogues + [{'role': 'user', 'content': f"""User Question:\n{question}\nOutcome:\n{results}"""}]
-        response = openai.chat.completions.create(
+        response = self._create_chat_completion(
+            priority=priority,
+            on_delta=current_stream(),
             model="gpt-3.5-turbo",
             messages=messages,
             temperature=0.31,
         )
         response_content = response.choices[0].message.content.strip()
-        if results['is_code_generated']:
-            self.chat_summary_history.append(
-                {"role": "user", "content": f"User Question:\n{question}"}
-            )
-            self.chat_summary_history.append(
-                {"role": "assistant", "content": f"Assistant 2:\n{response_content}"}
-            )
         self._update_token_usage(response.usage)
-        return response_content
+        return response_content, response.usage
+
+    def _condense_history(self, previous_summary, messages):
+        """
+        Condenses older chat turns into a compact summary for the conversation memory.
+
+        :param previous_summary: str - The summary produced for even older turns, if any.
+        :param messages: list - The chat messages to fold into the summary.
+        :return: str - The updated summary.
+        """
+        system_prompt = """
+        You maintain the memory of a conversation between a user and a database assistant.
+        Merge the previous summary and the new turns into one compact summary of at most 120 words.
+        Keep the questions asked, the key figures answered, and the table names, columns and filter values they resolved to.
+        Do not add anything that is not in the turns.
+        """
+        turns = '\n'.join(message['content'] for message in messages)
+        response = self._create_chat_completion(
+            priority=PRIORITY_BACKGROUND,
+            model="gpt-3.5-turbo",
+            messages=[
+                {'role': 'system', 'content': system_prompt},
+                {'role': 'user', 'content': f"Previous summary:\n{previous_summary or 'None'}\n\nNew turns:\n{turns}"}
+            ],
+            temperature=0,
+            max_tokens=200
+        )
+        self._update_token_usage(response.usage)
+        return response.choices[0].message.content.strip()
 
     def suggest_followup_questions(self, question: str, response: str) -> list:
         """
@@ -196,7 +403,8 @@ Ensure there has to be 'final_result' (not 'final_resul') dictionary returned at
                 {"role": "assistant", "content": f"Assistant 2 response:\n{response}\n"},
             ]
 
-        response = openai.chat.completions.create(
+        response = self._create_chat_completion(
+            priority=PRIORITY_BACKGROUND,
             model="gpt-3.5-turbo",
             messages=messages,
             n=1
@@ -0,0 +1,478 @@
+import os
+import struct
+import threading
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from utils.cancellation import OperationCancelled, current_token
+from utils.result_profiler import ResultProfiler
+from .database_manager import is_read_only
+
+
+COPY_SIGNATURE = b'PGCOPY\n\xff\r\n\x00'
+
+# Postgres types decoded from their binary representation, with the local column type
+FIXED_WIDTH_TYPES = {
+    'bool': ('?', 'BOOLEAN'),
+    'int2': ('>i2', 'SMALLINT'),
+    'int4': ('>i4', 'INTEGER'),
+    'int8': ('>i8', 'BIGINT'),
+    'float4': ('>f4', 'REAL'),
+    'float8': ('>f8', 'DOUBLE'),
+    'date': ('>i4', 'DATE'),
+    'timestamp': ('>i8', 'TIMESTAMP'),
+    # Kept as UTC timestamps: DuckDB's client needs pytz to return time zone aware values
+    'timestamptz': ('>i8', 'TIMESTAMP'),
+    'time': ('>i8', 'TIME'),
+}
+# Settings bringing DuckDB's semantics closer to PostgreSQL's. Remaining differences: division
+# by zero gives NULL instead of an error, and timestamptz columns compare as UTC timestamps.
+POSTGRES_COMPATIBILITY = [
+    'SET integer_division = true',
+    "SET default_null_order = 'nulls_last_on_asc_first_on_desc'",
+]
+TEXT_TYPES = {'text', 'varchar', 'bpchar', 'name', 'json', 'char'}
+# Dates and timestamps count days and microseconds from the Postgres epoch
+POSTGRES_EPOCH = np.datetime64('2000-01-01T00:00:00', 'us')
+
+
+def _local_type(column):
+    """
+    How a column is copied: its binary decoding ('fixed', 'text', 'jsonb' or 'uuid', the
+    others being cast to text in the COPY query) and its type in the local engine.
+    """
+    type_name, formatted = column['type_name'], column['formatted_type']
+    if type_name in FIXED_WIDTH_TYPES:
+        return 'fixed', FIXED_WIDTH_TYPES[type_name][1]
+    if type_name in TEXT_TYPES:
+        return 'text', 'JSON' if type_name == 'json' else 'VARCHAR'
+    if type_name == 'jsonb':
+        return 'jsonb', 'JSON'
+    if type_name == 'uuid':
+        return 'uuid', 'UUID'
+    if type_name == 'numeric':
+        # Decimal digits arrive as text and are cast locally, to DECIMAL when the precision fits
+        if formatted.startswith('numeric(') and int(formatted[8:].split(',')[0].rstrip(')')) <= 38:
+            return 'cast', formatted.replace('numeric', 'DECIMAL')
+        return 'cast', 'DOUBLE'
+    return 'cast', 'VARCHAR'
+
+
+class BinaryCopyParser:
+    """
+    Incremental parser of the Postgres binary COPY format. Raw field values are collected
+    per column and decoded a batch at a time, fixed-width columns with one NumPy
+    conversion each, and every full batch is handed to `on_batch` as a DataFrame.
+    """
+
+    def __init__(self, columns, on_batch, batch_rows=50000):
+        """
+        :param columns: list - Dicts with 'column_name', 'decoding' and 'type_name'.
+        :param on_batch: callable - Receives each decoded batch (pd.DataFrame).
+        :param batch_rows: int - Rows per batch.
+        """
+        self.columns = columns
+        self.on_batch = on_batch
+        self.batch_rows = batch_rows
+        self.rows = 0
+        self.bytes = 0
+        self._buffer = bytearray()
+        self._header_done = False
+        self._finished = False
+        self._fields = [[] for _ in columns]
+
+    def write(self, data):
+        self.bytes += len(data)
+        self._buffer += data
+        self._parse()
+        return len(data)
+
+    def _parse(self):
+        buffer = memoryview(self._buffer)
+        position = 0
+        if not self._header_done:
+            if len(buffer) < 19:
+                return
+            if bytes(buffer[:11]) != COPY_SIGNATURE:
+                raise ValueError("Not a binary COPY stream.")
+            extension_length, = struct.unpack_from('>i', buffer, 15)
+            if len(buffer) < 19 + extension_length:
+                return
+            position = 19 + extension_length
+            self._header_done = True
+
+        unpack_count, unpack_length = struct.Struct('>h').unpack_from, struct.Struct('>i').unpack_from
+        fields, size = self._fields, len(buffer)
+        while not self._finished and position + 2 <= size:
+            count, = unpack_count(buffer, position)
+            if count == -1:
+                self._finished = True
+                position += 2
+                break
+            # Fields are only taken once the whole tuple has arrived
+            cursor, values = position + 2, []
+            for _ in range(count):
+                if cursor + 4 > size:
+                    break
+                length, = unpack_length(buffer, cursor)
+                cursor += 4
+                if length == -1:
+                    values.append(None)
+                    continue
+                if cursor + length > size:
+                    break
+                values.append(bytes(buffer[cursor:cursor + length]))
+                cursor += length
+            if len(values) < count:
+                break
+            for column_fields, value in zip(fields, values):
+                column_fields.append(value)
+            position = cursor
+            if len(fields[0]) >= self.batch_rows:
+                self._flush()
+                fields = self._fields
+        buffer.release()
+        del self._buffer[:position]
+
+    def _decode(self, column, values):
+        decoding, type_name = column['decoding'], column['type_name']
+        if decoding == 'fixed':
+            dtype = FIXED_WIDTH_TYPES[type_name][0]
+            missing = np.fromiter((value is None for value in values), dtype=bool, count=len(values))
+            width = np.dtype(dtype).itemsize
+            raw = np.frombuffer(b''.join(value or b'\0' * width for value in values), dtype=dtype)
+            if type_name == 'bool':
+                return pd.arrays.BooleanArray(raw.copy(), missing)
+            if type_name == 'date':
+                decoded = (POSTGRES_EPOCH.astype('datetime64[D]') + raw.astype('timedelta64[D]')).astype('datetime64[us]')
+            elif type_name in ('timestamp', 'timestamptz'):
+                decoded = POSTGRES_EPOCH + raw.astype('timedelta64[us]')
+            elif type_name == 'time':
+                # As a timestamp on the Unix epoch, which is cast to TIME locally
+                decoded = np.datetime64('1970-01-01T00:00:00', 'us') + raw.astype('timedelta64[us]')
+            elif type_name in ('int2', 'int4', 'int8'):
+                return pd.arrays.IntegerArray(raw.astype(np.int64), missing)
+            else:
+                decoded = raw.astype(float)
+            decoded = decoded.copy()
+            decoded[missing] = np.datetime64('NaT') if decoded.dtype.kind in 'mM' else np.nan
+            return pd.Series(decoded)
+        if decoding == 'uuid':
+            return pd.Series([None if value is None else str(uuid.UUID(bytes=value)) for value in values], dtype=object)
+        if decoding == 'jsonb':
+            # jsonb carries a format version byte before the text
+            return pd.Series([None if value is None else value[1:].decode('utf-8') for value in values], dtype=object)
+        return pd.Series([None if value is None else value.decode('utf-8') for value in values], dtype=object)
+
+    def _flush(self):
+        if not self._fields[0]:
+            return
+        batch = pd.DataFrame({
+            column['column_name']: self._decode(column, values) for column, values in zip(self.columns, self._fields)
+        })
+        self.rows += len(batch)
+        self._fields = [[] for _ in self.columns]
+        self.on_batch(batch)
+
+    def close(self):
+        self._flush()
+        if not self._finished:
+            raise ValueError("The COPY stream ended before its trailer.")
+
+
+class SnapshotStore:
+    """
+    Local columnar copies of selected tables of a Postgres schema, kept in a DuckDB file,
+    with freshness metadata per table.
+
+    Tables are copied with `COPY ... TO STDOUT (FORMAT binary)` and parsed as they stream
+    in. Generated SQL then runs in process against the copies; a query the local engine
+    cannot answer (a table that was not copied, a Postgres-only construct) goes to the
+    database as usual.
+    """
+
+    def __init__(self, database_manager, path=None):
+        """
+        :param database_manager: DatabaseManager - The database the tables are copied from.
+        :param path: str - The DuckDB file (one per database and schema under ~/.query_quest/snapshots by default).
+        """
+        try:
+            import duckdb
+        except ImportError as e:
+            raise ImportError("Snapshot mode needs the 'duckdb' package.") from e
+        self.database_manager = database_manager
+        self.schema = database_manager.schema
+        params = database_manager.connection_params
+        self.path = path or os.path.join(
+            os.path.expanduser('~'), '.query_quest', 'snapshots',
+            f"{params['host']}_{params['port']}_{params['dbname']}_{self.schema}.duckdb"
+        )
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._connection = duckdb.connect(self.path)
+        # A forked process (e.g. a code candidate) must not use the parent's connection
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._connection.execute(f'CREATE SCHEMA IF NOT EXISTS "{self.schema}"')
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS snapshot_metadata (
+                table_name VARCHAR PRIMARY KEY, filter VARCHAR, columns VARCHAR, row_count BIGINT,
+                bytes BIGINT, refreshed_at TIMESTAMP, duration_ms DOUBLE, source_modifications BIGINT
+            )
+        """)
+
+    def _cursor(self):
+        # Every cursor is a connection of its own, so unqualified names are resolved per cursor
+        cursor = self._connection.cursor()
+        cursor.execute(f'SET search_path = \'"{self.schema}",main\'')
+        for setting in POSTGRES_COMPATIBILITY:
+            cursor.execute(setting)
+        return cursor
+
+    @property
+    def usable(self):
+        return os.getpid() == self._pid
+
+    def snapshot_table(self, table_name, where=None, columns=None):
+        """
+        Copies a table (or the rows matching `where`) into the local cache, replacing the
+        previous copy only once the new one is complete.
+
+        :param table_name: str - The table, without schema.
+        :param where: str - Optional SQL condition selecting the subset to copy.
+        :param columns: list - Optional subset of columns.
+        :return: dict - The table's freshness metadata.
+        """
+        started = time.perf_counter()
+        table_columns = self.database_manager.get_column_types(table_name)
+        if columns:
+            table_columns = [column for column in table_columns if column['column_name'] in columns]
+        select_list = []
+        for column in table_columns:
+            column['decoding'], column['local_type'] = _local_type(column)
+            name = '"' + column['column_name'].replace('"', '""') + '"'
+            select_list.append(f'{name}::text AS {name}' if column['decoding'] == 'cast' else name)
+        query = f'SELECT {", ".join(select_list)} FROM "{self.schema}"."{table_name}"'
+        if where:
+            query += f' WHERE {where}'
+        modifications = self.database_manager.get_modification_counts().get(table_name)
+
+        staging = f'"{self.schema}"."_staging_{table_name}"'
+        definition = ', '.join(f'"{column["column_name"]}" {column["local_type"]}' for column in table_columns)
+        casts = ', '.join(f'CAST("{column["column_name"]}" AS {column["local_type"]})' for column in table_columns)
+        with self._lock:
+            cursor = self._cursor()
+            cursor.execute(f'CREATE OR REPLACE TABLE {staging} ({definition})')
+
+            def append(batch):
+                cursor.register('snapshot_batch', batch)
+                cursor.execute(f'INSERT INTO {staging} SELECT {casts} FROM snapshot_batch')
+                cursor.unregister('snapshot_batch')
+
+            parser = BinaryCopyParser(table_columns, append)
+            try:
+                self.database_manager.copy_out(query, parser)
+                parser.close()
+            except BaseException:
+                cursor.execute(f'DROP TABLE IF EXISTS {staging}')
+                raise
+            metadata = {
+                'table_name': table_name, 'filter': where, 'columns': ', '.join(c['column_name'] for c in table_columns),
+                'row_count': parser.rows, 'bytes': parser.bytes, 'refreshed_at': datetime.now(timezone.utc),
+                'duration_ms': round((time.perf_counter() - started) * 1000, 3), 'source_modifications': modifications,
+            }
+            cursor.execute('BEGIN TRANSACTION')
+            cursor.execute(f'DROP TABLE IF EXISTS "{self.schema}"."{table_name}"')
+            cursor.execute(f'ALTER TABLE {staging} RENAME TO "{table_name}"')
+            cursor.execute('DELETE FROM snapshot_metadata WHERE table_name = ?', [table_name])
+            # Stored as a plain UTC timestamp, as time zone aware values need pytz in DuckDB's client
+            cursor.execute('INSERT INTO snapshot_metadata VALUES (?, ?, ?, ?, ?, ?, ?, ?)', [
+                metadata['refreshed_at'].replace(tzinfo=None) if key == 'refreshed_at' else value
+                for key, value in metadata.items()
+            ])
+            cursor.execute('COMMIT')
+        return metadata
+
+    def refresh(self, table_name=None):
+        """
+        Copies one table again (or all snapshotted tables), keeping their filters and columns.
+        """
+        tables = [table_name] if table_name else [row['table_name'] for row in self.status()]
+        return [
+            self.snapshot_table(table, where=entry['filter'], columns=entry['columns'].split(', '))
+            for table, entry in ((table, self._metadata(table)) for table in tables)
+        ]
+
+    def drop(self, table_name):
+        with self._lock:
+            cursor = self._cursor()
+            cursor.execute(f'DROP TABLE IF EXISTS "{self.schema}"."{table_name}"')
+            cursor.execute('DELETE FROM snapshot_metadata WHERE table_name = ?', [table_name])
+
+    def _metadata(self, table_name):
+        cursor = self._cursor()
+        row = cursor.execute('SELECT * FROM snapshot_metadata WHERE table_name = ?', [table_name]).fetchone()
+        if row is None:
+            raise KeyError(f"Table '{table_name}' has no snapshot.")
+        return dict(zip([desc[0] for desc in cursor.description], row))
+
+    def status(self, check_source=False):
+        """
+        Freshness of every snapshotted table.
+
+        :param check_source: bool - Also compare the source's modification counter with the
+            one recorded at copy time (one catalog query).
+        :return: list - Dicts with the metadata, 'age_seconds' and, when checked, 'source_changed'.
+        """
+        cursor = self._cursor()
+        rows = cursor.execute('SELECT * FROM snapshot_metadata ORDER BY table_name').fetchall()
+        names = [desc[0] for desc in cursor.description]
+        current = self.database_manager.get_modification_counts() if check_source else {}
+        now = datetime.now(timezone.utc)
+        status = []
+        for row in rows:
+            entry = dict(zip(names, row))
+            entry['refreshed_at'] = entry['refreshed_at'].replace(tzinfo=timezone.utc)
+            entry['age_seconds'] = round((now - entry['refreshed_at']).total_seconds())
+            if check_source:
+                recorded, latest = entry['source_modifications'], current.get(entry['table_name'])
+                entry['source_changed'] = None if recorded is None or latest is None else latest != recorded
+            status.append(entry)
+        return status
+
+    def describe(self):
+        """
+        One line per snapshotted table for the code-generation prompt.
+        """
+        return '\n'.join(
+            f"- {entry['table_name']}: {entry['row_count']} rows"
+            + (f" matching `{entry['filter']}`" if entry['filter'] else '')
+            + f", copied {entry['refreshed_at']:%Y-%m-%d %H:%M} UTC"
+            for entry in self.status()
+        )
+
+    @contextmanager
+    def _interruptible(self, cursor, timeout_ms):
+        """
+        Interrupts the statement running on `cursor` after `timeout_ms` or when the current
+        cancellation token is cancelled, as the statement timeout and cancel requests do on
+        the database.
+        """
+        token = current_token()
+        if token is not None:
+            token.check()
+        timed_out = threading.Event()
+
+        def expire():
+            timed_out.set()
+            cursor.interrupt()
+
+        timer = threading.Timer(timeout_ms / 1000, expire) if timeout_ms else None
+        if timer is not None:
+            timer.daemon = True
+            timer.start()
+        try:
+            with token.on_cancel(cursor.interrupt) if token is not None else nullcontext():
+                yield
+        except Exception as e:
+            if token is not None:
+                token.check()
+            if timed_out.is_set():
+                raise TimeoutError(f"The query ran longer than {int(timeout_ms)} ms.") from e
+            raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+    def execute_query(self, query, timeout_ms=None):
+        """
+        Runs a query against the local copies.
+
+        :param timeout_ms: int - Optional statement timeout.
+        :return: list - The rows as dicts, like `DatabaseManager.execute_query`.
+        """
+        cursor = self._cursor()
+        with self._interruptible(cursor, timeout_ms):
+            cursor.execute(query)
+            if cursor.description is None:
+                return []
+            columns = [desc[0] for desc in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def profile_query(self, query, token_budget=400, batch_size=10000, timeout_ms=None):
+        """
+        Profiles the complete result of a query against the local copies, batch by batch.
+
+        :param timeout_ms: int - Optional statement timeout.
+        :return: dict - 'total_rows' and 'digest', like `DatabaseManager.profile_query`.
+        """
+        cursor = self._cursor()
+        profiler = ResultProfiler()
+        with self._interruptible(cursor, timeout_ms):
+            cursor.execute(query)
+            columns = [desc[0] for desc in cursor.description]
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                profiler.update(pd.DataFrame.from_records(rows, columns=columns))
+        return {'total_rows': profiler.rows, 'digest': profiler.digest(token_budget)}
+
+    def close(self):
+        if self.usable:
+            self._connection.close()
+
+
+class SnapshotDatabase:
+    """
+    Database handle serving read-only queries from the snapshot when it can, and from the
+    database otherwise. Everything else is delegated to the database manager.
+    """
+
+    def __init__(self, database_manager, store, tracer):
+        self.database_manager = database_manager
+        self.store = store
+        self.tracer = tracer
+        self.stats = {'local': 0, 'remote': 0}
+
+    def __getattr__(self, name):
+        return getattr(self.database_manager, name)
+
+    def _local(self, operation, query, read_only, *args):
+        """
+        Runs `operation` of the store, returning None when the query has to go to the database.
+        """
+        if not self.store.usable or not (read_only if read_only is not None else is_read_only(query)):
+            return None
+        with self.tracer.span(f'snapshot.{operation}', query=query[:200]) as span:
+            try:
+                result = getattr(self.store, operation)(query, *args)
+            except (OperationCancelled, TimeoutError):
+                # Stopped or too slow: running it again on the database would not help
+                raise
+            except Exception as e:
+                # Not answerable locally, e.g. the table was not copied
+                span.set(fallback=type(e).__name__)
+                return None
+        self.stats['local'] += 1
+        return result
+
+    def execute_query(self, query, read_only=None, timeout_ms=None):
+        result = self._local('execute_query', query, read_only, timeout_ms)
+        if result is not None:
+            return result
+        self.stats['remote'] += 1
+        return self.database_manager.execute_query(query, read_only=read_only, timeout_ms=timeout_ms)
+
+    def profile_query(self, query, token_budget=400, batch_size=10000, timeout_ms=None):
+        result = self._local('profile_query', query, None, token_budget, batch_size, timeout_ms)
+        if result is not None:
+            return result
+        self.stats['remote'] += 1
+        return self.database_manager.profile_query(
+            query, token_budget=token_budget, batch_size=batch_size, timeout_ms=timeout_ms
+        )
@@ -1,65 +1,269 @@
+import copy
+import threading
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 
-from .llm_interface import LLMInterface
+import openai
+import pandas as pd
+
+from utils.cancellation import CancellationToken, cancellation_scope, current_token
+from utils.plotting import plotting
+from utils.result_profiler import profile_dataframe
+from utils.tracing import Tracer
 from .data_manager import DataManager
+from .llm_interface import LLMInterface
+from .workspace import Workspace
+
+
+class SampleScope:
+    """
+    Stands in for the application as `self` of generated code running on a dataset sample.
+    """
+
+    def __init__(self, data_manager, workspace):
+        self.data_manager = data_manager
+        self.workspace = workspace
 
 
 class SheetChatbotApplication:
-    def __init__(self, df, api_key):
-        self.data_manager = DataManager(df)
-        self.llm_interface = LLMInterface(api_key)
+    def __init__(self, df, api_key, raw_csv=None, workspace=None):
+        """
+        :param df: pd.DataFrame - The dataset, or None when a `workspace` is given.
+        :param api_key: str - OpenAI API key for LLM interactions.
+        :param raw_csv: bytes - The CSV `df` was parsed from, enabling incremental refreshes.
+        :param workspace: Workspace - Several named datasets to chat with at once.
+        """
+        self.tracer = Tracer('sheet_scout')
+        self.api_key = api_key
+        self.workspace = workspace or Workspace()
+        if df is not None:
+            self.workspace.add_dataset('data', df, raw_csv=raw_csv)
+        self.data_manager = self.workspace.primary
+        self.llm_interface = LLMInterface(api_key, tracer=self.tracer)
+        self.profile_token_budget = 400
+        self.approximate = True
+        self.approximate_rows = 2_000_000
+        self._refiner = ThreadPoolExecutor(max_workers=1, thread_name_prefix='refine')
+        self._refinement_token = None
+        # Generated code works on the shared frames and the global pyplot figure, so a
+        # background refinement never runs at the same time as the next question's code
+        self._execution_lock = threading.Lock()
+        self.suggest_followups = True
+
+    def _build_reference_context(self):
+        if len(self.workspace.datasets) > 1:
+            self.llm_interface.multiple_datasets = True
+            return self.workspace.get_reference_context()
+        return self.data_manager.get_dataframe_info()
 
     def initialize_context(self):
-        df_info = self.data_manager.get_dataframe_info()
+        with self.tracer.span('initialize_context') as span:
+            df_info = self._build_reference_context()
+            span.set(
+                rows=sum(len(manager.df) for manager in self.workspace.datasets.values()),
+                bytes=int(sum(manager.df.memory_usage().sum() for manager in self.workspace.datasets.values()))
+            )
         self.llm_interface.reference_context = df_info
+        if self._wants_estimate():
+            # Draw the sample ahead of the first question
+            self._refiner.submit(self.data_manager.stratified_sample)
+
+    def refresh_data(self, raw_csv, name=None):
+        """
+        Refreshes a dataset from a new version of its uploaded CSV, parsing only appended
+        rows when possible. The chat history is kept.
+
+        :param raw_csv: bytes - The new CSV content.
+        :param name: str - Name of the dataset to refresh (defaults to the first one).
+        :return: dict - 'mode' ('unchanged', 'append' or 'reload') and 'new_rows'.
+        """
+        data_manager = self.workspace.datasets[name] if name else self.data_manager
+        with self.tracer.span('refresh_data', bytes=len(raw_csv)) as span:
+            outcome = data_manager.refresh(raw_csv)
+            span.set(rows=outcome['new_rows'], mode=outcome['mode'])
+            self.llm_interface.reference_context = self._build_reference_context()
+        return outcome
+
+    def fork(self):
+        """
+        Returns an application sharing this one's datasets and context, with its own
+        conversation and token usage, so independent questions can be answered concurrently.
+        """
+        forked = copy.copy(self)
+        forked.llm_interface = self.llm_interface.fork()
+        forked._refinement_token = None
+        return forked
+
+    def session_state(self, cache):
+        """
+        Returns what is needed to resume the conversation as JSON-serializable parts, without
+        the API key. Datasets are written to the columnar cache (once per version) and referred
+        to by key.
+
+        :param cache: ColumnarCache - Where the datasets are stored.
+        """
+        return {
+            'config': {'approximate': self.approximate},
+            'datasets': [[name, manager.session_state(cache)] for name, manager in self.workspace.datasets.items()],
+            **self.llm_interface.session_state(),
+        }
+
+    @classmethod
+    def from_session_state(cls, state, cache, api_key):
+        """
+        Resumes a conversation saved with `session_state`, memory-mapping the datasets from
+        the cache instead of parsing and profiling the uploaded files again.
+
+        :param api_key: str - OpenAI API key, which is not saved.
+        """
+        workspace = Workspace()
+        for name, dataset in state['datasets']:
+            workspace.datasets[name] = DataManager.from_session_state(dataset, cache)
+        app = cls(None, api_key, workspace=workspace)
+        app.approximate = state['config'].get('approximate', True)
+        app.llm_interface.load_session_state(state)
+        return app
 
     def get_openai_usage_tokens(self):
         return self.llm_interface.token_usage
 
-    def _execute_generated_code(self, snippet):
+    def get_last_trace(self):
+        """
+        Returns the spans recorded for the most recent request.
+        """
+        return self.tracer.last_trace
+
+    def _execute_generated_code(self, snippet, scope=None):
         """
         Safely executes dynamically generated Python code and returns its output.
         This method limits the execution environment to prevent security risks.
+
+        :param scope: object - What the code sees as `self` (the application by default).
         """
         # Local scope to execute the code safely
-        local_scope = {'self': self}
+        local_scope = {'self': scope or self}
 
         # Execute the code within the local scope
         try:
             snippet = snippet.strip('```python').strip('```')
-            exec(snippet, {}, local_scope)
+            with self._execution_lock, plotting(snippet):
+                exec(snippet, {}, local_scope)
             return local_scope['final_result']
         except Exception as e:
             return {'error': e, 'is_code_generated': False}
 
-    def run_query(self, question):
-        try:
-            # Generate code from LLM
-            code_snippet = self.llm_interface.generate_code(question)
+    def _profile_result(self, code_outcome):
+        """
+        Replaces the complete result of the code by its profile, so the summary is not
+        limited to the first rows.
+        """
+        result_df = code_outcome.pop('result_df', None)
+        if isinstance(result_df, pd.Series):
+            result_df = result_df.to_frame()
+        if isinstance(result_df, pd.DataFrame) and len(result_df) > len(code_outcome.get('top_five_rows') or []):
+            with self.tracer.span('profile_result', rows=len(result_df)):
+                code_outcome['result_profile'] = profile_dataframe(result_df, token_budget=self.profile_token_budget)
+        return code_outcome
+
+    def _wants_estimate(self):
+        return self.approximate and len(self.workspace.datasets) == 1 and len(self.data_manager.df) >= self.approximate_rows
 
-            # Execute code snippet
+    def _estimate(self, code_snippet):
+        """
+        Runs the code on the stratified sample of the dataset. The outcome is only usable when
+        the code aggregated through `aggregate`, whose values are then scaled estimates.
+
+        :return: dict - The outcome, or None to run the code on the full data right away.
+        """
+        with self.tracer.span('stratified_sample'):
+            sample = self.data_manager.stratified_sample()
+        estimates_before = sample.estimates_made
+        with self.tracer.span('execute_code', approximate=True, rows=len(sample.df)) as execute_span:
+            code_outcome = self._execute_generated_code(snippet=code_snippet, scope=SampleScope(sample, self.workspace))
+            execute_span.set(total_rows=code_outcome.get('total_rows'))
+        if code_outcome.get('error') or sample.estimates_made == estimates_before:
+            return None
+        code_outcome['approximate'] = True
+        return code_outcome
+
+    def _refine(self, question, code_snippet, token):
+        """
+        Runs the code on the full dataset in the background and summarizes the exact result.
+        """
+        with cancellation_scope(token):
             code_outcome = self._execute_generated_code(snippet=code_snippet)
             if code_outcome.get('error'):
-                raise code_outcome['error']
+                raise RuntimeError(str(code_outcome['error']))
+            token.check()
+            summary, _ = self.llm_interface.request_interpretation(question, self._profile_result(code_outcome))
+            return {'result': summary, 'file': code_outcome.get('file_path')}
 
-            # Interpret/Summarize Outcome
-            summary = self.llm_interface.interpret_response(question, code_outcome)
+    def run_query(self, question):
+        with self.tracer.span('run_query', question=question[:200]) as span:
+            try:
+                # Generate code from LLM
+                with self.tracer.span('generate_code'):
+                    code_snippet = self.llm_interface.generate_code(question)
 
-            followup_suggestions = []
-            if code_outcome.get('is_code_generated'):
-                followup_suggestions = self.llm_interface.suggest_followup_questions(question=question, response=summary)
+                # Aggregates over very large datasets are answered from a sample first
+                code_outcome = self._estimate(code_snippet) if self._wants_estimate() else None
+                approximate = code_outcome is not None
+                span.set(approximate=approximate)
 
-            return {
-                'result': summary,
-                'file': code_outcome.get('file_path') if code_outcome else None,
-                'follow_up_questions': followup_suggestions
-            }
-        except Exception as e:
-            # print(f"Error: {str(e)}")
-            # traceback.print_exc()
-            return {
-                'result': 'Encountered internal error, please try again.',
-                'file': None,
-                'follow_up_questions': [question],
-                'error': str(e)
-            }
+                # Execute code snippet
+                if not approximate:
+                    with self.tracer.span('execute_code') as execute_span:
+                        code_outcome = self._execute_generated_code(snippet=code_snippet)
+                        execute_span.set(total_rows=code_outcome.get('total_rows'))
+                if code_outcome.get('error'):
+                    raise code_outcome['error']
+                self._profile_result(code_outcome)
+
+                # Interpret/Summarize Outcome
+                with self.tracer.span('interpret_response'):
+                    summary = self.llm_interface.interpret_response(question, code_outcome)
+
+                followup_suggestions = []
+                if code_outcome.get('is_code_generated') and self.suggest_followups:
+                    with self.tracer.span('suggest_followup_questions'):
+                        followup_suggestions = self.llm_interface.suggest_followup_questions(question=question, response=summary)
+
+                response = {
+                    'result': summary,
+                    'file': code_outcome.get('file_path') if code_outcome else None,
+                    'follow_up_questions': followup_suggestions
+                }
+                if approximate:
+                    # A newer estimate supersedes the refinement of an older one
+                    if self._refinement_token is not None:
+                        self._refinement_token.cancel()
+                    self._refinement_token = CancellationToken()
+                    response['approximate'] = True
+                    response['refinement'] = self._refiner.submit(
+                        self._refine, question, code_snippet, self._refinement_token
+                    )
+                return response
+            except Exception as e:
+                # print(f"Error: {str(e)}")
+                # traceback.print_exc()
+                token = current_token()
+                if token is not None and token.cancelled:
+                    span.status = 'cancelled'
+                    return {
+                        'result': 'Stopped.',
+                        'file': None,
+                        'follow_up_questions': [question],
+                        'cancelled': True
+                    }
+                span.status = 'error'
+                span.error = str(e)
+                if isinstance(e, openai.RateLimitError):
+                    message = 'The assistant is handling too many requests right now, please try again in a moment.'
+                else:
+                    message = 'Encountered internal error, please try again.'
+                return {
+                    'result': message,
+                    'file': None,
+                    'follow_up_questions': [question],
+                    'error': str(e)
+                }
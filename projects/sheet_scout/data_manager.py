@@ -1,17 +1,633 @@
+import hashlib
 import io
+import threading
+
+import numpy as np
+import pandas as pd
+
+
+def _same_values(held, current):
+    """
+    Whether two columns are backed by the same arrays (not merely equal values).
+    """
+    held, current = held.array, current.array
+    if held is current:
+        return True
+    # NumPy-backed arrays are wrapped anew on every access
+    held, current = getattr(held, '_ndarray', None), getattr(current, '_ndarray', None)
+    return isinstance(held, np.ndarray) and isinstance(current, np.ndarray) \
+        and held.__array_interface__ == current.__array_interface__
+
+
+class DataState:
+    """
+    What a cached structure was built from: the dataset version, the frame's shape and
+    column names, and the columns the structure reads. Those columns are held, so with
+    copy-on-write pandas copies a column before generated code changes it in place; any
+    change, including `df[column] = ...`, leaves the frame with arrays other than the held ones.
+    """
+
+    def __init__(self, manager, columns=None):
+        """
+        :param manager: DataManager - The dataset.
+        :param columns: list - The columns read (all by default).
+        """
+        df = manager.df
+        self.version = manager.version
+        self.shape = df.shape
+        self.names = list(df.columns)
+        self.columns = [(column, df[column]) for column in (self.names if columns is None else columns)]
+
+    def is_current(self, manager):
+        df = manager.df
+        if manager.version != self.version or df.shape != self.shape or list(df.columns) != self.names:
+            return False
+        return all(_same_values(held, df[column]) for column, held in self.columns)
+
+
+class DatasetProfile:
+    """
+    Per-column profile of the dataset (dtype, non-null count, numeric range) that can be
+    extended with new rows without rescanning the rows already profiled.
+    """
+
+    def __init__(self):
+        self.row_count = 0
+        self.columns = {}
+
+    def update(self, df):
+        """
+        Folds the rows of `df` into the profile.
+        """
+        self.row_count += len(df)
+        for column in df.columns:
+            series = df[column]
+            stats = self.columns.setdefault(column, {'non_null': 0, 'min': None, 'max': None})
+            stats['dtype'] = str(series.dtype)
+            stats['non_null'] += int(series.notna().sum())
+            if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series) and series.notna().any():
+                low, high = series.min(), series.max()
+                stats['min'] = low if stats['min'] is None else min(stats['min'], low)
+                stats['max'] = high if stats['max'] is None else max(stats['max'], high)
+
+    def sync_dtypes(self, df):
+        """
+        Refreshes column dtypes, which may widen when appended rows are concatenated.
+        """
+        for column in df.columns:
+            self.columns[column]['dtype'] = str(df[column].dtype)
+
+    def render(self):
+        """
+        Returns the profile as text in the layout of `DataFrame.info()`, with value ranges.
+        """
+        lines = [
+            f"RangeIndex: {self.row_count} entries, 0 to {max(self.row_count - 1, 0)}",
+            f"Data columns (total {len(self.columns)} columns):",
+            " #   Column  Non-Null Count  Dtype  Range",
+        ]
+        for i, (column, stats) in enumerate(self.columns.items()):
+            value_range = f"{stats['min']} .. {stats['max']}" if stats['min'] is not None else ''
+            lines.append(f" {i:<3} {column}  {stats['non_null']} non-null  {stats['dtype']}  {value_range}".rstrip())
+        return '\n'.join(lines)
+
+    def to_state(self):
+        """
+        Returns the profile as JSON-serializable data.
+        """
+        return {
+            'row_count': self.row_count,
+            'columns': [
+                [column, {name: value.item() if isinstance(value, np.generic) else value for name, value in stats.items()}]
+                for column, stats in self.columns.items()
+            ],
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        profile = cls()
+        profile.row_count = state['row_count']
+        profile.columns = {column: stats for column, stats in state['columns']}
+        return profile
+
+
+class HashIndex:
+    """
+    Positions of every key in a column, grouped by key. The key lookup reuses the hash
+    table cached by the underlying `pd.Index`, so it is built once per dataset version.
+    """
+
+    def __init__(self, values):
+        codes, uniques = pd.factorize(values)
+        order = np.argsort(codes, kind='stable')
+        sorted_codes = codes[order]
+        self.keys = pd.Index(uniques)
+        self.positions = order
+        self.starts = np.searchsorted(sorted_codes, np.arange(len(uniques)), side='left')
+        self.ends = np.searchsorted(sorted_codes, np.arange(len(uniques)), side='right')
+
+    def lookup(self, keys):
+        """
+        Returns `(probe_positions, build_positions)` pairing every probe key with all matching rows.
+        """
+        codes = self.keys.get_indexer(keys)
+        matched = np.flatnonzero(codes >= 0)
+        counts = self.ends[codes[matched]] - self.starts[codes[matched]]
+        probe_positions = np.repeat(matched, counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        build_positions = self.positions[np.repeat(self.starts[codes[matched]], counts) + offsets]
+        return probe_positions, build_positions
+
+    def positions_of(self, keys):
+        """
+        Returns the ascending positions of the rows holding any of the keys.
+        """
+        _, build_positions = self.lookup(pd.unique(np.asarray(keys, dtype=object)))
+        return np.sort(build_positions)
+
+
+class SortedIndex:
+    """
+    Non-null values of a numeric or date column in sorted order with their row positions,
+    so a range is located with two binary searches.
+    """
+
+    def __init__(self, values):
+        valid = np.flatnonzero(~pd.isna(values))
+        order = np.argsort(values[valid], kind='stable')
+        self.values = values[valid][order]
+        self.positions = valid[order]
+
+    def positions_between(self, low=None, high=None, inclusive='both'):
+        """
+        Returns the ascending positions of the rows with `low <= value <= high` (bounds per `inclusive`).
+        """
+        start = 0 if low is None else np.searchsorted(
+            self.values, low, side='left' if inclusive in ('both', 'left') else 'right'
+        )
+        end = len(self.values) if high is None else np.searchsorted(
+            self.values, high, side='right' if inclusive in ('both', 'right') else 'left'
+        )
+        return np.sort(self.positions[start:max(start, end)])
+
+
+class ZoneMap:
+    """
+    Minimum and maximum of a numeric or date column per block of rows. Blocks whose range
+    cannot contain a value are skipped, which pays off when the data is clustered on the
+    column (e.g. rows appended in date order).
+    """
+
+    def __init__(self, values, block_rows=65536):
+        self.values = values
+        self.block_rows = block_rows
+        missing = pd.isna(values)
+        if np.issubdtype(values.dtype, np.datetime64):
+            keys = values.view('int64')
+            low_fill, high_fill = np.iinfo(np.int64).max, np.iinfo(np.int64).min
+        else:
+            keys = values.astype(float)
+            low_fill, high_fill = np.inf, -np.inf
+        blocks = -(-len(values) // block_rows)
+        padding = blocks * block_rows - len(values)
+        lows = np.concatenate([np.where(missing, low_fill, keys), np.full(padding, low_fill, dtype=keys.dtype)])
+        highs = np.concatenate([np.where(missing, high_fill, keys), np.full(padding, high_fill, dtype=keys.dtype)])
+        self.minimums = lows.reshape(blocks, block_rows).min(axis=1)
+        self.maximums = highs.reshape(blocks, block_rows).max(axis=1)
+        self.is_datetime = np.issubdtype(values.dtype, np.datetime64)
+
+    def _key(self, bound):
+        return np.asarray(bound).astype(self.values.dtype).view('int64') if self.is_datetime else float(bound)
+
+    def candidate_blocks(self, low=None, high=None):
+        candidates = np.ones(len(self.minimums), dtype=bool)
+        if low is not None:
+            candidates &= self.maximums >= self._key(low)
+        if high is not None:
+            candidates &= self.minimums <= self._key(high)
+        return np.flatnonzero(candidates)
+
+    def positions_between(self, low=None, high=None, inclusive='both', blocks=None):
+        """
+        Scans only the candidate blocks and returns the ascending positions of matching rows.
+        """
+        blocks = self.candidate_blocks(low, high) if blocks is None else blocks
+        positions = []
+        for block in blocks:
+            start = block * self.block_rows
+            chunk = self.values[start:start + self.block_rows]
+            mask = ~pd.isna(chunk)
+            if low is not None:
+                mask &= (chunk >= low) if inclusive in ('both', 'left') else (chunk > low)
+            if high is not None:
+                mask &= (chunk <= high) if inclusive in ('both', 'right') else (chunk < high)
+            positions.append(np.flatnonzero(mask) + start)
+        return np.concatenate(positions) if positions else np.empty(0, dtype=np.int64)
 
 
 class DataManager:
-    def __init__(self, df):
+    block_size = 1 << 20
+
+    def __init__(self, df, raw_csv=None, profile=None):
+        """
+        :param df: pd.DataFrame - The dataset.
+        :param raw_csv: bytes - The CSV the dataset was parsed from. Required for `refresh`.
+        :param profile: DatasetProfile - The profile of `df` if already known (built otherwise).
+        """
         self.df = df
+        self.version = 0
+        if profile is None:
+            profile = DatasetProfile()
+            profile.update(df)
+        self.profile = profile
+        self._columns = {}
+        self._indexes = {}
+        self._index_lock = threading.RLock()
+        self.sampling = None
+        self.estimates_made = 0
+        self._raw_length = 0
+        self._block_hashes = []
+        if raw_csv is not None:
+            self._remember_raw(raw_csv)
+
+    def _remember_raw(self, raw):
+        self._raw_length = len(raw)
+        self._block_hashes = self._hash_blocks(raw, len(raw))
+        self._ends_with_newline = raw.endswith(b'\n')
+
+    def _hash_blocks(self, raw, length):
+        return [
+            hashlib.blake2b(raw[start:min(start + self.block_size, length)], digest_size=16).digest()
+            for start in range(0, length, self.block_size)
+        ]
+
+    def session_state(self, cache):
+        """
+        Returns the dataset as JSON-serializable data referring to a copy of the frame in a
+        columnar cache. The copy is written once per dataset version.
+
+        :param cache: ColumnarCache - Where the frame is stored.
+        """
+        state = {
+            'dataset': self._cached('session', cache.root, lambda: cache.put(self.df)),
+            'profile': self.profile.to_state(),
+        }
+        if self._block_hashes:
+            state['raw'] = {
+                'length': self._raw_length,
+                'block_hashes': [digest.hex() for digest in self._block_hashes],
+                'ends_with_newline': self._ends_with_newline,
+            }
+        return state
+
+    @classmethod
+    def from_session_state(cls, state, cache):
+        """
+        Restores what `session_state` returned. The frame is memory-mapped from the cache
+        and the profile is not rebuilt, so restoring does not scan the rows.
+        """
+        manager = cls(cache.get(state['dataset']), profile=DatasetProfile.from_state(state['profile']))
+        # The frame is already in the cache under this key
+        manager._indexes[('session', cache.root)] = (DataState(manager), state['dataset'])
+        raw = state.get('raw')
+        if raw:
+            manager._raw_length = raw['length']
+            manager._block_hashes = [bytes.fromhex(digest) for digest in raw['block_hashes']]
+            manager._ends_with_newline = raw['ends_with_newline']
+        return manager
 
     def get_dataframe(self):
         return self.df
 
     def get_dataframe_info(self):
-        buffer = io.StringIO()
-        self.df.info(buf=buffer)
-        return buffer.getvalue()
+        return self.profile.render()
 
     def get_dataframe_head(self, n=3):
         return self.df.head(n).to_string()
+
+    def _cached(self, kind, column, build, reads=None):
+        """
+        Returns an access structure of a column, building it on first use and again only
+        after the data changed, by a refresh or by generated code.
+
+        :param reads: list - The columns the structure is built from (all by default).
+        """
+        # Builds are serialized so a background refinement and a question never build the same structure twice
+        with self._index_lock:
+            cached = self._indexes.get((kind, column))
+            if cached is None or not cached[0].is_current(self):
+                cached = (DataState(self, reads), build())
+                self._indexes[(kind, column)] = cached
+            return cached[1]
+
+    def _range_values(self, column):
+        """
+        The column as a NumPy array that can be compared with range bounds: numbers, or
+        datetimes (parsed once when the CSV left them as text).
+        """
+        series = self.df[column]
+        if pd.api.types.is_bool_dtype(series):
+            raise TypeError(f"Column '{column}' is not numeric or a date.")
+        if pd.api.types.is_numeric_dtype(series):
+            return series.to_numpy(dtype=float, na_value=np.nan)
+        if not pd.api.types.is_datetime64_any_dtype(series):
+            parsed = pd.to_datetime(series, errors='coerce', format='mixed')
+            if parsed.notna().sum() < 0.9 * series.notna().sum() or not parsed.notna().any():
+                raise TypeError(f"Column '{column}' is not numeric or a date.")
+            series = parsed
+        if series.dt.tz is not None:
+            series = series.dt.tz_convert('UTC').dt.tz_localize(None)
+        return series.to_numpy()
+
+    def _values(self, column):
+        return self._cached('values', column, lambda: self._range_values(column), reads=[column])
+
+    def _range_bound(self, values, bound):
+        if bound is None:
+            return None
+        if np.issubdtype(values.dtype, np.datetime64):
+            timestamp = pd.Timestamp(bound)
+            if timestamp.tz is not None:
+                timestamp = timestamp.tz_convert('UTC').tz_localize(None)
+            return timestamp.to_datetime64().astype(values.dtype)
+        return float(bound)
+
+    def hash_index(self, column):
+        return self._cached('hash', column, lambda: HashIndex(self.df[column].to_numpy()), reads=[column])
+
+    def sorted_index(self, column):
+        return self._cached('sorted', column, lambda: SortedIndex(self._values(column)), reads=[column])
+
+    def zone_map(self, column):
+        return self._cached('zones', column, lambda: ZoneMap(self._values(column)), reads=[column])
+
+    def positions_equal(self, column, values):
+        """
+        Positions of the rows whose `column` is one of `values`, from the column's hash index.
+        """
+        if np.ndim(values) == 0 or isinstance(values, str):
+            values = [values]
+        return self.hash_index(column).positions_of(values)
+
+    def positions_between(self, column, low=None, high=None, inclusive='both'):
+        """
+        Positions of the rows whose `column` lies in a range. Zone maps are used when they rule
+        out most blocks (clustered data), the sorted index otherwise.
+        """
+        values = self._values(column)
+        low, high = self._range_bound(values, low), self._range_bound(values, high)
+        zone_map = self.zone_map(column)
+        blocks = zone_map.candidate_blocks(low, high)
+        if len(blocks) <= 0.25 * len(zone_map.minimums):
+            return zone_map.positions_between(low, high, inclusive, blocks=blocks)
+        return self.sorted_index(column).positions_between(low, high, inclusive)
+
+    def find_rows(self, column, values):
+        """
+        Rows whose `column` equals a value (or one of a list of values), in dataset order.
+        Use instead of `df[df[column] == value]` or `df[df[column].isin(values)]`.
+
+        :return: pd.DataFrame - The matching rows.
+        """
+        return self.df.iloc[self.positions_equal(column, values)]
+
+    def find_range(self, column, low=None, high=None, inclusive='both'):
+        """
+        Rows whose numeric or date `column` lies between `low` and `high` (either may be None),
+        in dataset order. Date bounds may be given as strings.
+
+        :param inclusive: str - 'both', 'left', 'right' or 'neither'.
+        :return: pd.DataFrame - The matching rows.
+        """
+        return self.df.iloc[self.positions_between(column, low, high, inclusive)]
+
+    def _positions(self, equals=None, between=None):
+        """
+        Positions of the rows matching all conditions, or None without conditions.
+        """
+        positions = None
+        for column, values in (equals or {}).items():
+            found = self.positions_equal(column, values)
+            positions = found if positions is None else np.intersect1d(positions, found, assume_unique=True)
+        for column, (low, high) in (between or {}).items():
+            found = self.positions_between(column, low, high)
+            positions = found if positions is None else np.intersect1d(positions, found, assume_unique=True)
+        return positions
+
+    def select(self, equals=None, between=None, columns=None):
+        """
+        Rows matching all conditions, intersecting the positions found through the indexes.
+
+        :param equals: dict - Column to a value or a list of accepted values.
+        :param between: dict - Column to a `(low, high)` tuple (either may be None), bounds included.
+        :param columns: list - Columns to return (all by default).
+        :return: pd.DataFrame - The matching rows, in dataset order.
+        """
+        positions = self._positions(equals, between)
+        rows = self.df if positions is None else self.df.iloc[positions]
+        return rows if columns is None else rows[columns]
+
+    def _strata_column(self, max_strata=50, probe_rows=100000):
+        """
+        The categorical column with the most distinct values, up to `max_strata`, or None.
+        """
+        best, best_count = None, 1
+        for column in self.df.columns:
+            series = self.df[column]
+            if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+                continue
+            # A prefix rules out high-cardinality columns before the full column is counted
+            if series.iloc[:probe_rows].nunique(dropna=False) > max_strata:
+                continue
+            count = series.nunique(dropna=False)
+            if best_count < count <= max_strata:
+                best, best_count = column, count
+        return best
+
+    def stratified_sample(self, size=200000, min_per_stratum=200, seed=0):
+        """
+        Returns a stratified random sample of the dataset as a DataManager whose `aggregate`
+        estimates population values with confidence intervals. Strata are the values of the
+        categorical column with the most (at most 50) distinct values, allocated
+        proportionally with a minimum per stratum so that small groups are represented.
+        Built once per dataset version.
+
+        :param size: int - Approximate number of sampled rows.
+        :param min_per_stratum: int - Rows sampled at least from every stratum (or all of its rows).
+        """
+        return self._cached('sample', (size, min_per_stratum, seed), lambda: self._build_sample(size, min_per_stratum, seed))
+
+    def _build_sample(self, size, min_per_stratum, seed):
+        column = self._strata_column()
+        if column is None:
+            codes = np.zeros(len(self.df), dtype=np.int16)
+        else:
+            codes = pd.factorize(self.df[column], use_na_sentinel=False)[0].astype(np.int16)
+        population = np.bincount(codes)
+        sizes = np.minimum(
+            np.maximum(np.round(size * population / max(len(self.df), 1)), min_per_stratum), population
+        ).astype(np.int64)
+        # Small integer codes are sorted with a linear-time radix sort
+        order = np.argsort(codes, kind='stable')
+        starts = np.concatenate([[0], np.cumsum(population)[:-1]])
+        rng = np.random.default_rng(seed)
+        positions = np.sort(np.concatenate([
+            order[start + rng.choice(count, sampled, replace=False)]
+            for start, count, sampled in zip(starts, population, sizes)
+        ]))
+        sample = DataManager(self.df.iloc[positions])
+        sample.sampling = {'column': column, 'strata': codes[positions], 'population': population, 'sizes': sizes}
+        return sample
+
+    def aggregate(self, func, column=None, by=None, equals=None, between=None):
+        """
+        Counts, sums or averages rows, optionally per group and over the rows matching
+        `equals`/`between` (as in `select`). On a stratified sample the values are estimates
+        of the full dataset with 95% confidence intervals.
+
+        :param func: str - 'count', 'sum' or 'mean'.
+        :param column: str - The aggregated column (for 'count', counts its non-empty values).
+        :param by: str|list - Grouping columns.
+        :return: pd.DataFrame - The grouping columns and 'value', plus 'ci_low' and 'ci_high' for estimates.
+        """
+        if func not in ('count', 'sum', 'mean'):
+            raise ValueError("func must be 'count', 'sum' or 'mean'.")
+        if column is None and func != 'count':
+            raise ValueError(f"'{func}' needs a column.")
+        by = [by] if isinstance(by, str) else list(by or [])
+        positions = self._positions(equals, between)
+        rows = self.df if positions is None else self.df.iloc[positions]
+
+        frame = rows[by].reset_index(drop=True) if by else pd.DataFrame(index=range(len(rows)))
+        if column is None:
+            frame['_x'] = 1.0
+            frame['_y'] = 1.0
+        else:
+            if func == 'count':
+                # Only the non-empty values are counted
+                values = rows[column].notna().to_numpy(dtype=float)
+                frame['_x'] = values
+            else:
+                values = pd.to_numeric(rows[column], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+                frame['_x'] = (~np.isnan(values)).astype(float)
+            frame['_y'] = np.nan_to_num(values)
+        keys = by or ['_all']
+        if not by:
+            frame['_all'] = 0
+
+        if self.sampling is None:
+            stats = frame.groupby(keys, dropna=False, observed=True)[['_x', '_y']].sum()
+            value = stats['_x'] if func == 'count' else stats['_y'] if func == 'sum' else stats['_y'] / stats['_x']
+            result = value.rename('value').reset_index()
+            return result.drop(columns=['_all']) if not by else result
+
+        self.estimates_made += 1
+        frame['_yy'] = frame['_y'] ** 2
+        frame['_stratum'] = self.sampling['strata'] if positions is None else self.sampling['strata'][positions]
+        stats = frame.groupby(keys + ['_stratum'], dropna=False, observed=True)[['_x', '_y', '_yy']].sum().reset_index()
+        population = self.sampling['population'][stats['_stratum']].astype(float)
+        sampled = self.sampling['sizes'][stats['_stratum']].astype(float)
+        weight = population / sampled
+        stats['X'] = weight * stats['_x']
+        stats['Y'] = weight * stats['_y']
+        groups = stats.groupby(keys, dropna=False, observed=True)
+        totals = groups[['X', 'Y']].sum()
+
+        # Variance of a stratified total: sum over strata of N^2 (1 - n/N) s^2 / n
+        if func == 'count':
+            first, second = stats['_x'], stats['_x']
+            value = totals['X']
+        elif func == 'sum':
+            first, second = stats['_y'], stats['_yy']
+            value = totals['Y']
+        else:
+            # Ratio estimator, linearized: d = y - R x
+            ratio = (totals['Y'] / totals['X']).rename('_r')
+            r = stats[keys].merge(ratio, left_on=keys, right_index=True, how='left')['_r'].to_numpy()
+            first = stats['_y'] - r * stats['_x']
+            second = stats['_yy'] - 2 * r * stats['_y'] + r ** 2 * stats['_x']
+            value = ratio
+        spread = (second - first ** 2 / sampled) / np.maximum(sampled - 1, 1)
+        stats['_v'] = population ** 2 * (1 - sampled / population) * spread / sampled
+        variance = stats.groupby(keys, dropna=False, observed=True)['_v'].sum()
+        if func == 'mean':
+            variance = variance / totals['X'] ** 2
+        margin = 1.96 * np.sqrt(variance.clip(lower=0))
+        result = pd.DataFrame({'value': value, 'ci_low': value - margin, 'ci_high': value + margin}).reset_index()
+        return result.drop(columns=['_all']) if not by else result
+
+    def get_column(self, column):
+        """
+        Returns a cached NumPy (columnar) copy of a column.
+        """
+        cached = self._columns.get(column)
+        if cached is None or not cached[0].is_current(self):
+            cached = (DataState(self, [column]), self.df[column].to_numpy())
+            self._columns[column] = cached
+        return cached[1]
+
+    def refresh(self, raw_csv):
+        """
+        Updates the dataset from a new version of the same CSV. When the previous content
+        is an unchanged prefix (detected by comparing block hashes), only the appended rows
+        are parsed and the frame, columnar copies and profile are extended; otherwise the
+        file is parsed again from scratch.
+
+        :param raw_csv: bytes - The new CSV content.
+        :return: dict - 'mode' ('unchanged', 'append' or 'reload') and 'new_rows'.
+        """
+        if not self._block_hashes or len(raw_csv) < self._raw_length \
+                or self._hash_blocks(raw_csv, self._raw_length) != self._block_hashes:
+            self._reload(raw_csv)
+            return {'mode': 'reload', 'new_rows': len(self.df)}
+
+        tail = raw_csv[self._raw_length:]
+        if not self._ends_with_newline:
+            # The last previously parsed row only gains its line terminator
+            if not tail.startswith((b'\n', b'\r\n')):
+                self._reload(raw_csv)
+                return {'mode': 'reload', 'new_rows': len(self.df)}
+            tail = tail.split(b'\n', 1)[1] if b'\n' in tail else b''
+
+        if not tail.strip():
+            self._remember_raw(raw_csv)
+            return {'mode': 'unchanged', 'new_rows': 0}
+
+        new_rows = self._parse_rows(tail)
+        self._append(new_rows)
+        self._remember_raw(raw_csv)
+        return {'mode': 'append', 'new_rows': len(new_rows)}
+
+    def _parse_rows(self, tail):
+        """
+        Parses header-less CSV rows using the existing columns and, where possible, dtypes.
+        """
+        dtypes = {
+            column: dtype for column, dtype in self.df.dtypes.items()
+            if pd.api.types.is_numeric_dtype(dtype) or pd.api.types.is_bool_dtype(dtype)
+        }
+        try:
+            return pd.read_csv(io.BytesIO(tail), header=None, names=list(self.df.columns), dtype=dtypes)
+        except (ValueError, TypeError):
+            # New rows widen a column (e.g. missing values in an integer column)
+            return pd.read_csv(io.BytesIO(tail), header=None, names=list(self.df.columns))
+
+    def _append(self, new_rows):
+        self.df = pd.concat([self.df, new_rows], ignore_index=True)
+        self.version += 1
+        for column, (_, values) in list(self._columns.items()):
+            extended = np.concatenate([values, new_rows[column].to_numpy()])
+            if extended.dtype != self.df[column].dtype:
+                extended = self.df[column].to_numpy()
+            self._columns[column] = (DataState(self, [column]), extended)
+        self.profile.update(new_rows)
+        self.profile.sync_dtypes(self.df)
+
+    def _reload(self, raw_csv):
+        self.df = pd.read_csv(io.BytesIO(raw_csv))
+        self.version += 1
+        self.profile = DatasetProfile()
+        self.profile.update(self.df)
+        self._columns = {}
+        self._indexes = {}
+        self._remember_raw(raw_csv)
@@ -1,17 +1,76 @@
+import copy
+
 from openai import OpenAI, AuthenticationError
 
+from utils.cancellation import current_token
+from utils.conversation_memory import ConversationMemory, extract_dataframe_entities
+from utils.llm_dispatcher import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, current_stream, get_dispatcher
+
 
 class LLMInterface:
-    def __init__(self, api_key):
+    def __init__(self, api_key, tracer=None):
         self.client = OpenAI(api_key=api_key)
-        self.chat_summary_history = []
+        self.tracer = tracer
+        self.chat_summary_history = ConversationMemory(
+            summarizer=self._condense_history,
+            window=6,
+            entity_extractor=extract_dataframe_entities
+        )
+        self._last_code = None
         self.reference_context = None
+        self.multiple_datasets = False
+        # Where generated code saves its files
+        self.output_dir = '/tmp'
         self.token_usage = {
             'completion_tokens': 0,
             'prompt_tokens': 0,
             'total_tokens': 0
         }
 
+    def fork(self):
+        """
+        Returns an interface sharing this one's client and reference context, with an empty
+        conversation and its own token usage, to answer an independent question alongside others.
+        """
+        forked = copy.copy(self)
+        forked.chat_summary_history = ConversationMemory(
+            summarizer=forked._condense_history,
+            window=self.chat_summary_history.window,
+            entity_extractor=extract_dataframe_entities
+        )
+        forked._last_code = None
+        forked.token_usage = dict.fromkeys(self.token_usage, 0)
+        return forked
+
+    def session_state(self):
+        """
+        Returns the reference context and the conversation as JSON-serializable parts, so the
+        large, rarely changing context is saved apart from the conversation growing every turn.
+        """
+        return {
+            'context': {
+                'reference_context': self.reference_context,
+                'multiple_datasets': self.multiple_datasets,
+            },
+            'conversation': {
+                'memory': self.chat_summary_history.to_state(),
+                'token_usage': dict(self.token_usage),
+                'last_code': self._last_code,
+            },
+        }
+
+    def load_session_state(self, state):
+        """
+        Restores what `session_state` returned, without profiling the datasets again.
+        """
+        context = state.get('context', {})
+        self.reference_context = context.get('reference_context')
+        self.multiple_datasets = context.get('multiple_datasets', False)
+        conversation = state.get('conversation', {})
+        self.chat_summary_history.load_state(conversation.get('memory', {}))
+        self.token_usage.update(conversation.get('token_usage', {}))
+        self._last_code = conversation.get('last_code')
+
     def _update_token_usage(self, usage_data):
         """
         Updates the internal token usage counters based on the usage data from a completion.
@@ -19,6 +78,28 @@ class LLMInterface:
         self.token_usage['completion_tokens'] += usage_data.completion_tokens
         self.token_usage['prompt_tokens'] += usage_data.prompt_tokens
         self.token_usage['total_tokens'] += usage_data.total_tokens
+        if self.tracer is not None:
+            self.tracer.count(
+                completion_tokens=usage_data.completion_tokens,
+                prompt_tokens=usage_data.prompt_tokens,
+                total_tokens=usage_data.total_tokens
+            )
+
+    def _create_chat_completion(self, priority=PRIORITY_INTERACTIVE, on_delta=None, **kwargs):
+        """
+        Sends a chat completion through the process-wide dispatcher, which applies the
+        shared rate limits, retries and coalescing of identical in-flight requests.
+        Within a cancellation scope the completion is streamed and aborted on cancellation.
+
+        :param on_delta: callable - Receives the text of the completion as it is generated.
+        """
+        future = get_dispatcher().submit(
+            self.client.chat.completions.create, priority=priority, cancel_token=current_token(), on_delta=on_delta, **kwargs
+        )
+        response = future.result()
+        if self.tracer is not None:
+            self.tracer.count(queue_wait_ms=round(future.queue_wait_ms, 3))
+        return response
 
     def verify_api_key(self):
         """
@@ -45,6 +126,14 @@ class LLMInterface:
         if not self.reference_context:
             raise AttributeError("Dataframe context was not set.")
 
+        workspace_guidelines = ''
+        if self.multiple_datasets:
+            workspace_guidelines = """
+**Multiple Datasets:**
+- Several datasets are loaded and `self.data_manager.df` is only the first one. Access any dataset with `self.workspace.get('<name>')` using the dataset names given above; its indexed helpers are on `self.workspace.datasets['<name>']`.
+- To combine datasets, use `self.workspace.join('<left name>', '<right name>', left_on='<column>', right_on='<column>', how='inner')` (or `how='left'`) instead of `pd.merge`, preferring the likely join keys listed.
+"""
+
         system_prompt = f"""
 You are 'Assistant 1', responsible for generating Python code snippets based on user queries regarding an uploaded CSV file, preloaded as a pandas DataFrame (`self.data_manager.df`). Information about the dataset is detailed in: {self.reference_context}.
 
@@ -52,12 +141,20 @@ You are 'Assistant 1', responsible for generating Python code snippets based on
 - Utilize the preloaded `self.data_manager.df` (not `df`) to perform data fetches and manipulations as specified by the user's query.
 - Limit result rows to 5 unless the user requests more.
 - Select only the necessary columns to prevent errors from accessing non-existent fields.
-- Ensure that visualizations required by the question are generated and stored in the '/tmp' directory, not displayed.
+- Ensure that visualizations required by the question are generated and stored in the '{self.output_dir}' directory, not displayed.
 - Include necessary import statements for libraries such as pandas, matplotlib, and os.
 - Be extremely creative in handling data when specific datapoints are unavailable; indicate uncertainty by using 'probably' in the 'summary_message'.
 - Avoid making assumptions about dynamic data like current date or weather conditions which constantly changes.
 - Always generate the code for 'final_result' without any assumptions and prefilling.
 
+**Fast Filtering:**
+- Filter rows with the indexed helpers of `self.data_manager` instead of boolean masks over the whole DataFrame; they return the matching rows as a DataFrame, in dataset order:
+  - `find_rows('<column>', value)` or `find_rows('<column>', [value, ...])` for equality and membership filters.
+  - `find_range('<column>', low, high)` for numeric or date ranges (either bound may be None, dates may be strings like '2024-01-31'; `inclusive='both'|'left'|'right'|'neither'`).
+  - `select(equals={{'<column>': value}}, between={{'<column>': (low, high)}}, columns=[...])` to combine several such conditions.
+- Apply any remaining conditions with pandas on the (smaller) result.
+- Compute counts, sums and averages with `self.data_manager.aggregate('count'|'sum'|'mean', column=None, by=None, equals=None, between=None)` (conditions as in `select`). It returns a DataFrame of the `by` columns and 'value', plus 'ci_low' and 'ci_high' when the answer is estimated from a sample of a very large dataset; keep these columns in 'top_five_rows'.
+{workspace_guidelines}
 **Expected Output:**
 Generate a clean, executable Python code snippet that:
 - Performs DataFrame operations and manages file generation according to user queries.
@@ -67,6 +164,7 @@ Generate a clean, executable Python code snippet that:
   - 'file_path': Dynamically set to the path of the generated files with no assumptions, if applicable.
   - 'summary_message': A message summarizing the outcome, formatted with f-strings.
   - 'is_code_generated': A boolean indicating whether the query resulted in any DataFrame operations.
+  - 'result_df': The complete result DataFrame before limiting it to five rows (None when there is no tabular result). It is profiled for the summary, so never truncate it.
 
 **Handling Query Outcomes:**
 - For irrelevant queries: Set 'total_rows' to zero and 'top_five_rows' to empty list, 'file_path' to None, 'summary_message' to 'Question not relevant to the dataset.' or 'Datapoints not avaiable.', and 'is_code_generated' to False stored in 'final_result' variable.
@@ -83,8 +181,8 @@ Generate a clean, executable Python code snippet that:
             {"role": "system", "content": system_prompt},
         ]
         user_prompt = f"Question:\n{question}\n"
-        messages = dialogues + self.chat_summary_history[-6:] + [{"role": "user", "content": user_prompt}]
-        response = self.client.chat.completions.create(
+        messages = dialogues + self.chat_summary_history.to_messages() + [{"role": "user", "content": user_prompt}]
+        response = self._create_chat_completion(
             model="gpt-3.5-turbo",
             messages=messages,
             temperature=0,
@@ -92,9 +190,24 @@ Generate a clean, executable Python code snippet that:
         )
         response_content = response.choices[0].message.content.strip()
         self._update_token_usage(response.usage)
+        self._last_code = response_content
         return response_content
 
     def interpret_response(self, question, results):
+        """
+        Summarizes a code outcome and records the turn in the conversation memory.
+        """
+        response_content, _ = self.request_interpretation(question, results)
+        if results['is_code_generated']:
+            self.chat_summary_history.add_turn(question, response_content, code=self._last_code)
+        return response_content
+
+    def request_interpretation(self, question, results):
+        """
+        Summarizes a code outcome without recording the turn.
+
+        :return: tuple - The summary and the completion's token usage.
+        """
         if not self.reference_context:
             raise AttributeError("Dataframe context was not set.")
 
@@ -107,8 +220,11 @@ Generate a clean, executable Python code snippet that:
         - 'file_path': The location of any file that was generated during the process, if applicable.
         - 'summary_message': Contains a concise message crafted by the previous assistant, detailing the results.
         - 'is_code_generated': Confirms whether any DataFrame operations were executed/generated.
+        - 'result_profile': If present, a profile of the complete result (aggregates, quantiles, top values and trends per column); prefer it over 'top_five_rows' for statements about the whole result.
+        - 'approximate': If True, the figures are estimates computed from a sample of the data; rows with 'ci_low' and 'ci_high' give their 95% confidence intervals.
         
         Your summary should:
+        - When 'approximate' is True, clearly mark every figure as an estimate (e.g. 'about 1.2M, likely between 1.18M and 1.22M') and mention that the exact answer follows shortly.
         - Provide a clear statistical overview based on 'total_rows'.
         - Always list 'top_five_rows' when available and highlight any significant data trends or anomalies found.
         - Ensure not to mention 'file_path' and it's value, instead you can advice to download the file.  
@@ -125,21 +241,43 @@ Generate a clean, executable Python code snippet that:
             {'role': 'assistant', 'content': 'Hello! How can I assist you?'},
         ]
         messages = dialogues + [{'role': 'user', 'content': f"""User Question:\n{question}\nOutcome:\n{results}"""}]
-        response = self.client.chat.completions.create(
+        response = self._create_chat_completion(
+            on_delta=current_stream(),
             model="gpt-3.5-turbo",
             messages=messages,
             temperature=0.32,
         )
         response_content = response.choices[0].message.content.strip()
-        if results['is_code_generated']:
-            self.chat_summary_history.append(
-                {"role": "user", "content": f"User Question:\n{question}"}
-            )
-            self.chat_summary_history.append(
-                {"role": "assistant", "content": f"Assistant 2:\n{response_content}"}
-            )
         self._update_token_usage(response.usage)
-        return response_content
+        return response_content, response.usage
+
+    def _condense_history(self, previous_summary, messages):
+        """
+        Condenses older chat turns into a compact summary for the conversation memory.
+
+        :param previous_summary: str - The summary produced for even older turns, if any.
+        :param messages: list - The chat messages to fold into the summary.
+        :return: str - The updated summary.
+        """
+        system_prompt = """
+        You maintain the memory of a conversation between a user and a spreadsheet assistant.
+        Merge the previous summary and the new turns into one compact summary of at most 120 words.
+        Keep the questions asked, the key figures answered, and the columns and filter values they resolved to.
+        Do not add anything that is not in the turns.
+        """
+        turns = '\n'.join(message['content'] for message in messages)
+        response = self._create_chat_completion(
+            priority=PRIORITY_BACKGROUND,
+            model="gpt-3.5-turbo",
+            messages=[
+                {'role': 'system', 'content': system_prompt},
+                {'role': 'user', 'content': f"Previous summary:\n{previous_summary or 'None'}\n\nNew turns:\n{turns}"}
+            ],
+            temperature=0,
+            max_tokens=200
+        )
+        self._update_token_usage(response.usage)
+        return response.choices[0].message.content.strip()
 
     def suggest_followup_questions(self, question: str, response: str) -> list:
         """
@@ -181,7 +319,8 @@ Generate a clean, executable Python code snippet that:
             {"role": "assistant", "content": f"Assistant 2 response:\n{response}\n"},
         ]
 
-        response = self.client.chat.completions.create(
+        response = self._create_chat_completion(
+            priority=PRIORITY_BACKGROUND,
             model="gpt-3.5-turbo",
             messages=messages,
             n=1
@@ -0,0 +1,179 @@
+import io
+import os
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from .data_manager import DataManager, DataState
+
+
+class ValueSketch:
+    """
+    K-minimum-values sketch of a column's distinct values, used to estimate how much two
+    columns overlap without comparing them in full.
+    """
+
+    def __init__(self, values, k=256):
+        distinct = pd.unique(pd.Series(values).dropna().astype(str))
+        hashes = np.unique(pd.util.hash_array(np.asarray(distinct, dtype=object)))
+        self.k = k
+        self.distinct_count = len(distinct)
+        self.minimums = hashes[:k]
+
+    def containment(self, other):
+        """
+        Estimated fraction of the smaller column's distinct values found in the other column.
+        """
+        if not len(self.minimums) or not len(other.minimums):
+            return 0.0
+        union = np.union1d(self.minimums, other.minimums)[:self.k]
+        shared = np.intersect1d(np.intersect1d(self.minimums, other.minimums), union)
+        jaccard = len(shared) / len(union)
+        smaller = min(self.distinct_count, other.distinct_count)
+        intersection = jaccard * (self.distinct_count + other.distinct_count) / (1 + jaccard)
+        return min(1.0, intersection / smaller)
+
+
+class Workspace:
+    """
+    Named datasets (CSV files and XLSX sheets) available to Sheet Scout in one session,
+    with join-key detection and joins using the datasets' cached hash indexes.
+    """
+
+    def __init__(self):
+        self.datasets = OrderedDict()
+        self._sketches = {}
+
+    @property
+    def primary(self):
+        """
+        The first dataset added, exposed as `self.data_manager` to generated code.
+        """
+        return next(iter(self.datasets.values()))
+
+    def add_dataset(self, name, df, raw_csv=None):
+        self.datasets[name] = DataManager(df, raw_csv=raw_csv)
+        return self.datasets[name]
+
+    def load_file(self, file_name, raw):
+        """
+        Adds the datasets in an uploaded file: one for a CSV, one per sheet for an XLSX.
+
+        :return: list - Names of the datasets added.
+        """
+        base_name = os.path.splitext(os.path.basename(file_name))[0]
+        if file_name.lower().endswith(('.xlsx', '.xls')):
+            sheets = pd.read_excel(io.BytesIO(raw), sheet_name=None)
+            names = []
+            for sheet_name, df in sheets.items():
+                name = base_name if len(sheets) == 1 else f'{base_name}:{sheet_name}'
+                self.add_dataset(name, df)
+                names.append(name)
+            return names
+        self.add_dataset(base_name, pd.read_csv(io.BytesIO(raw)), raw_csv=raw)
+        return [base_name]
+
+    def get(self, name):
+        """
+        Returns the DataFrame of a dataset.
+        """
+        return self.datasets[name].df
+
+    def _sketch(self, name, column):
+        manager = self.datasets[name]
+        key = (name, column)
+        cached = self._sketches.get(key)
+        if cached is None or not cached[0].is_current(manager):
+            cached = (DataState(manager, [column]), ValueSketch(manager.df[column]))
+            self._sketches[key] = cached
+        return cached[1]
+
+    def _candidate_key_columns(self, name):
+        df = self.datasets[name].df
+        columns = []
+        for column in df.columns:
+            dtype = df[column].dtype
+            if pd.api.types.is_float_dtype(dtype) or pd.api.types.is_bool_dtype(dtype):
+                continue
+            if pd.api.types.is_datetime64_any_dtype(dtype):
+                continue
+            columns.append(column)
+        return columns
+
+    def detect_join_keys(self, min_containment=0.6, min_distinct=2):
+        """
+        Finds column pairs across datasets whose values overlap enough to be join keys.
+
+        :return: list - Tuples `(left, left_column, right, right_column, containment)`, best first.
+        """
+        names = list(self.datasets)
+        candidates = []
+        for i, left in enumerate(names):
+            for right in names[i + 1:]:
+                for left_column in self._candidate_key_columns(left):
+                    left_sketch = self._sketch(left, left_column)
+                    if left_sketch.distinct_count < min_distinct:
+                        continue
+                    for right_column in self._candidate_key_columns(right):
+                        right_sketch = self._sketch(right, right_column)
+                        if right_sketch.distinct_count < min_distinct:
+                            continue
+                        containment = left_sketch.containment(right_sketch)
+                        if containment >= min_containment:
+                            candidates.append((left, left_column, right, right_column, round(containment, 2)))
+        return sorted(candidates, key=lambda candidate: -candidate[4])
+
+    def get_index(self, name, column):
+        """
+        Returns the cached hash index of a dataset column, rebuilt only when the data changes.
+        """
+        return self.datasets[name].hash_index(column)
+
+    def join(self, left, right, left_on, right_on=None, how='inner', suffixes=('', '_right')):
+        """
+        Joins two datasets on a key using the cached hash index of the right dataset.
+
+        :param left: str - Name of the left dataset.
+        :param right: str - Name of the right dataset.
+        :param left_on: str - Key column of the left dataset.
+        :param right_on: str - Key column of the right dataset (defaults to `left_on`).
+        :param how: str - 'inner' or 'left'.
+        :return: pd.DataFrame - The joined rows.
+        """
+        right_on = right_on or left_on
+        left_df, right_df = self.get(left), self.get(right)
+        probe_positions, build_positions = self.get_index(right, right_on).lookup(left_df[left_on].to_numpy())
+
+        joined_left = left_df.iloc[probe_positions].reset_index(drop=True)
+        joined_right = right_df.iloc[build_positions].reset_index(drop=True)
+        if how == 'left':
+            unmatched = np.setdiff1d(np.arange(len(left_df)), probe_positions)
+            joined_left = pd.concat([joined_left, left_df.iloc[unmatched].reset_index(drop=True)], ignore_index=True)
+            joined_right = joined_right.reindex(range(len(joined_left)))
+        elif how != 'inner':
+            raise ValueError(f"Unsupported join type '{how}'.")
+
+        if right_on == left_on:
+            joined_right = joined_right.drop(columns=[right_on])
+        overlapping = set(joined_left.columns) & set(joined_right.columns)
+        joined_left = joined_left.rename(columns={c: f'{c}{suffixes[0]}' for c in overlapping})
+        joined_right = joined_right.rename(columns={c: f'{c}{suffixes[1]}' for c in overlapping})
+        return pd.concat([joined_left, joined_right], axis=1)
+
+    def get_reference_context(self):
+        """
+        Returns the combined description of all datasets and their likely join keys.
+        """
+        sections = [
+            f"Dataset '{name}' (`self.workspace.get('{name}')`):\n{manager.get_dataframe_info()}"
+            for name, manager in self.datasets.items()
+        ]
+        if len(self.datasets) > 1:
+            join_keys = self.detect_join_keys()
+            if join_keys:
+                sections.append('Likely join keys:\n' + '\n'.join(
+                    f"- '{left}'.{left_column} <-> '{right}'.{right_column} (value overlap {containment:.0%})"
+                    for left, left_column, right, right_column, containment in join_keys
+                ))
+        return '\n\n'.join(sections)
@@ -0,0 +1,40 @@
+import re
+
+
+TOKEN_PATTERN = re.compile(r'\w+|[^\w\s]', re.UNICODE)
+
+
+def count_tokens(text):
+    """
+    Approximate token count (words and punctuation marks) used for chunk sizing.
+    """
+    return len(TOKEN_PATTERN.findall(text))
+
+
+class TextChunker:
+    """
+    Splits text into chunks of at most `chunk_tokens` tokens, with consecutive chunks
+    sharing `overlap_tokens` tokens so passages cut at a boundary stay searchable.
+    """
+
+    def __init__(self, chunk_tokens=400, overlap_tokens=50):
+        if overlap_tokens >= chunk_tokens:
+            raise ValueError("Overlap must be smaller than the chunk size.")
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+
+    def chunk(self, text):
+        """
+        :param text: str - The text to split.
+        :return: list - Dicts with 'text', 'start' and 'end' (character offsets) and 'tokens'.
+        """
+        spans = [match.span() for match in TOKEN_PATTERN.finditer(text)]
+        chunks = []
+        step = self.chunk_tokens - self.overlap_tokens
+        for first in range(0, len(spans), step):
+            window = spans[first:first + self.chunk_tokens]
+            start, end = window[0][0], window[-1][1]
+            chunks.append({'text': text[start:end], 'start': start, 'end': end, 'tokens': len(window)})
+            if first + self.chunk_tokens >= len(spans):
+                break
+        return chunks
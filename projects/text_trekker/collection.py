@@ -0,0 +1,404 @@
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+
+import numpy as np
+
+from .inverted_index import InvertedIndex, tokenize
+from .vector_store import VectorStore
+
+
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS segments (
+    segment_id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    row_count INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS documents (
+    doc_id TEXT PRIMARY KEY,
+    name TEXT,
+    path TEXT,
+    chunk_count INTEGER NOT NULL,
+    added_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chunk_ranges (
+    doc_id TEXT NOT NULL,
+    segment_id TEXT NOT NULL,
+    row_start INTEGER NOT NULL,
+    row_end INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chunk_ranges_segment ON chunk_ranges (segment_id, row_start);
+CREATE INDEX IF NOT EXISTS chunk_ranges_document ON chunk_ranges (doc_id);
+CREATE TABLE IF NOT EXISTS tombstones (
+    segment_id TEXT NOT NULL,
+    row_start INTEGER NOT NULL,
+    row_end INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    segment_id TEXT NOT NULL,
+    row INTEGER NOT NULL,
+    chunk_id TEXT NOT NULL,
+    page INTEGER,
+    text TEXT NOT NULL,
+    PRIMARY KEY (segment_id, row)
+);
+"""
+
+
+class Collection:
+    """
+    Segment-based document collection for Text Trekker.
+
+    New documents are appended to a small write segment, which is sealed once it reaches
+    `segment_rows`. Deleting a document only tombstones its rows; a background compaction
+    merges small sealed segments and drops tombstoned rows. Searches fan out over all
+    segments and merge their top-k results. Documents, their chunk row ranges and chunk
+    texts live in an SQLite catalog, so listing and filtering never touch the vectors.
+    Each segment also has an inverted index for BM25 keyword search, saved when sealed.
+    """
+
+    def __init__(self, path, dim, dtype='float32', segment_rows=5000, compaction_rows=50000,
+                 ivf_threshold=50000):
+        """
+        :param path: str - Directory of the collection.
+        :param dim: int - Embedding dimension.
+        :param dtype: str - Vector storage type, 'float32' or 'int8'.
+        :param segment_rows: int - Rows after which the write segment is sealed.
+        :param compaction_rows: int - Sealed segments smaller than this are merged by compaction.
+        :param ivf_threshold: int - Segments at least this large get an IVF index when sealed.
+        """
+        self.path = path
+        self.dim = dim
+        self.dtype = dtype
+        self.segment_rows = segment_rows
+        self.compaction_rows = compaction_rows
+        self.ivf_threshold = ivf_threshold
+        os.makedirs(os.path.join(path, 'segments'), exist_ok=True)
+        self._lock = threading.RLock()
+        self._catalog = sqlite3.connect(os.path.join(path, 'catalog.sqlite3'), check_same_thread=False)
+        self._catalog.executescript(CATALOG_SCHEMA)
+        self._stores = {}
+        self._keyword_indexes = {}
+        self._tombstones = {}
+        self._compaction = None
+        self._load_tombstones()
+
+    def _store(self, segment_id):
+        if segment_id not in self._stores:
+            self._stores[segment_id] = VectorStore(os.path.join(self.path, 'segments', segment_id), self.dim, self.dtype)
+        return self._stores[segment_id]
+
+    def _keyword_index(self, segment_id):
+        index = self._keyword_indexes.get(segment_id)
+        if index is None:
+            index = InvertedIndex.load(os.path.join(self.path, 'segments', segment_id, 'keywords'))
+            if index is None:
+                rows = self._catalog.execute("SELECT row, text FROM chunks WHERE segment_id = ?", (segment_id,)).fetchall()
+                index = InvertedIndex()
+                index.add([row for row, _ in rows], [text for _, text in rows])
+            self._keyword_indexes[segment_id] = index
+        return index
+
+    def _segments(self, states=('active', 'sealed')):
+        placeholders = ','.join('?' * len(states))
+        rows = self._catalog.execute(
+            f"SELECT segment_id, state, row_count FROM segments WHERE state IN ({placeholders}) ORDER BY created_at",
+            states
+        ).fetchall()
+        return rows
+
+    def _load_tombstones(self):
+        self._tombstones = {}
+        rows = self._catalog.execute("SELECT segment_id, row_start, row_end FROM tombstones").fetchall()
+        for segment_id, row_start, row_end in rows:
+            self._tombstone(segment_id, row_start, row_end)
+
+    def _tombstone(self, segment_id, row_start, row_end):
+        rows = self._tombstones.get(segment_id, np.empty(0, dtype=np.int64))
+        self._tombstones[segment_id] = np.union1d(rows, np.arange(row_start, row_end))
+
+    def _write_segment(self):
+        active = self._segments(states=('active',))
+        if active:
+            return active[0][0]
+        segment_id = uuid.uuid4().hex[:12]
+        with self._catalog:
+            self._catalog.execute(
+                "INSERT INTO segments (segment_id, state, row_count, created_at) VALUES (?, 'active', 0, ?)",
+                (segment_id, time.time())
+            )
+        return segment_id
+
+    def add_document(self, doc_id, chunks, vectors, name=None, path=None):
+        """
+        Adds (or replaces) a document.
+
+        :param doc_id: str - Document id.
+        :param chunks: list - Chunk dicts with 'chunk_id', 'text' and optionally 'page'.
+        :param vectors: np.ndarray - One embedding per chunk.
+        """
+        with self._lock:
+            if self._catalog.execute("SELECT 1 FROM documents WHERE doc_id = ?", (doc_id,)).fetchone():
+                self.delete_document(doc_id)
+            segment_id = self._write_segment()
+            store = self._store(segment_id)
+            ids = store.add(vectors) if len(chunks) else np.empty(0, dtype=np.int64)
+            row_start = int(ids[0]) if len(ids) else store.count
+            with self._catalog:
+                self._catalog.execute(
+                    "INSERT INTO documents (doc_id, name, path, chunk_count, added_at) VALUES (?, ?, ?, ?, ?)",
+                    (doc_id, name, path, len(chunks), time.time())
+                )
+                self._catalog.execute(
+                    "INSERT INTO chunk_ranges (doc_id, segment_id, row_start, row_end) VALUES (?, ?, ?, ?)",
+                    (doc_id, segment_id, row_start, row_start + len(chunks))
+                )
+                self._catalog.executemany(
+                    "INSERT INTO chunks (segment_id, row, chunk_id, page, text) VALUES (?, ?, ?, ?, ?)",
+                    [(segment_id, int(row), chunk['chunk_id'], chunk.get('page'), chunk['text'])
+                     for row, chunk in zip(ids, chunks)]
+                )
+                self._catalog.execute("UPDATE segments SET row_count = ? WHERE segment_id = ?", (store.count, segment_id))
+            if segment_id in self._keyword_indexes:
+                self._keyword_indexes[segment_id].add(ids, [chunk['text'] for chunk in chunks])
+            if store.count >= self.segment_rows:
+                self._seal(segment_id)
+
+    def _seal(self, segment_id):
+        store = self._store(segment_id)
+        if store.count >= self.ivf_threshold:
+            store.build_ivf()
+        self._keyword_index(segment_id).save(os.path.join(self.path, 'segments', segment_id, 'keywords'))
+        with self._catalog:
+            self._catalog.execute("UPDATE segments SET state = 'sealed' WHERE segment_id = ?", (segment_id,))
+        self.compact_async()
+
+    def delete_document(self, doc_id):
+        """
+        Tombstones a document's chunks; the space is reclaimed by the next compaction.
+        """
+        with self._lock:
+            ranges = self._catalog.execute(
+                "SELECT segment_id, row_start, row_end FROM chunk_ranges WHERE doc_id = ?", (doc_id,)
+            ).fetchall()
+            with self._catalog:
+                self._catalog.executemany(
+                    "INSERT INTO tombstones (segment_id, row_start, row_end) VALUES (?, ?, ?)", ranges
+                )
+                self._catalog.execute("DELETE FROM chunk_ranges WHERE doc_id = ?", (doc_id,))
+                self._catalog.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+            for segment_id, row_start, row_end in ranges:
+                self._tombstone(segment_id, row_start, row_end)
+
+    def list_documents(self, name_contains=None):
+        """
+        Lists live documents from the catalog.
+        """
+        query = "SELECT doc_id, name, path, chunk_count, added_at FROM documents"
+        params = ()
+        if name_contains:
+            query += " WHERE name LIKE ?"
+            params = (f'%{name_contains}%',)
+        columns = ('doc_id', 'name', 'path', 'chunk_count', 'added_at')
+        # The catalog connection is shared, reads must not interleave with a write transaction
+        with self._lock:
+            rows = self._catalog.execute(query + " ORDER BY added_at", params).fetchall()
+        return [dict(zip(columns, row)) for row in rows]
+
+    def _allowed_rows(self, segment_id, doc_ids):
+        with self._lock:
+            ranges = self._catalog.execute(
+                f"SELECT row_start, row_end FROM chunk_ranges WHERE segment_id = ? AND doc_id IN ({','.join('?' * len(doc_ids))})",
+                (segment_id, *doc_ids)
+            ).fetchall()
+        if not ranges:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([np.arange(start, end) for start, end in ranges])
+
+    def search(self, query_vector, k=10, doc_ids=None, nprobe=8):
+        """
+        Searches all segments and merges their top-k results.
+
+        :param query_vector: np.ndarray - The query embedding.
+        :param k: int - Number of results.
+        :param doc_ids: list - Optionally restricts the search to these documents.
+        :return: list - Dicts with 'score', 'doc_id', 'chunk_id', 'page' and 'text', best first.
+        """
+        with self._lock:
+            stores = [(segment_id, self._store(segment_id)) for segment_id, _, _ in self._segments()]
+            tombstones = dict(self._tombstones)
+        hits = []
+        for segment_id, store in stores:
+            try:
+                hits += self._search_segment(segment_id, store, query_vector, k, doc_ids, tombstones, nprobe)
+            except FileNotFoundError:
+                # Segment retired by a concurrent compaction; its rows live on in the merged one
+                continue
+
+        hits.sort(key=lambda hit: -hit[0])
+        return self._describe(hits[:k])
+
+    def _search_segment(self, segment_id, store, query_vector, k, doc_ids, tombstones, nprobe):
+        if not len(store):
+            return []
+        if doc_ids is not None:
+            allowed = np.setdiff1d(self._allowed_rows(segment_id, doc_ids), tombstones.get(segment_id, []))
+            if not len(allowed):
+                return []
+            scores = store.get_vectors(allowed) @ np.asarray(query_vector, dtype=np.float32).ravel()
+            scores /= max(np.linalg.norm(query_vector), 1e-12)
+            best = np.argsort(-scores)[:k]
+            return [(float(scores[i]), segment_id, int(allowed[i])) for i in best]
+        dead = tombstones.get(segment_id, np.empty(0, dtype=np.int64))
+        # Over-fetch so that enough live rows remain after dropping tombstoned ones
+        ids, scores = store.search(query_vector, k=k + len(dead), nprobe=nprobe)
+        live = (ids[0] >= 0) & ~np.isin(ids[0], dead)
+        return [(float(score), segment_id, int(row)) for row, score in zip(ids[0][live][:k], scores[0][live][:k])]
+
+    def keyword_search(self, query, k=10, doc_ids=None, k1=1.2, b=0.75):
+        """
+        BM25 search over the chunk texts, with statistics aggregated across all segments.
+
+        :param query: str - The query text; identifiers are matched as whole terms.
+        :param k: int - Number of results.
+        :param doc_ids: list - Optionally restricts the search to these documents.
+        :return: list - Dicts with 'score', 'doc_id', 'chunk_id', 'page' and 'text', best first.
+        """
+        terms = tokenize(query)
+        if not terms:
+            return []
+        hits = []
+        with self._lock:
+            indexes = [(segment_id, self._keyword_index(segment_id)) for segment_id, _, _ in self._segments()]
+            document_frequencies = dict.fromkeys(terms, 0)
+            row_count = 0
+            total_length = 0
+            for segment_id, index in indexes:
+                frequencies, rows, length = index.statistics(terms, excluded_rows=self._tombstones.get(segment_id))
+                for term, frequency in frequencies.items():
+                    document_frequencies[term] += frequency
+                row_count += rows
+                total_length += length
+            if not row_count:
+                return []
+            idf = {
+                term: float(np.log(1 + (row_count - frequency + 0.5) / (frequency + 0.5)))
+                for term, frequency in document_frequencies.items()
+            }
+            average_length = total_length / row_count
+            for segment_id, index in indexes:
+                excluded = self._tombstones.get(segment_id)
+                if doc_ids is not None:
+                    allowed = self._allowed_rows(segment_id, doc_ids)
+                    if not len(allowed):
+                        continue
+                    excluded = np.setdiff1d(np.arange(index.row_count), allowed)
+                rows, scores = index.score(terms, idf, average_length, k=k, excluded_rows=excluded, k1=k1, b=b)
+                hits += [(float(score), segment_id, int(row)) for row, score in zip(rows, scores)]
+        hits.sort(key=lambda hit: -hit[0])
+        return self._describe(hits[:k])
+
+    def _describe(self, hits):
+        results = []
+        for score, segment_id, row in hits:
+            with self._lock:
+                chunk = self._catalog.execute(
+                    "SELECT c.chunk_id, c.page, c.text, r.doc_id FROM chunks c JOIN chunk_ranges r "
+                    "ON r.segment_id = c.segment_id AND c.row >= r.row_start AND c.row < r.row_end "
+                    "WHERE c.segment_id = ? AND c.row = ?",
+                    (segment_id, row)
+                ).fetchone()
+            if chunk is None:
+                continue
+            chunk_id, page, text, doc_id = chunk
+            results.append({'score': score, 'doc_id': doc_id, 'chunk_id': chunk_id, 'page': page, 'text': text,
+                            'segment_id': segment_id, 'row': row})
+        return results
+
+    def compact_async(self):
+        """
+        Starts a background compaction unless one is already running.
+        """
+        if self._compaction is not None and self._compaction.is_alive():
+            return self._compaction
+        self._compaction = threading.Thread(target=self.compact, name='collection-compaction', daemon=True)
+        self._compaction.start()
+        return self._compaction
+
+    def compact(self):
+        """
+        Merges small sealed segments (and any with tombstones) into one, dropping tombstoned rows.
+        """
+        with self._lock:
+            candidates = [
+                segment_id for segment_id, state, row_count in self._segments(states=('sealed',))
+                if row_count < self.compaction_rows or len(self._tombstones.get(segment_id, []))
+            ]
+            if len(candidates) < 2 and not any(len(self._tombstones.get(s, [])) for s in candidates):
+                return None
+            tombstones = {segment_id: self._tombstones.get(segment_id) for segment_id in candidates}
+
+        # Copy live rows outside the lock; new writes only go to the active segment
+        merged_id = uuid.uuid4().hex[:12]
+        merged = VectorStore(os.path.join(self.path, 'segments', merged_id), self.dim, self.dtype)
+        new_ranges = []
+        new_chunks = []
+        for segment_id in candidates:
+            with self._lock:
+                ranges = self._catalog.execute(
+                    "SELECT doc_id, row_start, row_end FROM chunk_ranges WHERE segment_id = ? ORDER BY row_start",
+                    (segment_id,)
+                ).fetchall()
+            store = self._store(segment_id)
+            for doc_id, row_start, row_end in ranges:
+                if row_end == row_start:
+                    new_ranges.append((doc_id, merged_id, merged.count, merged.count))
+                    continue
+                new_ids = merged.add(store.get_vectors(np.arange(row_start, row_end)))
+                new_ranges.append((doc_id, merged_id, int(new_ids[0]), int(new_ids[-1]) + 1))
+                for old_row, new_row in zip(range(row_start, row_end), new_ids):
+                    new_chunks.append((segment_id, old_row, merged_id, int(new_row)))
+
+        with self._lock:
+            placeholders = ','.join('?' * len(candidates))
+            # Documents deleted or replaced while copying are tombstoned in the merged segment
+            still_live = {
+                doc_id for (doc_id,) in self._catalog.execute(
+                    f"SELECT doc_id FROM chunk_ranges WHERE segment_id IN ({placeholders})", candidates
+                )
+            }
+            dead_ranges = [(segment, start, end) for doc_id, segment, start, end in new_ranges if doc_id not in still_live]
+            new_ranges = [new_range for new_range in new_ranges if new_range[0] in still_live]
+            with self._catalog:
+                self._catalog.execute(
+                    "INSERT INTO segments (segment_id, state, row_count, created_at) VALUES (?, 'sealed', ?, ?)",
+                    (merged_id, merged.count, time.time())
+                )
+                self._catalog.executemany(
+                    "INSERT INTO chunks (segment_id, row, chunk_id, page, text) "
+                    "SELECT ?, ?, chunk_id, page, text FROM chunks WHERE segment_id = ? AND row = ?",
+                    [(new_segment, new_row, old_segment, old_row) for old_segment, old_row, new_segment, new_row in new_chunks]
+                )
+                self._catalog.execute(f"DELETE FROM tombstones WHERE segment_id IN ({placeholders})", candidates)
+                self._catalog.execute(f"DELETE FROM chunk_ranges WHERE segment_id IN ({placeholders})", candidates)
+                self._catalog.execute(f"DELETE FROM chunks WHERE segment_id IN ({placeholders})", candidates)
+                self._catalog.execute(f"UPDATE segments SET state = 'retired' WHERE segment_id IN ({placeholders})", candidates)
+                self._catalog.executemany(
+                    "INSERT INTO chunk_ranges (doc_id, segment_id, row_start, row_end) VALUES (?, ?, ?, ?)", new_ranges
+                )
+                self._catalog.executemany(
+                    "INSERT INTO tombstones (segment_id, row_start, row_end) VALUES (?, ?, ?)", dead_ranges
+                )
+            if merged.count >= self.ivf_threshold:
+                merged.build_ivf()
+            self._keyword_index(merged_id).save(os.path.join(self.path, 'segments', merged_id, 'keywords'))
+            for segment_id in candidates:
+                self._stores.pop(segment_id, None)
+                self._keyword_indexes.pop(segment_id, None)
+                shutil.rmtree(os.path.join(self.path, 'segments', segment_id), ignore_errors=True)
+            self._load_tombstones()
+        return merged_id
@@ -0,0 +1,101 @@
+import hashlib
+import re
+
+import numpy as np
+
+
+MERSENNE_PRIME = (1 << 61) - 1
+WORD_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+
+class MinHashDeduplicator:
+    """
+    Detects near-identical chunks with MinHash signatures over word shingles and
+    locality-sensitive hashing (banded signatures) to find candidates in constant time.
+    """
+
+    def __init__(self, num_permutations=64, bands=16, shingle_size=5, threshold=0.85, seed=7):
+        """
+        :param num_permutations: int - Signature length.
+        :param bands: int - LSH bands; must divide `num_permutations`.
+        :param shingle_size: int - Words per shingle.
+        :param threshold: float - Estimated Jaccard similarity at which a chunk is a duplicate.
+        """
+        if num_permutations % bands:
+            raise ValueError("The number of permutations must be divisible by the number of bands.")
+        self.num_permutations = num_permutations
+        self.bands = bands
+        self.rows = num_permutations // bands
+        self.shingle_size = shingle_size
+        self.threshold = threshold
+        generator = np.random.default_rng(seed)
+        self._a = generator.integers(1, MERSENNE_PRIME, size=num_permutations, dtype=np.uint64)
+        self._b = generator.integers(0, MERSENNE_PRIME, size=num_permutations, dtype=np.uint64)
+        self._buckets = [dict() for _ in range(bands)]
+        self._signatures = {}
+
+    def signature(self, text):
+        """
+        Returns the MinHash signature of a text as a uint64 array.
+        """
+        words = WORD_PATTERN.findall(text.lower())
+        size = min(self.shingle_size, max(len(words), 1))
+        shingles = {' '.join(words[i:i + size]) for i in range(max(len(words) - size + 1, 1))}
+        hashes = np.fromiter(
+            (int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), 'little') for s in shingles),
+            dtype=np.uint64, count=len(shingles)
+        ) % np.uint64(MERSENNE_PRIME)
+        # (a * x + b) mod p, vectorized over all shingles and permutations (wrapping uint64 arithmetic)
+        permuted = (np.outer(hashes, self._a) + self._b) % np.uint64(MERSENNE_PRIME)
+        return permuted.min(axis=0)
+
+    def _band_keys(self, signature):
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def find_duplicate(self, text, signature=None):
+        """
+        Returns the key of an already added chunk that is a near duplicate of `text`, or None.
+        """
+        signature = self.signature(text) if signature is None else signature
+        seen = set()
+        for band, key in enumerate(self._band_keys(signature)):
+            for candidate in self._buckets[band].get(key, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                if np.mean(self._signatures[candidate] == signature) >= self.threshold:
+                    return candidate
+        return None
+
+    def add(self, key, text, signature=None):
+        signature = self.signature(text) if signature is None else signature
+        self._signatures[key] = signature
+        for band, band_key in enumerate(self._band_keys(signature)):
+            self._buckets[band].setdefault(band_key, []).append(key)
+
+    def remove(self, keys):
+        """
+        Forgets added chunks, so they no longer match as duplicates.
+        """
+        for key in keys:
+            signature = self._signatures.pop(key, None)
+            if signature is None:
+                continue
+            for band, band_key in enumerate(self._band_keys(signature)):
+                bucket = self._buckets[band].get(band_key)
+                if bucket is not None and key in bucket:
+                    bucket.remove(key)
+                    if not bucket:
+                        del self._buckets[band][band_key]
+
+    def add_if_new(self, key, text):
+        """
+        Adds the chunk unless it is a near duplicate of one already added.
+
+        :return: str - None if the chunk was added, otherwise the key of its duplicate.
+        """
+        signature = self.signature(text)
+        duplicate = self.find_duplicate(text, signature=signature)
+        if duplicate is None:
+            self.add(key, text, signature=signature)
+        return duplicate
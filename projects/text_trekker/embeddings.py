@@ -0,0 +1,185 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+
+import numpy as np
+
+from .chunker import count_tokens
+
+
+class HashingEmbedder:
+    """
+    Deterministic, dependency-free embedder using the hashing trick over words and word
+    bigrams. Works offline and is stable across runs, which makes it suitable for tests.
+    """
+
+    def __init__(self, dim=256):
+        self.dim = dim
+        self.name = f'hashing-{dim}'
+
+    def _features(self, text):
+        words = re.findall(r'\w+', text.lower())
+        return words + [f'{a} {b}' for a, b in zip(words, words[1:])]
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), 'little')
+                vectors[i, digest % self.dim] += 1.0 if (digest >> 63) else -1.0
+        return vectors
+
+
+class LocalEmbedder:
+    """
+    CPU embedder backed by a locally stored sentence-transformers model.
+    """
+
+    def __init__(self, model_name='all-MiniLM-L6-v2'):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise ImportError("LocalEmbedder requires the 'sentence-transformers' package.") from e
+        self.model = SentenceTransformer(model_name, device='cpu')
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.name = f'local-{model_name}'
+
+    def embed(self, texts):
+        return np.asarray(self.model.encode(list(texts), batch_size=64, show_progress_bar=False), dtype=np.float32)
+
+
+class OpenAIEmbedder:
+    """
+    Remote embedder using the OpenAI embeddings API through the shared dispatcher.
+    """
+
+    dimensions = {'text-embedding-3-small': 1536, 'text-embedding-3-large': 3072, 'text-embedding-ada-002': 1536}
+
+    def __init__(self, api_key, model='text-embedding-3-small'):
+        from openai import OpenAI
+
+        self.client = OpenAI(api_key=api_key)
+        self.model = model
+        self.dim = self.dimensions[model]
+        self.name = f'openai-{model}'
+
+    def embed(self, texts):
+        from utils.llm_dispatcher import PRIORITY_BACKGROUND, get_dispatcher
+
+        response = get_dispatcher().call(
+            self.client.embeddings.create, priority=PRIORITY_BACKGROUND, model=self.model, input=list(texts)
+        )
+        return np.array([item.embedding for item in sorted(response.data, key=lambda item: item.index)], dtype=np.float32)
+
+
+class EmbeddingCache:
+    """
+    On-disk cache of embeddings keyed by a hash of the model name and the text.
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB NOT NULL)")
+
+    @staticmethod
+    def key(model_name, text):
+        return hashlib.sha256(f'{model_name}\0{text}'.encode()).digest()
+
+    def get_many(self, keys):
+        found = {}
+        with self._lock:
+            # Stay below SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = self._connection.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                found.update({key: np.frombuffer(vector, dtype=np.float32) for key, vector in rows})
+        return found
+
+    def put_many(self, items):
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in items]
+            )
+
+
+class EmbeddingService:
+    """
+    Embeds chunks and queries for Text Trekker. Texts already embedded with the same model
+    are served from the cache (so unchanged chunks are not re-embedded on re-ingestion),
+    identical texts are embedded once, and the rest are sent in batches bounded by a token
+    limit.
+    """
+
+    def __init__(self, embedder, cache_path, max_batch_tokens=8000, max_batch_size=256, tracer=None):
+        """
+        :param embedder: object - Embedder with `name`, `dim` and `embed(texts)`.
+        :param cache_path: str - Path of the SQLite embedding cache.
+        :param max_batch_tokens: int - Token limit of one embedding call.
+        :param max_batch_size: int - Maximum texts in one embedding call.
+        :param tracer: Tracer - Optional tracer recording cache hits and batches.
+        """
+        self.embedder = embedder
+        self.cache = EmbeddingCache(cache_path)
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.tracer = tracer
+        self.stats = {'cache_hits': 0, 'embedded': 0, 'batches': 0}
+
+    @property
+    def dim(self):
+        return self.embedder.dim
+
+    def _batches(self, texts):
+        batch = []
+        batch_tokens = 0
+        for text in texts:
+            tokens = count_tokens(text)
+            if batch and (batch_tokens + tokens > self.max_batch_tokens or len(batch) >= self.max_batch_size):
+                yield batch
+                batch = []
+                batch_tokens = 0
+            batch.append(text)
+            batch_tokens += tokens
+        if batch:
+            yield batch
+
+    def embed(self, texts):
+        """
+        :param texts: list - Texts to embed.
+        :return: np.ndarray - One float32 vector per text.
+        """
+        keys = [EmbeddingCache.key(self.embedder.name, text) for text in texts]
+        vectors = self.cache.get_many(list(set(keys)))
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing.setdefault(key, text)
+
+        batches = 0
+        for batch in self._batches(list(missing.values())):
+            embedded = self.embedder.embed(batch)
+            batch_keys = [EmbeddingCache.key(self.embedder.name, text) for text in batch]
+            self.cache.put_many(zip(batch_keys, embedded))
+            vectors.update(zip(batch_keys, embedded))
+            batches += 1
+
+        hits = len(texts) - sum(1 for key in keys if key in missing)
+        self.stats['cache_hits'] += hits
+        self.stats['embedded'] += len(missing)
+        self.stats['batches'] += batches
+        if self.tracer is not None:
+            self.tracer.count(cache_hits=hits, embedded=len(missing), batches=batches)
+            self.tracer.annotate(cache_hit=not missing)
+        if not texts:
+            return np.empty((0, self.dim), dtype=np.float32)
+        return np.vstack([vectors[key] for key in keys]).astype(np.float32)
+
+    def embed_query(self, text):
+        return self.embed([text])[0]
@@ -0,0 +1,78 @@
+from utils.tracing import Tracer
+
+
+def reciprocal_rank_fusion(result_lists, k=60):
+    """
+    Fuses ranked result lists by summing `1 / (k + rank)` for every list a chunk appears in.
+
+    :param result_lists: list - Ranked lists of result dicts carrying a 'chunk_id'.
+    :param k: int - Damping constant; larger values flatten the contribution of top ranks.
+    :return: list - Result dicts with 'rrf_score' and per-list 'ranks', best first.
+    """
+    fused = {}
+    for list_index, results in enumerate(result_lists):
+        for rank, result in enumerate(results, start=1):
+            entry = fused.setdefault(result['chunk_id'], {**result, 'rrf_score': 0.0, 'ranks': {}})
+            entry['rrf_score'] += 1.0 / (k + rank)
+            entry['ranks'][list_index] = rank
+    return sorted(fused.values(), key=lambda entry: -entry['rrf_score'])
+
+
+class HybridRetriever:
+    """
+    Combines embedding search with BM25 keyword search over a collection, so exact
+    identifiers (contract numbers, SKUs) are found even when embeddings miss them.
+    Every stage is timed so candidate-set sizes can be tuned.
+    """
+
+    def __init__(self, collection, embed_query=None, tracer=None):
+        """
+        :param collection: Collection - The searched collection.
+        :param embed_query: callable - Returns the embedding of a query text.
+        :param tracer: Tracer - Tracer recording a span per retrieval stage.
+        """
+        self.collection = collection
+        self.embed_query = embed_query
+        self.tracer = tracer or Tracer('text_trekker')
+
+    def search(self, query, k=10, query_vector=None, vector_candidates=50, keyword_candidates=50,
+               rrf_k=60, doc_ids=None):
+        """
+        :param query: str - The query text.
+        :param k: int - Number of fused results.
+        :param query_vector: np.ndarray - The query embedding, if already computed.
+        :param vector_candidates: int - Candidates taken from the embedding search.
+        :param keyword_candidates: int - Candidates taken from the BM25 search.
+        :param rrf_k: int - Reciprocal-rank fusion constant.
+        :param doc_ids: list - Optionally restricts the search to these documents.
+        :return: dict - 'results' (best first) and 'latency_ms' per stage.
+        """
+        stages = []
+        with self.tracer.span('hybrid_search', query=query[:200]) as span:
+            vector_results = []
+            if query_vector is None and self.embed_query is not None:
+                with self.tracer.span('embed_query') as stage:
+                    stages.append(stage)
+                    query_vector = self.embed_query(query)
+            if query_vector is not None and vector_candidates:
+                with self.tracer.span('vector_search') as stage:
+                    stages.append(stage)
+                    vector_results = self.collection.search(query_vector, k=vector_candidates, doc_ids=doc_ids)
+                    stage.set(rows=len(vector_results))
+
+            keyword_results = []
+            if keyword_candidates:
+                with self.tracer.span('keyword_search') as stage:
+                    stages.append(stage)
+                    keyword_results = self.collection.keyword_search(query, k=keyword_candidates, doc_ids=doc_ids)
+                    stage.set(rows=len(keyword_results))
+
+            with self.tracer.span('fusion') as stage:
+                stages.append(stage)
+                results = reciprocal_rank_fusion([vector_results, keyword_results], k=rrf_k)[:k]
+                stage.set(rows=len(results))
+            span.set(rows=len(results))
+        stages.append(span)
+
+        latency_ms = {stage.name: round(stage.duration_ms, 3) for stage in stages}
+        return {'results': results, 'latency_ms': latency_ms}
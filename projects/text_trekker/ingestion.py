@@ -0,0 +1,207 @@
+import hashlib
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from .chunker import TextChunker
+from .deduplicator import MinHashDeduplicator
+
+
+def extract_pdf_pages(path, first_page, last_page):
+    """
+    Extracts the text of pages `first_page` to `last_page - 1`. Runs in a worker process.
+
+    :return: tuple - The document's page count and a list of `(page_number, text)` tuples.
+    """
+    from pypdf import PdfReader
+
+    reader = PdfReader(path)
+    pages = []
+    for page_number in range(first_page, min(last_page, len(reader.pages))):
+        try:
+            text = reader.pages[page_number].extract_text() or ''
+        except Exception:
+            # A single broken page should not fail the whole document
+            text = ''
+        pages.append((page_number, text))
+    return len(reader.pages), pages
+
+
+class IngestionProgress:
+    """
+    Append-only record of per-document ingestion status, so that an interrupted batch
+    resumes with the documents that were not completed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.documents = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Torn last line from an interrupted write
+                        continue
+                    self.documents[record['doc_id']] = record
+
+    def is_done(self, doc_id, fingerprint):
+        record = self.documents.get(doc_id)
+        return record is not None and record['status'] == 'done' and record['fingerprint'] == fingerprint
+
+    def record(self, doc_id, **fields):
+        record = {**self.documents.get(doc_id, {}), 'doc_id': doc_id, **fields}
+        self.documents[doc_id] = record
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class IngestionPipeline:
+    """
+    Streaming PDF ingestion for Text Trekker: pages are extracted in a process pool,
+    chunked by token count with overlap, and near-duplicate chunks are dropped. Chunks
+    of every completed document are written to `<work_dir>/chunks/<doc_id>.jsonl`.
+    """
+
+    def __init__(self, work_dir, workers=None, pages_per_task=16, max_pending_tasks=None,
+                 chunker=None, deduplicator=None):
+        """
+        :param work_dir: str - Directory holding the progress record and chunk files.
+        :param workers: int - Worker processes (defaults to the CPU count).
+        :param pages_per_task: int - Pages extracted per worker task.
+        :param max_pending_tasks: int - Bound on queued extraction tasks, limiting memory use.
+        :param chunker: TextChunker - Chunking strategy.
+        :param deduplicator: MinHashDeduplicator - Near-duplicate detection across the batch.
+        """
+        self.work_dir = work_dir
+        self.workers = workers or os.cpu_count() or 1
+        self.pages_per_task = pages_per_task
+        self.max_pending_tasks = max_pending_tasks or self.workers * 4
+        self.chunker = chunker or TextChunker()
+        self.deduplicator = deduplicator or MinHashDeduplicator()
+        os.makedirs(os.path.join(work_dir, 'chunks'), exist_ok=True)
+        self.progress = IngestionProgress(os.path.join(work_dir, 'progress.jsonl'))
+        self._document_chunks = {}
+        self._load_completed_chunks()
+
+    @staticmethod
+    def document_id(path):
+        return hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:16]
+
+    @staticmethod
+    def fingerprint(path):
+        stat = os.stat(path)
+        return f'{stat.st_size}:{int(stat.st_mtime)}'
+
+    def chunk_file(self, doc_id):
+        return os.path.join(self.work_dir, 'chunks', f'{doc_id}.jsonl')
+
+    def iter_chunks(self, doc_id):
+        """
+        Yields the stored chunks of an ingested document.
+        """
+        with open(self.chunk_file(doc_id)) as f:
+            for line in f:
+                yield json.loads(line)
+
+    def _load_completed_chunks(self):
+        # Seed the deduplicator with documents finished by an earlier, interrupted run
+        for doc_id, record in self.progress.documents.items():
+            if record['status'] == 'done' and os.path.exists(self.chunk_file(doc_id)):
+                chunk_ids = self._document_chunks[doc_id] = []
+                for chunk in self.iter_chunks(doc_id):
+                    self.deduplicator.add(chunk['chunk_id'], chunk['text'])
+                    chunk_ids.append(chunk['chunk_id'])
+
+    def _forget_document(self, doc_id):
+        """
+        Drops the chunks of an earlier version of a document from the deduplicator, so the
+        new version is not matched against its own previous content.
+        """
+        self.deduplicator.remove(self._document_chunks.pop(doc_id, []))
+
+    def ingest(self, paths):
+        """
+        Ingests PDFs, yielding a summary per document as soon as it completes. Documents
+        already completed with the same size and modification time are skipped.
+
+        :param paths: iterable - Paths of the PDF files.
+        :return: generator - Dicts with 'doc_id', 'path', 'status', 'pages', 'chunks' and 'duplicates'.
+        """
+        pending = {}
+        documents = {}
+        paths = iter(paths)
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            exhausted = False
+            while True:
+                while not exhausted and len(pending) < self.max_pending_tasks:
+                    path = next(paths, None)
+                    if path is None:
+                        exhausted = True
+                        break
+                    doc_id = self.document_id(path)
+                    fingerprint = self.fingerprint(path)
+                    if self.progress.is_done(doc_id, fingerprint):
+                        yield {**self.progress.documents[doc_id], 'status': 'skipped'}
+                        continue
+                    self._forget_document(doc_id)
+                    self.progress.record(doc_id, path=path, fingerprint=fingerprint, status='in_progress')
+                    documents[doc_id] = {'path': path, 'fingerprint': fingerprint, 'pages': {}, 'tasks': 1}
+                    # The first task also reads the page count, so the PDF is never opened in this process
+                    future = executor.submit(extract_pdf_pages, path, 0, self.pages_per_task)
+                    pending[future] = doc_id
+
+                if not pending:
+                    if exhausted:
+                        break
+                    continue
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    doc_id = pending.pop(future)
+                    document = documents[doc_id]
+                    document['tasks'] -= 1
+                    try:
+                        page_count, pages = future.result()
+                    except Exception as e:
+                        document['error'] = str(e)
+                    else:
+                        document['pages'].update(pages)
+                        if 'page_count' not in document:
+                            document['page_count'] = page_count
+                            self.progress.record(doc_id, pages=page_count)
+                            for first_page in range(self.pages_per_task, page_count, self.pages_per_task):
+                                future = executor.submit(
+                                    extract_pdf_pages, document['path'], first_page, first_page + self.pages_per_task
+                                )
+                                pending[future] = doc_id
+                                document['tasks'] += 1
+                    if document['tasks'] == 0:
+                        yield self._finish_document(doc_id, documents.pop(doc_id))
+
+    def _finish_document(self, doc_id, document):
+        if document.get('error'):
+            self.progress.record(doc_id, status='failed', error=document['error'])
+            return self.progress.documents[doc_id]
+
+        chunk_count = 0
+        duplicates = 0
+        chunk_ids = self._document_chunks[doc_id] = []
+        temporary_file = self.chunk_file(doc_id) + '.tmp'
+        with open(temporary_file, 'w') as f:
+            for page_number in sorted(document['pages']):
+                for i, chunk in enumerate(self.chunker.chunk(document['pages'][page_number])):
+                    chunk_id = f'{doc_id}:{page_number}:{i}'
+                    if self.deduplicator.add_if_new(chunk_id, chunk['text']) is not None:
+                        duplicates += 1
+                        continue
+                    chunk_ids.append(chunk_id)
+                    f.write(json.dumps({'chunk_id': chunk_id, 'doc_id': doc_id, 'page': page_number, **chunk}) + '\n')
+                    chunk_count += 1
+        # Publish the chunk file only once complete, so a crash never leaves a partial one
+        os.replace(temporary_file, self.chunk_file(doc_id))
+        self.progress.record(doc_id, status='done', chunks=chunk_count, duplicates=duplicates)
+        return self.progress.documents[doc_id]
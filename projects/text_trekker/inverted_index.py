@@ -0,0 +1,190 @@
+import json
+import os
+import re
+from collections import Counter
+
+import numpy as np
+
+
+# Keeps identifiers such as contract numbers and SKUs ("INV-2023/0042") as single terms
+TERM_PATTERN = re.compile(r'[^\W_]+(?:[-_./][^\W_]+)*')
+PART_PATTERN = re.compile(r'[-_./]')
+
+
+def tokenize(text):
+    """
+    Lowercased terms of a text; composite identifiers also contribute their parts.
+    """
+    terms = []
+    for match in TERM_PATTERN.findall(text.lower()):
+        terms.append(match)
+        if PART_PATTERN.search(match):
+            terms.extend(part for part in PART_PATTERN.split(match) if part)
+    return terms
+
+
+class InvertedIndex:
+    """
+    Compact inverted index over the chunks of one collection segment.
+
+    The term dictionary is a sorted array of terms with offsets into the postings. Postings
+    are stored as delta-encoded row numbers with term frequencies in flat NumPy arrays, and
+    BM25 is scored for a whole posting list at a time. Rows added after the arrays were
+    built are kept in a small pending buffer that searches read alongside the arrays; it is
+    merged into them when the index is saved.
+    """
+
+    def __init__(self):
+        self.terms = np.empty(0, dtype=object)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.row_deltas = np.empty(0, dtype=np.uint32)
+        self.frequencies = np.empty(0, dtype=np.uint16)
+        self.lengths = np.empty(0, dtype=np.uint32)
+        self._pending = {}
+
+    @property
+    def row_count(self):
+        return len(self.lengths)
+
+    def add(self, rows, texts):
+        """
+        Indexes the texts of the given segment rows.
+        """
+        lengths = {}
+        for row, text in zip(rows, texts):
+            terms = tokenize(text)
+            lengths[int(row)] = len(terms)
+            for term, frequency in Counter(terms).items():
+                self._pending.setdefault(term, []).append((int(row), frequency))
+        if lengths:
+            if max(lengths) >= len(self.lengths):
+                self.lengths = np.concatenate([self.lengths, np.zeros(max(lengths) + 1 - len(self.lengths), dtype=np.uint32)])
+            self.lengths[list(lengths)] = list(lengths.values())
+
+    def _merge_pending(self):
+        """
+        Folds the pending postings into the arrays, re-sorting all postings by term and row.
+        """
+        if not self._pending:
+            return
+        counts = np.diff(self.offsets)
+        # Decode the deltas: running sum over all postings, restarted at every list
+        running = np.cumsum(self.row_deltas, dtype=np.int64)
+        list_starts = np.repeat(np.concatenate([[0], running])[self.offsets[:-1]], counts)
+        rows = running - list_starts
+        pending_terms = sorted(self._pending)
+        terms = np.union1d(self.terms.astype(str), np.array(pending_terms, dtype=str)).astype(object)
+        term_ids = np.repeat(np.searchsorted(terms, self.terms.astype(str)) if len(self.terms) else np.empty(0, dtype=np.int64), counts)
+        pending_ids = np.searchsorted(terms, np.array(pending_terms, dtype=str))
+        pending_counts = [len(self._pending[term]) for term in pending_terms]
+        pending = np.array([entry for term in pending_terms for entry in self._pending[term]], dtype=np.int64).reshape(-1, 2)
+
+        term_ids = np.concatenate([term_ids, np.repeat(pending_ids, pending_counts)])
+        rows = np.concatenate([rows, pending[:, 0]])
+        frequencies = np.concatenate([self.frequencies, np.minimum(pending[:, 1], 65535).astype(np.uint16)])
+        order = np.lexsort((rows, term_ids))
+        term_ids, rows, frequencies = term_ids[order], rows[order], frequencies[order]
+
+        list_sizes = np.bincount(term_ids, minlength=len(terms))
+        offsets = np.concatenate([[0], np.cumsum(list_sizes)])
+        deltas = np.diff(rows, prepend=0)
+        # The first posting of every list holds its row itself
+        firsts = offsets[:-1][list_sizes > 0]
+        deltas[firsts] = rows[firsts]
+
+        self.terms = terms
+        self.offsets = offsets.astype(np.int64)
+        self.row_deltas = deltas.astype(np.uint32)
+        self.frequencies = frequencies
+        self._pending = {}
+
+    def _postings(self, term):
+        """
+        Rows and frequencies of a term, from the arrays and the pending buffer.
+        """
+        rows, frequencies = None, None
+        position = np.searchsorted(self.terms, term)
+        if position < len(self.terms) and self.terms[position] == term:
+            start, end = self.offsets[position], self.offsets[position + 1]
+            rows, frequencies = np.cumsum(self.row_deltas[start:end], dtype=np.int64), self.frequencies[start:end]
+        pending = self._pending.get(term)
+        if pending:
+            pending = np.array(pending, dtype=np.int64)
+            pending_frequencies = np.minimum(pending[:, 1], 65535).astype(np.uint16)
+            if rows is None:
+                return pending[:, 0], pending_frequencies
+            rows = np.concatenate([rows, pending[:, 0]])
+            frequencies = np.concatenate([frequencies, pending_frequencies])
+        return rows, frequencies
+
+    @staticmethod
+    def _live(rows, excluded_rows):
+        if excluded_rows is None or not len(excluded_rows):
+            return rows
+        return rows[~np.isin(rows, excluded_rows)]
+
+    def statistics(self, terms, excluded_rows=None):
+        """
+        Returns `(document_frequencies, row_count, total_length)` for BM25 across segments,
+        leaving out `excluded_rows` (tombstones).
+        """
+        document_frequencies = {}
+        for term in terms:
+            rows, _ = self._postings(term)
+            document_frequencies[term] = 0 if rows is None else len(self._live(rows, excluded_rows))
+        lengths = self.lengths
+        if excluded_rows is not None and len(excluded_rows):
+            lengths = lengths.copy()
+            lengths[excluded_rows[excluded_rows < len(lengths)]] = 0
+        return document_frequencies, int(np.count_nonzero(lengths)), int(lengths.sum())
+
+    def score(self, terms, idf, average_length, k=10, excluded_rows=None, k1=1.2, b=0.75):
+        """
+        Scores the segment's rows with BM25 and returns the best `k`.
+
+        :param terms: list - Query terms.
+        :param idf: dict - Collection-wide inverse document frequency per term.
+        :param average_length: float - Collection-wide average chunk length in terms.
+        :param excluded_rows: np.ndarray - Rows to skip (tombstones).
+        :return: tuple - `(rows, scores)` arrays, best first.
+        """
+        scores = np.zeros(len(self.lengths), dtype=np.float32)
+        for term in set(terms):
+            rows, frequencies = self._postings(term)
+            if rows is None:
+                continue
+            frequencies = frequencies.astype(np.float32)
+            norm = k1 * (1 - b + b * self.lengths[rows] / max(average_length, 1e-9))
+            scores[rows] += idf[term] * frequencies * (k1 + 1) / (frequencies + norm)
+        if excluded_rows is not None and len(excluded_rows):
+            scores[excluded_rows[excluded_rows < len(scores)]] = 0
+        matched = np.flatnonzero(scores > 0)
+        best = matched[np.argsort(-scores[matched], kind='stable')[:k]]
+        return best, scores[best]
+
+    def save(self, path):
+        self._merge_pending()
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, 'terms.json'), 'w') as f:
+            json.dump(self.terms.tolist(), f)
+        np.savez(
+            os.path.join(path, 'postings.npz'),
+            offsets=self.offsets, row_deltas=self.row_deltas, frequencies=self.frequencies, lengths=self.lengths
+        )
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a saved index, or returns None if there is none at `path`.
+        """
+        if not os.path.exists(os.path.join(path, 'postings.npz')):
+            return None
+        index = cls()
+        with open(os.path.join(path, 'terms.json')) as f:
+            index.terms = np.array(json.load(f), dtype=object)
+        with np.load(os.path.join(path, 'postings.npz')) as arrays:
+            index.offsets = arrays['offsets']
+            index.row_deltas = arrays['row_deltas']
+            index.frequencies = arrays['frequencies']
+            index.lengths = arrays['lengths']
+        return index
@@ -0,0 +1,258 @@
+import json
+import os
+
+import numpy as np
+
+
+def normalize(vectors):
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def top_k(scores, k):
+    """
+    Returns `(indices, scores)` of the `k` best scores per row, best first.
+    """
+    k = min(k, scores.shape[1])
+    if k == 0:
+        empty = np.empty((scores.shape[0], 0))
+        return empty.astype(np.int64), empty.astype(np.float32)
+    candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.argsort(-candidate_scores, axis=1)
+    return np.take_along_axis(candidates, order, axis=1), np.take_along_axis(candidate_scores, order, axis=1)
+
+
+class VectorStore:
+    """
+    Append-only store of L2-normalized embeddings in a memory-mapped file, searched by
+    cosine similarity. Vectors are kept as float32 or int8 with a per-vector scale.
+    Opening a store only reads its metadata; vectors are paged in by the OS on demand.
+
+    Small stores are searched exactly with blocked matrix products. Larger ones can build
+    an IVF index (k-means coarse quantizer with inverted lists) searched over the `nprobe`
+    closest lists, trading recall for latency.
+    """
+
+    block_rows = 65536
+
+    def __init__(self, path, dim, dtype='float32'):
+        """
+        :param path: str - Directory of the store (created if missing).
+        :param dim: int - Embedding dimension.
+        :param dtype: str - 'float32', or 'int8' for 4x smaller quantized vectors.
+        """
+        if dtype not in ('float32', 'int8'):
+            raise ValueError("dtype must be 'float32' or 'int8'.")
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        meta_path = os.path.join(path, 'meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta['dim'] != dim or meta['dtype'] != dtype:
+                raise ValueError(f"Store at {path} holds {meta['dtype']} vectors of dimension {meta['dim']}.")
+            self.count = meta['count']
+        else:
+            self.count = 0
+        self.dim = dim
+        self.dtype = dtype
+        self._vectors = None
+        self._scales = None
+        self._ivf = None
+        self._write_meta()
+
+    @property
+    def _vectors_file(self):
+        return os.path.join(self.path, f'vectors.{self.dtype}')
+
+    @property
+    def _scales_file(self):
+        return os.path.join(self.path, 'scales.float32')
+
+    def _write_meta(self):
+        temporary = os.path.join(self.path, 'meta.json.tmp')
+        with open(temporary, 'w') as f:
+            json.dump({'dim': self.dim, 'dtype': self.dtype, 'count': self.count}, f)
+        os.replace(temporary, os.path.join(self.path, 'meta.json'))
+
+    def __len__(self):
+        return self.count
+
+    def add(self, vectors):
+        """
+        Appends embeddings (normalized on the way in).
+
+        :return: np.ndarray - Row ids assigned to the new vectors.
+        """
+        vectors = normalize(vectors)
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected vectors of dimension {self.dim}, got {vectors.shape[1]}.")
+        if self.dtype == 'int8':
+            scales = np.abs(vectors).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            quantized = np.round(vectors / scales[:, None]).astype(np.int8)
+            with open(self._vectors_file, 'ab') as f:
+                f.write(quantized.tobytes())
+            with open(self._scales_file, 'ab') as f:
+                f.write(scales.astype(np.float32).tobytes())
+        else:
+            with open(self._vectors_file, 'ab') as f:
+                f.write(vectors.tobytes())
+        ids = np.arange(self.count, self.count + len(vectors))
+        self.count += len(vectors)
+        self._write_meta()
+        # Remap lazily to pick up the new rows
+        self._vectors = None
+        self._scales = None
+        return ids
+
+    def _mapped(self):
+        if self._vectors is None and self.count:
+            self._vectors = np.memmap(self._vectors_file, dtype=np.dtype(self.dtype), mode='r', shape=(self.count, self.dim))
+            if self.dtype == 'int8':
+                self._scales = np.memmap(self._scales_file, dtype=np.float32, mode='r', shape=(self.count,))
+        return self._vectors, self._scales
+
+    def get_vectors(self, ids):
+        """
+        Returns the (dequantized) float32 vectors of the given row ids.
+        """
+        vectors, scales = self._mapped()
+        ids = np.asarray(ids, dtype=np.int64)
+        rows = np.asarray(vectors[ids], dtype=np.float32)
+        if scales is not None:
+            rows *= scales[ids][:, None]
+        return rows
+
+    def _scores(self, queries, start, stop):
+        vectors, scales = self._mapped()
+        block = np.asarray(vectors[start:stop], dtype=np.float32)
+        scores = queries @ block.T
+        if scales is not None:
+            scores *= scales[start:stop]
+        return scores
+
+    def search_exact(self, queries, k=10):
+        """
+        Exact cosine search over all vectors, one block of rows at a time.
+
+        :return: tuple - `(ids, scores)` arrays of shape (queries, k).
+        """
+        queries = normalize(queries)
+        best_ids = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        for start in range(0, self.count, self.block_rows):
+            stop = min(start + self.block_rows, self.count)
+            ids, scores = top_k(self._scores(queries, start, stop), k)
+            best_ids, best_scores = self._merge(best_ids, best_scores, ids + start, scores, k)
+        return best_ids, best_scores
+
+    @staticmethod
+    def _merge(ids_a, scores_a, ids_b, scores_b, k):
+        ids = np.concatenate([ids_a, ids_b], axis=1)
+        scores = np.concatenate([scores_a, scores_b], axis=1)
+        positions, merged_scores = top_k(scores, k)
+        return np.take_along_axis(ids, positions, axis=1), merged_scores
+
+    def build_ivf(self, nlist=None, iterations=10, sample_size=100000, seed=0):
+        """
+        Trains the IVF coarse quantizer on a sample and writes the inverted lists next to
+        the vectors, so later opens memory-map them instead of rebuilding.
+
+        :param nlist: int - Number of inverted lists (defaults to ~4*sqrt(count)).
+        :param iterations: int - k-means iterations.
+        :param sample_size: int - Vectors sampled for training.
+        """
+        if not self.count:
+            return
+        nlist = min(nlist or int(4 * np.sqrt(self.count)), self.count)
+        generator = np.random.default_rng(seed)
+        sample_ids = np.sort(generator.choice(self.count, size=min(sample_size, self.count), replace=False))
+        sample = self.get_vectors(sample_ids)
+        centroids = sample[generator.choice(len(sample), size=nlist, replace=False)]
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            counts = np.bincount(assignment, minlength=nlist)
+            filled = counts > 0
+            centroids[filled] = normalize(sums[filled])
+
+        assignments = np.empty(self.count, dtype=np.int32)
+        for start in range(0, self.count, self.block_rows):
+            stop = min(start + self.block_rows, self.count)
+            assignments[start:stop] = np.argmax(self.get_vectors(np.arange(start, stop)) @ centroids.T, axis=1)
+        order = np.argsort(assignments, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=nlist))])
+
+        np.save(os.path.join(self.path, 'ivf_centroids.npy'), centroids.astype(np.float32))
+        np.save(os.path.join(self.path, 'ivf_ids.npy'), order.astype(np.int64))
+        np.save(os.path.join(self.path, 'ivf_offsets.npy'), offsets.astype(np.int64))
+        with open(os.path.join(self.path, 'ivf_count.json'), 'w') as f:
+            json.dump({'count': self.count}, f)
+        self._ivf = None
+
+    def _load_ivf(self):
+        if self._ivf is None:
+            count_file = os.path.join(self.path, 'ivf_count.json')
+            if not os.path.exists(count_file):
+                return None
+            with open(count_file) as f:
+                indexed = json.load(f)['count']
+            self._ivf = {
+                'centroids': np.load(os.path.join(self.path, 'ivf_centroids.npy'), mmap_mode='r'),
+                'ids': np.load(os.path.join(self.path, 'ivf_ids.npy'), mmap_mode='r'),
+                'offsets': np.load(os.path.join(self.path, 'ivf_offsets.npy'), mmap_mode='r'),
+                'count': indexed,
+            }
+        return self._ivf
+
+    def search_ivf(self, queries, k=10, nprobe=8):
+        """
+        Approximate search over the `nprobe` inverted lists closest to each query, probing more
+        lists when those hold fewer than `k` vectors. Vectors appended after the index was built
+        are searched exactly, so none are missed.
+        """
+        ivf = self._load_ivf()
+        queries = normalize(queries)
+        centroids = np.asarray(ivf['centroids'])
+        offsets = np.asarray(ivf['offsets'])
+        list_sizes = np.diff(offsets)
+        unindexed = np.arange(ivf['count'], self.count)
+        found = min(k, self.count)
+        all_ids = np.empty((len(queries), found), dtype=np.int64)
+        all_scores = np.empty((len(queries), found), dtype=np.float32)
+        for i, (query, centroid_scores) in enumerate(zip(queries, queries @ centroids.T)):
+            ranked = np.argsort(-centroid_scores, kind='stable')
+            # Enough of the closest lists to hold `found` candidates together with the unindexed tail
+            covered = np.cumsum(list_sizes[ranked]) + len(unindexed)
+            probe_count = max(nprobe, int(np.searchsorted(covered, found)) + 1)
+            candidate_ids = np.concatenate(
+                [ivf['ids'][offsets[probe]:offsets[probe + 1]] for probe in ranked[:probe_count]] + [unindexed]
+            )
+            candidate_ids.sort()
+            scores = self.get_vectors(candidate_ids) @ query
+            positions, best = top_k(scores[None, :], found)
+            all_ids[i] = candidate_ids[positions[0]]
+            all_scores[i] = best[0]
+        return all_ids, all_scores
+
+    def search(self, queries, k=10, nprobe=8, exact_threshold=50000):
+        """
+        Searches exactly for small stores and with the IVF index (if built) for large ones.
+
+        :param queries: np.ndarray - One query vector or a batch of them.
+        :param k: int - Results per query.
+        :param nprobe: int - IVF lists probed; higher improves recall at the cost of latency.
+        :param exact_threshold: int - Below this many vectors, exact search is used.
+        :return: tuple - `(ids, scores)` arrays of shape (queries, k).
+        """
+        if not self.count:
+            empty = np.empty((len(np.atleast_2d(queries)), 0))
+            return empty.astype(np.int64), empty.astype(np.float32)
+        if self.count >= exact_threshold and self._load_ivf() is not None:
+            return self.search_ivf(queries, k=k, nprobe=nprobe)
+        return self.search_exact(queries, k=k)
@@ -0,0 +1,143 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class OperationCancelled(Exception):
+    """
+    Raised by work that noticed its cancellation token was cancelled.
+    """
+
+
+class CancellationToken:
+    """
+    Cancellation signal handed through a request. Work checks it at safe points, and
+    blocking operations register callbacks that interrupt them (cancelling a running
+    statement, closing a completion stream, killing a process) while they run.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = {}
+        self._next_handle = 0
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        """
+        Cancels the token and runs the registered callbacks (once).
+        """
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks = list(self._callbacks.values())
+            self._callbacks = {}
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                # Interrupting is best effort, the work still stops at its next check
+                pass
+
+    def check(self):
+        if self._event.is_set():
+            raise OperationCancelled("The operation was cancelled.")
+
+    def wait(self, timeout=None):
+        return self._event.wait(timeout)
+
+    def register(self, callback):
+        """
+        Runs `callback` when the token is cancelled (right away if it already is).
+
+        :return: callable - Unregisters the callback.
+        """
+        with self._lock:
+            if not self._event.is_set():
+                handle = self._next_handle
+                self._next_handle += 1
+                self._callbacks[handle] = callback
+                return lambda: self._unregister(handle)
+        callback()
+        return lambda: None
+
+    def _unregister(self, handle):
+        with self._lock:
+            self._callbacks.pop(handle, None)
+
+    @contextmanager
+    def on_cancel(self, callback):
+        """
+        Runs `callback` if the token is cancelled while the block executes.
+        """
+        unregister = self.register(callback)
+        try:
+            yield
+        finally:
+            unregister()
+
+
+_local = threading.local()
+
+
+def current_token():
+    """
+    Returns the token of the request running on this thread, or None.
+    """
+    return getattr(_local, 'token', None)
+
+
+@contextmanager
+def cancellation_scope(token):
+    """
+    Makes `token` the current token of this thread for the duration of the block, so
+    database and LLM calls deep inside a request can be interrupted without passing it
+    through every signature.
+    """
+    previous = current_token()
+    _local.token = token
+    try:
+        yield token
+    finally:
+        _local.token = previous
+
+
+def run_interruptible(function, *args, token=None, heartbeat=None, interval=0.25, **kwargs):
+    """
+    Runs `function(*args, **kwargs)` on a worker thread under a cancellation scope while the
+    calling thread keeps calling `heartbeat(elapsed_seconds)`. If anything interrupts the
+    caller (the heartbeat raising, e.g. Streamlit stopping or rerunning the script), the
+    token is cancelled before the interruption propagates.
+
+    :param token: CancellationToken - The token of the run (a new one if None).
+    :param heartbeat: callable - Called every `interval` seconds while waiting.
+    :return: The function's result.
+    """
+    token = token or CancellationToken()
+    outcome = {}
+
+    def target():
+        with cancellation_scope(token):
+            try:
+                outcome['result'] = function(*args, **kwargs)
+            except BaseException as e:
+                outcome['error'] = e
+
+    worker = threading.Thread(target=target, name='interruptible', daemon=True)
+    started = time.monotonic()
+    worker.start()
+    try:
+        while worker.is_alive():
+            worker.join(interval)
+            if heartbeat is not None and worker.is_alive():
+                heartbeat(time.monotonic() - started)
+    except BaseException:
+        token.cancel()
+        raise
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['result']
@@ -0,0 +1,237 @@
+import re
+import threading
+from collections import OrderedDict
+
+
+SQL_TABLE_PATTERN = re.compile(r'\b(?:FROM|JOIN)\s+([A-Za-z_][\w.]*)', re.IGNORECASE)
+SQL_FILTER_PATTERN = re.compile(r'\b([A-Za-z_][\w.]*)\s*(?:=|ILIKE|LIKE)\s*\'([^\']{1,60})\'', re.IGNORECASE)
+DATAFRAME_COLUMN_PATTERN = re.compile(r'\[\s*[\'"]([^\'"\]]{1,60})[\'"]\s*\]')
+DATAFRAME_FILTER_PATTERN = re.compile(r'\[\s*[\'"]([^\'"\]]{1,60})[\'"]\s*\]\s*==\s*[\'"]([^\'"]{1,60})[\'"]')
+
+
+def estimate_tokens(text):
+    """
+    Cheap token estimate (~4 characters per token) used for budgeting prompts.
+    """
+    return len(text) // 4 + 1
+
+
+def extract_sql_entities(code):
+    """
+    Returns the tables and filtered values referenced by generated code running SQL.
+    """
+    entities = [('table', table) for table in SQL_TABLE_PATTERN.findall(code or '')]
+    entities += [('filter', f'{column} = {value}') for column, value in SQL_FILTER_PATTERN.findall(code or '')]
+    return entities
+
+
+def extract_dataframe_entities(code):
+    """
+    Returns the columns and filtered values referenced by generated pandas code.
+    """
+    entities = [('column', column) for column in DATAFRAME_COLUMN_PATTERN.findall(code or '')]
+    entities += [('filter', f'{column} == {value}') for column, value in DATAFRAME_FILTER_PATTERN.findall(code or '')]
+    return entities
+
+
+class ConversationMemory:
+    """
+    Bounded chat history for the LLM interfaces. Only the most recent messages are kept
+    verbatim (limited by both a message window and a token budget); older turns are
+    condensed into a rolling summary by a background call, and the tables, columns and
+    filter values resolved by earlier answers are kept so follow-ups can reuse them.
+
+    Supports `append`, `len`, iteration and indexing so it can stand in for the plain
+    list previously used as `chat_summary_history`.
+    """
+
+    def __init__(self, summarizer=None, window=4, token_budget=1200, max_summary_tokens=250,
+                 max_entities=40, max_pending_messages=24, entity_extractor=None):
+        """
+        :param summarizer: callable - `summarizer(previous_summary, messages) -> str`, condensing
+                           messages into a summary. Called on a background thread.
+        :param window: int - Maximum number of recent messages sent verbatim.
+        :param token_budget: int - Maximum estimated tokens of the verbatim messages.
+        :param max_summary_tokens: int - Cap on the estimated tokens of the rolling summary.
+        :param max_entities: int - Maximum number of resolved entities kept.
+        :param max_pending_messages: int - Hard cap on messages held in memory while the
+                                     summarizer is catching up.
+        :param entity_extractor: callable - Returns `(kind, name)` pairs from generated code.
+        """
+        self.summarizer = summarizer
+        self.window = window
+        self.token_budget = token_budget
+        self.max_summary_tokens = max_summary_tokens
+        self.max_entities = max_entities
+        self.max_pending_messages = max_pending_messages
+        self.entity_extractor = entity_extractor
+        self.messages = []
+        self.summary = ''
+        self.entities = OrderedDict()
+        self._lock = threading.Lock()
+        self._condensing = None
+        # Changes whenever messages are dropped other than by a background condensation
+        self._generation = 0
+
+    def __len__(self):
+        return len(self.messages)
+
+    def __iter__(self):
+        return iter(list(self.messages))
+
+    def __getitem__(self, item):
+        return self.messages[item]
+
+    def append(self, message):
+        """
+        Adds a chat message (`{'role': ..., 'content': ...}`) and condenses old ones if needed.
+        """
+        with self._lock:
+            self.messages.append(message)
+        self._maybe_condense()
+
+    def add_turn(self, question, answer, code=None):
+        """
+        Records a question/answer pair and the entities resolved by the code behind it.
+        """
+        if code and self.entity_extractor is not None:
+            self.remember(self.entity_extractor(code))
+        with self._lock:
+            self.messages.append({"role": "user", "content": f"User Question:\n{question}"})
+            self.messages.append({"role": "assistant", "content": f"Assistant 2:\n{answer}"})
+        self._maybe_condense()
+
+    def remember(self, entities):
+        """
+        Keeps `(kind, name)` entities, most recently used last, bounded by `max_entities`.
+        """
+        with self._lock:
+            for kind, name in entities:
+                key = (kind, name.strip())
+                self.entities.pop(key, None)
+                self.entities[key] = True
+            while len(self.entities) > self.max_entities:
+                self.entities.popitem(last=False)
+
+    def _recent_messages(self):
+        """
+        Returns the suffix of messages fitting both the window and the token budget.
+        """
+        recent = []
+        used = 0
+        for message in reversed(self.messages[-self.window:] if self.window else []):
+            cost = estimate_tokens(message['content'])
+            if recent and used + cost > self.token_budget:
+                break
+            recent.insert(0, message)
+            used += cost
+        return recent
+
+    def to_messages(self):
+        """
+        Returns the messages to send with the next completion: a compact memory note
+        (summary and resolved entities) followed by the recent messages.
+        """
+        with self._lock:
+            recent = self._recent_messages()
+            notes = []
+            if self.summary:
+                notes.append(f"Summary of the earlier conversation:\n{self.summary}")
+            if self.entities:
+                grouped = OrderedDict()
+                for kind, name in self.entities:
+                    grouped.setdefault(kind, []).append(name)
+                notes.append('Resolved in earlier answers:\n' + '\n'.join(
+                    f"- {kind}s: {', '.join(names)}" for kind, names in grouped.items()
+                ))
+        if not notes:
+            return recent
+        return [{"role": "system", "content": '\n\n'.join(notes)}] + recent
+
+    def to_state(self):
+        """
+        Returns the messages, summary and resolved entities as JSON-serializable data.
+        """
+        with self._lock:
+            return {
+                'messages': list(self.messages),
+                'summary': self.summary,
+                'entities': [list(key) for key in self.entities],
+            }
+
+    def load_state(self, state):
+        """
+        Restores what `to_state` returned.
+        """
+        with self._lock:
+            self._generation += 1
+            self.messages = list(state.get('messages', []))
+            self.summary = state.get('summary', '')
+            self.entities = OrderedDict((tuple(key), True) for key in state.get('entities', []))
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self.messages = []
+            self.summary = ''
+            self.entities.clear()
+
+    def _maybe_condense(self):
+        with self._lock:
+            keep = len(self._recent_messages())
+            # Keep user/assistant pairs together when cutting
+            stale_count = len(self.messages) - keep
+            stale_count -= stale_count % 2
+            if stale_count <= 0:
+                return
+            if len(self.messages) > self.max_pending_messages:
+                # Summarizer is behind: fold the overflow synchronously to cap memory use
+                overflow = self.messages[:stale_count]
+                self._generation += 1
+                self.messages = self.messages[stale_count:]
+                self.summary = self._truncate(self._fallback_summary(self.summary, overflow))
+                return
+            if self.summarizer is None:
+                self.summary = self._truncate(self._fallback_summary(self.summary, self.messages[:stale_count]))
+                self.messages = self.messages[stale_count:]
+                return
+            if self._condensing is not None and self._condensing.is_alive():
+                return
+            stale = self.messages[:stale_count]
+            previous_summary = self.summary
+            self._condensing = threading.Thread(
+                target=self._condense, args=(previous_summary, stale, self._generation), daemon=True
+            )
+            self._condensing.start()
+
+    def _condense(self, previous_summary, stale, generation):
+        try:
+            summary = self.summarizer(previous_summary, stale)
+        except Exception:
+            summary = self._fallback_summary(previous_summary, stale)
+        with self._lock:
+            # The summary only replaces the condensed messages if nothing else (a synchronous
+            # fold, `clear` or `load_state`) changed them or the summary in the meantime
+            current = generation == self._generation and self.messages[:len(stale)] == stale
+            if current:
+                self.messages = self.messages[len(stale):]
+                self.summary = self._truncate(summary or '')
+        if not current:
+            self._maybe_condense()
+
+    def _fallback_summary(self, previous_summary, messages):
+        """
+        Extractive summary used when no summarizer is available or it failed.
+        """
+        lines = [previous_summary] if previous_summary else []
+        for message in messages:
+            first_line = message['content'].split('\n', 2)
+            text = first_line[1] if len(first_line) > 1 else first_line[0]
+            lines.append(f"{message['role']}: {text[:160]}")
+        return '\n'.join(lines)
+
+    def _truncate(self, summary):
+        max_chars = self.max_summary_tokens * 4
+        if len(summary) <= max_chars:
+            return summary
+        return '...' + summary[-max_chars:]
@@ -0,0 +1,465 @@
+import asyncio
+import concurrent.futures
+import copy
+import functools
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import openai
+
+from utils.cancellation import CancellationToken, OperationCancelled
+from utils.tracing import PrometheusExporter, get_exporters
+
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously up to `capacity` every `period` seconds.
+    Only used from the dispatcher's event loop, so it needs no locking.
+    """
+
+    def __init__(self, capacity, period=60.0):
+        self.capacity = float(capacity)
+        self.rate = self.capacity / period
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount):
+        """
+        Waits until `amount` tokens are available and takes them.
+        """
+        amount = min(float(amount), self.capacity)
+        while True:
+            self._refill()
+            if self.level >= amount:
+                self.level -= amount
+                return
+            await asyncio.sleep((amount - self.level) / self.rate)
+
+    def debit(self, amount):
+        """
+        Takes tokens without waiting (the level may go negative), e.g. to correct an estimate.
+        """
+        self._refill()
+        self.level -= amount
+
+
+_local = threading.local()
+
+
+def current_stream():
+    """
+    Returns the callback receiving the text of summaries generated on this thread, or None.
+    """
+    return getattr(_local, 'on_delta', None)
+
+
+@contextmanager
+def stream_scope(on_delta):
+    """
+    Streams the text of the summaries generated on this thread during the block to
+    `on_delta(text)`, piece by piece as the model produces it.
+    """
+    previous = current_stream()
+    _local.on_delta = on_delta
+    try:
+        yield
+    finally:
+        _local.on_delta = previous
+
+
+def _streamed(create, token, on_delta=None):
+    """
+    Wraps a chat completion call so it streams and can be aborted: the stream is closed
+    as soon as the token is cancelled, which stops the generation (and its billing). The
+    chunks are assembled into a response with the usual `choices` and `usage`, while the
+    text of the first choice is also handed to `on_delta` as it arrives. A retried call
+    streams its text again from the start. SDKs predating `stream_options` report no usage,
+    so it is then estimated from the lengths of the prompt and of the completion.
+    """
+    def call(**kwargs):
+        token.check()
+        try:
+            stream = create(stream=True, stream_options={'include_usage': True}, **kwargs)
+        except TypeError:
+            # SDKs predating `stream_options` stream without the usage
+            stream = create(stream=True, **kwargs)
+        contents = {}
+        usage = None
+        with token.on_cancel(stream.close):
+            try:
+                for chunk in stream:
+                    if token.cancelled:
+                        break
+                    for choice in chunk.choices:
+                        contents.setdefault(choice.index, []).append(choice.delta.content or '')
+                        if on_delta is not None and choice.index == 0 and choice.delta.content:
+                            on_delta(choice.delta.content)
+                    if getattr(chunk, 'usage', None) is not None:
+                        usage = chunk.usage
+            except Exception:
+                # Closing the stream from another thread makes the read fail
+                if not token.cancelled:
+                    raise
+        token.check()
+        choices = [
+            SimpleNamespace(index=index, message=SimpleNamespace(role='assistant', content=''.join(parts)))
+            for index, parts in sorted(contents.items())
+        ]
+        if usage is None:
+            prompt_tokens = sum(len(str(message.get('content', ''))) for message in kwargs.get('messages', [])) // 4
+            completion_tokens = sum(len(choice.message.content) for choice in choices) // 4
+            usage = SimpleNamespace(
+                prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                total_tokens=prompt_tokens + completion_tokens
+            )
+        return SimpleNamespace(choices=choices, usage=usage)
+    return call
+
+
+def _uncharged(result):
+    """
+    Returns a shared call's result as handed to the callers that joined the call: with a
+    zero usage, as its tokens are counted by the caller that started it.
+    """
+    if getattr(result, 'usage', None) is None:
+        return result
+    result = copy.copy(result)
+    result.usage = SimpleNamespace(prompt_tokens=0, completion_tokens=0, total_tokens=0)
+    return result
+
+
+class _Job:
+    def __init__(self, create, kwargs, future, estimated_tokens):
+        self.create = create
+        self.kwargs = kwargs
+        self.future = future
+        self.estimated_tokens = estimated_tokens
+        self.enqueued_at = time.monotonic()
+        self.attempt = 0
+
+
+class _Shared:
+    """
+    A queued or running call and the callers waiting for its result. A call that can be
+    cancelled is cancelled once every caller waiting for it has cancelled.
+    """
+
+    def __init__(self, future, token):
+        """
+        :param token: CancellationToken - Aborts the call, or None if it cannot be aborted.
+        """
+        self.future = future
+        self.token = token
+        self.waiters = 0
+        # An uncancellable caller keeps the call alive whatever the others do
+        self.pinned = token is None
+
+
+class LLMDispatcher:
+    """
+    Process-wide queue for OpenAI calls shared by all Streamlit sessions.
+
+    Calls are queued by priority (interactive before background work such as follow-up
+    suggestions), admitted under request and token per-minute budgets, executed on a
+    bounded worker pool driven by an asyncio loop on a background thread, and retried
+    with jittered exponential backoff on rate limits, server errors and connection
+    failures. Identical requests already in flight share one call, whose usage is reported
+    to the caller that started it only.
+    """
+
+    def __init__(self, requests_per_minute=3500, tokens_per_minute=90000, concurrency=8,
+                 max_retries=5, base_delay=0.5, max_delay=20.0):
+        """
+        :param requests_per_minute: int - Request budget per minute.
+        :param tokens_per_minute: int - Token budget per minute (prompt plus completion).
+        :param concurrency: int - Maximum number of calls running at the same time.
+        :param max_retries: int - Retries for a call failing with a retryable error.
+        :param base_delay: float - Initial backoff delay in seconds.
+        :param max_delay: float - Maximum backoff delay in seconds.
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._lock = threading.RLock()
+        self._in_flight = {}
+        self._sequence = itertools.count()
+        self._loop = None
+        self._queue = None
+
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._retries = 0
+        self._coalesced = 0
+        self._wait_times = deque(maxlen=1000)
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._loop is not None:
+                return
+            self._loop = asyncio.new_event_loop()
+            ready = threading.Event()
+            threading.Thread(target=self._run_loop, args=(ready,), name='llm-dispatcher', daemon=True).start()
+        ready.wait()
+
+    def _run_loop(self, ready):
+        asyncio.set_event_loop(self._loop)
+        self._queue = asyncio.PriorityQueue()
+        self._requests_bucket = TokenBucket(self.requests_per_minute)
+        self._tokens_bucket = TokenBucket(self.tokens_per_minute)
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.concurrency, thread_name_prefix='llm-call'
+        )
+        for _ in range(self.concurrency):
+            self._loop.create_task(self._worker())
+        self._loop.call_soon(ready.set)
+        self._loop.run_forever()
+
+    @staticmethod
+    def estimate_tokens(kwargs):
+        """
+        Rough token estimate of a chat completion request (prompt plus maximum completion)
+        or of an embedding request (its inputs only).
+        """
+        if 'input' in kwargs:
+            inputs = kwargs['input'] if isinstance(kwargs['input'], list) else [kwargs['input']]
+            return sum(len(str(text)) for text in inputs) // 4
+        prompt_chars = sum(len(str(message.get('content', ''))) for message in kwargs.get('messages', []))
+        completion_tokens = kwargs.get('max_tokens') or 500
+        return prompt_chars // 4 + completion_tokens * kwargs.get('n', 1)
+
+    @staticmethod
+    def _coalesce_key(create, kwargs):
+        if kwargs.get('stream'):
+            return None
+        try:
+            payload = json.dumps(kwargs, sort_keys=True, default=str)
+        except (TypeError, ValueError):
+            return None
+        # The bound client identifies the API key the call is billed to
+        return id(getattr(create, '__self__', create)), payload
+
+    def submit(self, create, priority=PRIORITY_INTERACTIVE, cancel_token=None, on_delta=None, **kwargs):
+        """
+        Queues `create(**kwargs)` and returns a `concurrent.futures.Future` for its result.
+        The future exposes `queue_wait_ms` once the call has started.
+
+        :param create: callable - The blocking SDK call, e.g. `client.chat.completions.create`.
+        :param priority: int - Lower runs first; see `PRIORITY_INTERACTIVE` and `PRIORITY_BACKGROUND`.
+        :param cancel_token: CancellationToken - Makes the caller's wait abortable: its future is
+            cancelled when the token is, and the chat completion itself is dropped from the
+            queue, or its stream closed, once no other caller shares it.
+        :param on_delta: callable - Streams the chat completion, passing its text to `on_delta` as it
+            arrives. Such a call is never shared.
+        """
+        self._ensure_started()
+        if cancel_token is not None:
+            cancel_token.check()
+        key = None if on_delta is not None else self._coalesce_key(create, kwargs)
+        with self._lock:
+            shared = self._in_flight.get(key) if key is not None else None
+            charged = shared is None
+            if shared is not None:
+                self._coalesced += 1
+            else:
+                # Cancellable calls stream, so closing the stream aborts the generation
+                token = CancellationToken() if cancel_token is not None or on_delta is not None else None
+                shared = _Shared(concurrent.futures.Future(), token)
+                shared.future.queue_wait_ms = 0.0
+                if key is not None:
+                    self._in_flight[key] = shared
+                    shared.future.add_done_callback(lambda _: self._forget(key, shared))
+                self._queued += 1
+                call = _streamed(create, token, on_delta) if token is not None else create
+                job = _Job(call, kwargs, shared.future, self.estimate_tokens(kwargs))
+                self._loop.call_soon_threadsafe(self._enqueue, priority, job)
+            if cancel_token is None:
+                shared.pinned = True
+                if charged:
+                    return shared.future
+            else:
+                shared.waiters += 1
+        return self._wait_for(shared, key, cancel_token, charged)
+
+    def _wait_for(self, shared, key, cancel_token, charged):
+        """
+        Returns a future of the shared call's result for one caller.
+
+        :param cancel_token: CancellationToken - Makes the wait abortable, if given.
+        :param charged: bool - Whether the caller started the call and is reported its usage.
+        """
+        future = concurrent.futures.Future()
+        future.queue_wait_ms = 0.0
+
+        def deliver(done):
+            future.queue_wait_ms = done.queue_wait_ms
+            if not future.set_running_or_notify_cancel():
+                return
+            if done.cancelled():
+                future.set_exception(OperationCancelled("The operation was cancelled."))
+            elif done.exception() is not None:
+                future.set_exception(done.exception())
+            else:
+                future.set_result(done.result() if charged else _uncharged(done.result()))
+
+        if cancel_token is None:
+            shared.future.add_done_callback(deliver)
+            return future
+
+        def cancel():
+            if not future.cancel():
+                return
+            with self._lock:
+                shared.waiters -= 1
+                abandoned = shared.waiters == 0 and not shared.pinned
+                if abandoned:
+                    # Later identical requests start afresh rather than join a call being aborted
+                    self._forget(key, shared)
+            if abandoned:
+                # Queued calls are dropped; running ones stop through their stream
+                shared.future.cancel()
+                shared.token.cancel()
+
+        unregister = cancel_token.register(cancel)
+        future.add_done_callback(lambda _: unregister())
+        shared.future.add_done_callback(deliver)
+        return future
+
+    def call(self, create, priority=PRIORITY_INTERACTIVE, cancel_token=None, on_delta=None, **kwargs):
+        """
+        Blocking variant of `submit`, returning the call's result or raising its error.
+        """
+        return self.submit(create, priority=priority, cancel_token=cancel_token, on_delta=on_delta, **kwargs).result()
+
+    def _forget(self, key, shared):
+        with self._lock:
+            if key is not None and self._in_flight.get(key) is shared:
+                del self._in_flight[key]
+
+    def _enqueue(self, priority, job):
+        self._queue.put_nowait((priority, next(self._sequence), job))
+
+    def _is_retryable(self, error):
+        if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+            return True
+        status_code = getattr(error, 'status_code', None)
+        return status_code is not None and (status_code == 429 or status_code >= 500)
+
+    def _backoff_delay(self, error, attempt):
+        response = getattr(error, 'response', None)
+        retry_after = response.headers.get('retry-after') if response is not None else None
+        try:
+            if retry_after is not None:
+                return min(self.max_delay, float(retry_after)) + random.uniform(0, self.base_delay)
+        except ValueError:
+            pass
+        # Full jitter keeps sessions that failed together from retrying together
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def _worker(self):
+        while True:
+            priority, _, job = await self._queue.get()
+            if job.attempt == 0:
+                if not job.future.set_running_or_notify_cancel():
+                    with self._lock:
+                        self._queued -= 1
+                    continue
+                wait_ms = (time.monotonic() - job.enqueued_at) * 1000
+                job.future.queue_wait_ms = wait_ms
+                with self._lock:
+                    self._queued -= 1
+                    self._wait_times.append(wait_ms)
+
+            await self._requests_bucket.acquire(1)
+            await self._tokens_bucket.acquire(job.estimated_tokens)
+            with self._lock:
+                self._running += 1
+            try:
+                result = await self._loop.run_in_executor(
+                    self._executor, functools.partial(job.create, **job.kwargs)
+                )
+            except Exception as e:
+                if self._is_retryable(e) and job.attempt < self.max_retries:
+                    delay = self._backoff_delay(e, job.attempt)
+                    job.attempt += 1
+                    with self._lock:
+                        self._retries += 1
+                    self._loop.call_later(delay, self._enqueue, priority, job)
+                else:
+                    with self._lock:
+                        self._failed += 1
+                    job.future.set_exception(e)
+            else:
+                usage = getattr(result, 'usage', None)
+                if usage is not None and getattr(usage, 'total_tokens', None) is not None:
+                    self._tokens_bucket.debit(usage.total_tokens - job.estimated_tokens)
+                with self._lock:
+                    self._completed += 1
+                job.future.set_result(result)
+            finally:
+                with self._lock:
+                    self._running -= 1
+
+    def metrics(self):
+        """
+        Returns queue depth, throughput counters and wait-time statistics (milliseconds).
+        """
+        with self._lock:
+            waits = sorted(self._wait_times)
+            metrics = {
+                'llm_queue_depth': self._queued,
+                'llm_in_flight': self._running,
+                'llm_completed_total': self._completed,
+                'llm_failed_total': self._failed,
+                'llm_retries_total': self._retries,
+                'llm_coalesced_total': self._coalesced,
+            }
+        if waits:
+            metrics['llm_queue_wait_ms_avg'] = round(sum(waits) / len(waits), 3)
+            metrics['llm_queue_wait_ms_p50'] = round(waits[len(waits) // 2], 3)
+            metrics['llm_queue_wait_ms_p95'] = round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 3)
+        return metrics
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    """
+    Returns the process-wide dispatcher, configured from the `LLM_REQUESTS_PER_MINUTE`,
+    `LLM_TOKENS_PER_MINUTE` and `LLM_MAX_CONCURRENCY` environment variables.
+    """
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = LLMDispatcher(
+                requests_per_minute=int(os.environ.get('LLM_REQUESTS_PER_MINUTE', 3500)),
+                tokens_per_minute=int(os.environ.get('LLM_TOKENS_PER_MINUTE', 90000)),
+                concurrency=int(os.environ.get('LLM_MAX_CONCURRENCY', 8)),
+            )
+            for exporter in get_exporters():
+                if isinstance(exporter, PrometheusExporter):
+                    exporter.register_collector(_dispatcher.metrics)
+        return _dispatcher
@@ -0,0 +1,17 @@
+import re
+import threading
+from contextlib import nullcontext
+
+
+PLOT_PATTERN = re.compile(r'\b(?:matplotlib|pyplot|plt|seaborn|sns)\b')
+
+# pyplot draws on one current figure per process, so code using it runs one snippet at a time
+_plot_lock = threading.Lock()
+
+
+def plotting(snippet):
+    """
+    Returns a context manager to execute generated code in: it holds the process-wide plot
+    lock when the code draws with pyplot, and does nothing otherwise.
+    """
+    return _plot_lock if PLOT_PATTERN.search(snippet or '') else nullcontext()
@@ -0,0 +1,164 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from utils.cancellation import CancellationToken, cancellation_scope
+
+
+class PrefetchCancelled(Exception):
+    """
+    Raised inside prefetch work when it was cancelled or ran out of budget.
+    """
+
+
+class PrefetchBudget:
+    """
+    Token and query budget shared by the prefetches started for one set of suggestions.
+    """
+
+    def __init__(self, token_budget, query_budget):
+        self.token_budget = token_budget
+        self.query_budget = query_budget
+        self.tokens_used = 0
+        self.queries_used = 0
+        self._lock = threading.Lock()
+
+
+class PrefetchTicket:
+    """
+    Handle given to one prefetch task to check for cancellation and spend the shared budget.
+    The task runs under the ticket's cancellation token, so cancelling the ticket also
+    interrupts the completion or query it is waiting on.
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.cancelled = threading.Event()
+        self.token = CancellationToken()
+
+    def cancel(self):
+        self.cancelled.set()
+        self.token.cancel()
+
+    def check(self):
+        if self.cancelled.is_set():
+            raise PrefetchCancelled("Prefetch was cancelled.")
+        if self.budget.tokens_used >= self.budget.token_budget:
+            raise PrefetchCancelled("Prefetch token budget exhausted.")
+
+    def charge_tokens(self, tokens):
+        with self.budget._lock:
+            self.budget.tokens_used += tokens
+
+    def take_query(self):
+        """
+        Reserves one database query from the budget.
+        """
+        self.check()
+        with self.budget._lock:
+            if self.budget.queries_used >= self.budget.query_budget:
+                raise PrefetchCancelled("Prefetch query budget exhausted.")
+            self.budget.queries_used += 1
+
+
+class Prefetcher:
+    """
+    Speculatively runs work for questions the user is likely to ask next (the suggested
+    follow-ups) on a small background pool, keeping the results in a short-lived cache.
+
+    Each call to `prefetch` replaces the earlier prefetches. Taking a cached result, or
+    asking anything else, cancels the other prefetches.
+    """
+
+    def __init__(self, ttl=120, max_workers=2, token_budget=6000, query_budget=5):
+        """
+        :param ttl: int - Seconds a prefetched result stays usable.
+        :param max_workers: int - Prefetches running at the same time.
+        :param token_budget: int - LLM tokens one round may spend.
+        :param query_budget: int - Database queries one round may run.
+        """
+        self.ttl = ttl
+        self.token_budget = token_budget
+        self.query_budget = query_budget
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='prefetch')
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.stats = {'started': 0, 'hits': 0, 'misses': 0, 'late': 0, 'cancelled': 0}
+
+    def prefetch(self, questions, task, context_version=None):
+        """
+        Starts `task(question, ticket)` for each question, replacing any earlier prefetches.
+
+        :param questions: list - The questions to prefetch.
+        :param task: callable - Produces the result for one question; raises PrefetchCancelled to stop.
+        :param context_version: object - State the results depend on; a lookup with another version misses.
+        """
+        self.cancel()
+        budget = PrefetchBudget(self.token_budget, self.query_budget)
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            for question in questions:
+                ticket = PrefetchTicket(budget)
+                future = self._executor.submit(self._run, task, question, ticket)
+                self._entries[question.strip()] = (context_version, expires_at, future, ticket)
+                self.stats['started'] += 1
+
+    @staticmethod
+    def _run(task, question, ticket):
+        with cancellation_scope(ticket.token):
+            return task(question, ticket)
+
+    def take(self, question, context_version=None):
+        """
+        Returns the future of a prefetched result for the question, or None. Either way the
+        other prefetches are cancelled, as the conversation moves on.
+        """
+        with self._lock:
+            entry = self._entries.pop(question.strip(), None)
+        self.cancel()
+        if entry is None or entry[0] != context_version or entry[1] < time.monotonic() or entry[2].cancelled():
+            if entry is not None:
+                entry[3].cancel()
+            self.stats['misses'] += 1
+            return None
+        self.stats['hits'] += 1
+        return entry[2]
+
+    def wait(self, question, context_version=None, timeout=None):
+        """
+        Takes the prefetched result for the question (see `take`), waiting at most `timeout`
+        seconds for it. A prefetch that is not ready by then, e.g. starved by interactive work,
+        is cancelled so the question can be answered afresh without waiting any longer.
+
+        :return: object - The result, or None if there is none, it failed or it was late.
+        """
+        with self._lock:
+            entry = self._entries.get(question.strip())
+        future = self.take(question, context_version=context_version)
+        if future is None:
+            return None
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            entry[3].cancel()
+            future.cancel()
+            self.stats['late'] += 1
+            return None
+        except Exception:
+            return None
+
+    def cancel(self):
+        """
+        Cancels all pending prefetches: queued ones are dropped and running ones have their
+        in-flight completion or query interrupted.
+        """
+        with self._lock:
+            for _, _, future, ticket in self._entries.values():
+                ticket.cancel()
+                if future.cancel() or future.running():
+                    self.stats['cancelled'] += 1
+            self._entries = {}
+
+    def shutdown(self):
+        self.cancel()
+        self._executor.shutdown(wait=False)
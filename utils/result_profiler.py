@@ -0,0 +1,284 @@
+import datetime
+import decimal
+
+import numpy as np
+import pandas as pd
+
+
+def _format_number(value):
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return 'n/a'
+    return f'{value:,.4g}' if abs(value) < 1e15 else f'{value:.3e}'
+
+
+class _NumericColumn:
+    """
+    Count, extremes, mean and variance merged batch by batch (Chan et al.), a fixed-size
+    uniform sample for quantiles, and least-squares sums for the trend against the
+    profiler's x axis.
+    """
+
+    kind = 'numeric'
+
+    def __init__(self, sample_size, rng):
+        self.sample_size = sample_size
+        self.rng = rng
+        self.count = 0
+        self.nulls = 0
+        self.minimum = np.inf
+        self.maximum = -np.inf
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.total = 0.0
+        # Keeping the values with the smallest random keys is a uniform sample of everything seen
+        self.sample = np.empty(0)
+        self.sample_keys = np.empty(0)
+        self.trend = np.zeros(6)  # n, sum x, sum y, sum xy, sum xx, sum yy
+
+    def update(self, series, x):
+        values = pd.to_numeric(series, errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+        valid = ~np.isnan(values)
+        self.nulls += int(len(values) - valid.sum())
+        values, x = values[valid], x[valid]
+        if not len(values):
+            return
+        n = len(values)
+        batch_mean = values.mean()
+        delta = batch_mean - self.mean
+        total_count = self.count + n
+        self.m2 += ((values - batch_mean) ** 2).sum() + delta ** 2 * self.count * n / total_count
+        self.mean += delta * n / total_count
+        self.count = total_count
+        self.total += values.sum()
+        self.minimum = min(self.minimum, values.min())
+        self.maximum = max(self.maximum, values.max())
+
+        keys = self.rng.random(n)
+        sample = np.concatenate([self.sample, values])
+        sample_keys = np.concatenate([self.sample_keys, keys])
+        if len(sample) > self.sample_size:
+            keep = np.argpartition(sample_keys, self.sample_size)[:self.sample_size]
+            sample, sample_keys = sample[keep], sample_keys[keep]
+        self.sample, self.sample_keys = sample, sample_keys
+
+        on_axis = ~np.isnan(x)
+        xs, ys = x[on_axis], values[on_axis]
+        self.trend += [len(xs), xs.sum(), ys.sum(), (xs * ys).sum(), (xs * xs).sum(), (ys * ys).sum()]
+
+    def describe(self, axis_unit):
+        if not self.count:
+            return f'all {self.nulls} values empty'
+        std = np.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+        q25, q50, q75 = np.quantile(self.sample, [0.25, 0.5, 0.75])
+        parts = [
+            f'min {_format_number(self.minimum)}', f'p25 {_format_number(q25)}', f'median {_format_number(q50)}',
+            f'p75 {_format_number(q75)}', f'max {_format_number(self.maximum)}', f'mean {_format_number(self.mean)}',
+            f'std {_format_number(std)}', f'sum {_format_number(self.total)}',
+        ]
+        if self.nulls:
+            parts.append(f'{self.nulls} empty')
+        n, sx, sy, sxy, sxx, syy = self.trend
+        if n > 2:
+            var_x, var_y, cov = n * sxx - sx * sx, n * syy - sy * sy, n * sxy - sx * sy
+            if var_x > 0 and var_y > 0:
+                r = cov / np.sqrt(var_x * var_y)
+                # Only trends that explain a fair share of the variation are worth mentioning
+                if abs(r) >= 0.3:
+                    parts.append(f'trend {cov / var_x:+.4g} per {axis_unit} (r={r:.2f})')
+        return ', '.join(parts)
+
+
+class _CategoricalColumn:
+    """
+    Misra-Gries heavy hitters: at most `capacity` counters, so memory stays bounded
+    whatever the number of distinct values; counts become lower bounds once values
+    had to be dropped.
+    """
+
+    kind = 'text'
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.count = 0
+        self.nulls = 0
+        self.counters = {}
+        self.approximate = False
+
+    def update(self, series, x):
+        try:
+            counts = series.value_counts(dropna=True)
+        except TypeError:
+            # Unhashable values such as JSON arrays are counted by their text
+            counts = series.dropna().astype(str).value_counts()
+        self.nulls += int(len(series) - counts.sum())
+        self.count += int(counts.sum())
+        for value, count in counts.items():
+            self.counters[value] = self.counters.get(value, 0) + int(count)
+        if len(self.counters) > self.capacity:
+            self.approximate = True
+            ranked = sorted(self.counters.values(), reverse=True)
+            cut = ranked[self.capacity]
+            self.counters = {value: count - cut for value, count in self.counters.items() if count > cut}
+
+    def describe(self, top=5, max_chars=40):
+        if not self.count:
+            return f'all {self.nulls} values empty'
+        distinct = f'over {self.capacity} distinct' if self.approximate else f'{len(self.counters)} distinct'
+        ranked = sorted(self.counters.items(), key=lambda item: -item[1])[:top]
+        parts = [distinct]
+        if ranked:
+            parts.append('top: ' + ', '.join(
+                f'{str(value)[:max_chars]} {"≥" if self.approximate else ""}{count / self.count:.0%}' for value, count in ranked
+            ))
+        else:
+            parts.append('no frequent values')
+        if self.nulls:
+            parts.append(f'{self.nulls} empty')
+        return ', '.join(parts)
+
+
+def _to_utc_naive(series):
+    """
+    Parses dates, converting time zone aware ones (e.g. timestamptz values) to UTC so they
+    compare and subtract like naive ones.
+    """
+    return pd.to_datetime(series, errors='coerce', utc=True).dt.tz_localize(None)
+
+
+class _DatetimeColumn:
+    kind = 'date'
+
+    def __init__(self):
+        self.count = 0
+        self.nulls = 0
+        self.minimum = None
+        self.maximum = None
+        self.zoned = False
+
+    def update(self, series, x):
+        sample = series.dropna()
+        if isinstance(series.dtype, pd.DatetimeTZDtype) or (len(sample) and getattr(sample.iloc[0], 'tzinfo', None) is not None):
+            self.zoned = True
+        values = _to_utc_naive(series)
+        valid = values.dropna()
+        self.nulls += int(len(values) - len(valid))
+        if not len(valid):
+            return
+        self.count += len(valid)
+        low, high = valid.min(), valid.max()
+        self.minimum = low if self.minimum is None else min(self.minimum, low)
+        self.maximum = high if self.maximum is None else max(self.maximum, high)
+
+    def describe(self):
+        if not self.count:
+            return f'all {self.nulls} values empty'
+        suffix = ' UTC' if self.zoned else ''
+        parts = [f'from {self.minimum}{suffix} to {self.maximum}{suffix}']
+        if self.nulls:
+            parts.append(f'{self.nulls} empty')
+        return ', '.join(parts)
+
+
+class ResultProfiler:
+    """
+    Single-pass profile of a query result fed in batches, so the complete result can be
+    described without keeping it in memory: per-column aggregates, quantiles from a
+    bounded sample, top categories and linear trends (against the first date column, or
+    the row order when there is none).
+
+    The digest is rendered within a token budget for the summarizing prompt.
+    """
+
+    def __init__(self, sample_size=4096, max_categories=256, seed=0):
+        """
+        :param sample_size: int - Values kept per numeric column for the quantiles.
+        :param max_categories: int - Counters kept per text column for the top categories.
+        """
+        self.sample_size = sample_size
+        self.max_categories = max_categories
+        self.rng = np.random.default_rng(seed)
+        self.rows = 0
+        self.columns = {}
+        self.axis = None
+
+    def _column_for(self, series):
+        sample = series.dropna()
+        if pd.api.types.is_bool_dtype(series):
+            return _CategoricalColumn(self.max_categories)
+        if pd.api.types.is_numeric_dtype(series):
+            return _NumericColumn(self.sample_size, self.rng)
+        if pd.api.types.is_datetime64_any_dtype(series):
+            return _DatetimeColumn()
+        if not len(sample):
+            return None
+        first = sample.iloc[0]
+        # Database drivers hand NUMERIC and DATE values over as Python objects
+        if isinstance(first, (decimal.Decimal, int, float)) and not isinstance(first, bool):
+            return _NumericColumn(self.sample_size, self.rng)
+        if isinstance(first, (datetime.date, datetime.datetime)):
+            return _DatetimeColumn()
+        return _CategoricalColumn(self.max_categories)
+
+    def update(self, batch):
+        """
+        Adds a batch of rows.
+
+        :param batch: pd.DataFrame or list - The rows, as a DataFrame or a list of dicts.
+        """
+        if not isinstance(batch, pd.DataFrame):
+            batch = pd.DataFrame.from_records(batch)
+        if batch.empty:
+            return
+        for name in batch.columns:
+            if self.columns.get(name) is None:
+                self.columns[name] = self._column_for(batch[name])
+        if self.axis is None:
+            self.axis = next(
+                (name for name, column in self.columns.items() if isinstance(column, _DatetimeColumn)), '#row'
+            )
+        if self.axis == '#row':
+            x = np.arange(self.rows, self.rows + len(batch), dtype=float)
+        elif self.axis in batch.columns:
+            dates = _to_utc_naive(batch[self.axis])
+            # Days since the epoch keep the sums well within float precision
+            x = ((dates - pd.Timestamp(0)) / pd.Timedelta(days=1)).to_numpy(dtype=float, na_value=np.nan)
+        else:
+            x = np.full(len(batch), np.nan)
+        for name, column in self.columns.items():
+            if column is not None and name in batch.columns:
+                column.update(batch[name], x)
+        self.rows += len(batch)
+
+    def digest(self, token_budget=400):
+        """
+        Renders the profile, one line per column, stopping before the budget is exceeded.
+
+        :param token_budget: int - Approximate number of tokens the digest may use.
+        :return: str - The digest.
+        """
+        axis_unit = 'row' if self.axis in (None, '#row') else f'day ({self.axis})'
+        lines = [f'{self.rows} rows, {len(self.columns)} columns']
+        budget = token_budget * 4 - len(lines[0])
+        for shown, (name, column) in enumerate(self.columns.items()):
+            if column is None:
+                line = f'- {name}: all {self.rows} values empty'
+            elif isinstance(column, _NumericColumn):
+                line = f'- {name} ({column.kind}): {column.describe(axis_unit)}'
+            else:
+                line = f'- {name} ({column.kind}): {column.describe()}'
+            if len(line) + 1 > budget:
+                lines.append(f'- ... {len(self.columns) - shown} more columns')
+                break
+            budget -= len(line) + 1
+            lines.append(line)
+        return '\n'.join(lines)
+
+
+def profile_dataframe(df, token_budget=400, batch_size=50000):
+    """
+    Profiles a DataFrame in slices and returns its digest.
+    """
+    profiler = ResultProfiler()
+    for start in range(0, len(df), batch_size):
+        profiler.update(df.iloc[start:start + batch_size])
+    return profiler.digest(token_budget)
@@ -0,0 +1,96 @@
+import multiprocessing
+import time
+from multiprocessing.connection import wait
+
+
+# Children are forked from a fork server, a fresh single-threaded interpreter started on first
+# use, never from the application process: forking it would copy locks held by its other
+# threads (dispatcher, prefetches, exporters) into a child that could then never take them.
+# Payloads and the executed function are pickled, so the function must be module-level.
+_context = multiprocessing.get_context(
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+)
+
+
+def preload(modules):
+    """
+    Imports modules once in the fork server, so children start without importing them.
+    Only effective before the first race.
+    """
+    if _context.get_start_method() == 'forkserver':
+        _context.set_forkserver_preload(list(modules))
+
+
+def _child(execute, payload, connection):
+    try:
+        outcome = execute(payload)
+    except BaseException as e:
+        outcome = {'error': str(e), 'is_code_generated': False}
+    try:
+        connection.send(outcome)
+    except Exception as e:
+        # e.g. a result that cannot be pickled
+        connection.send({'error': f'The result could not be returned: {e}', 'is_code_generated': False})
+    connection.close()
+
+
+def race(payloads, execute, is_valid, timeout=20, cancel_token=None):
+    """
+    Runs `execute(payload)` for every payload concurrently, each in its own process,
+    and returns as soon as one outcome is valid. The other processes are killed, so a
+    slow or stuck candidate cannot outlive the race.
+
+    :param payloads: list - The inputs, e.g. code candidates.
+    :param execute: callable - Module-level function running one payload in the child process and
+        returning a picklable outcome.
+    :param is_valid: callable - Tells whether an outcome is acceptable.
+    :param timeout: float - Seconds after which the remaining processes are killed.
+    :param cancel_token: CancellationToken - Kills all processes and raises OperationCancelled when cancelled.
+    :return: dict - 'winner' (index or None), 'outcomes' (by index, for the finished payloads),
+        'timed_out' (indices) and 'elapsed_ms'.
+    """
+    started = time.monotonic()
+    deadline = started + timeout
+    running = {}
+    for index, payload in enumerate(payloads):
+        receiver, sender = _context.Pipe(duplex=False)
+        process = _context.Process(target=_child, args=(execute, payload, sender), daemon=True)
+        process.start()
+        sender.close()
+        running[receiver] = (index, process)
+
+    outcomes = {}
+    winner = None
+    processes = [process for _, process in running.values()]
+    try:
+        while running and winner is None:
+            if cancel_token is not None:
+                cancel_token.check()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if cancel_token is not None:
+                remaining = min(remaining, 0.1)
+            # Among candidates finishing together, the earlier one wins
+            for receiver in sorted(wait(list(running), timeout=remaining), key=lambda r: running[r][0]):
+                index, _ = running.pop(receiver)
+                try:
+                    outcome = receiver.recv()
+                except EOFError:
+                    outcome = {'error': 'The process exited without a result.', 'is_code_generated': False}
+                receiver.close()
+                outcomes[index] = outcome
+                if winner is None and is_valid(outcome):
+                    winner = index
+    finally:
+        for receiver, (_, process) in running.items():
+            process.kill()
+            receiver.close()
+        for process in processes:
+            process.join(timeout=1)
+    return {
+        'winner': winner,
+        'outcomes': outcomes,
+        'timed_out': sorted(index for index, _ in running.values()) if winner is None else [],
+        'elapsed_ms': round((time.monotonic() - started) * 1000, 3),
+    }
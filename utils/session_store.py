@@ -0,0 +1,317 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+
+# Text columns whose distinct values would take more than this as fixed-width NumPy strings are pickled
+MAX_FIXED_WIDTH_BYTES = 256 << 20
+
+
+class ColumnarCache:
+    """
+    DataFrames stored once, column by column, as NumPy files that are memory-mapped back:
+    numeric, boolean and datetime columns load without being read, and text columns are
+    kept as codes into their distinct values. Datasets are immutable and referenced by key,
+    so sessions point at them instead of embedding them.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, mode=0o700, exist_ok=True)
+
+    def _save_column(self, directory, name, series):
+        """
+        Writes one column and returns how to read it back.
+        """
+        dtype = series.dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            np.save(os.path.join(directory, f'{name}.codes.npy'), series.cat.codes.to_numpy())
+            categories = self._save_column(directory, f'{name}.categories', series.cat.categories.to_series())
+            return {'encoding': 'category', 'categories': categories, 'ordered': bool(dtype.ordered)}
+        if isinstance(dtype, pd.DatetimeTZDtype):
+            np.save(os.path.join(directory, f'{name}.npy'), series.dt.tz_convert('UTC').dt.tz_localize(None).to_numpy())
+            return {'encoding': 'datetime_tz', 'tz': str(dtype.tz)}
+        if isinstance(dtype, np.dtype) and dtype.kind in 'biufcmM':
+            np.save(os.path.join(directory, f'{name}.npy'), series.to_numpy())
+            return {'encoding': 'numpy'}
+        if isinstance(dtype, pd.api.extensions.ExtensionDtype) and dtype.kind in 'biuf' and hasattr(dtype, 'numpy_dtype'):
+            # Nullable integers, floats and booleans: their values with a mask of the missing ones
+            numpy_dtype = dtype.numpy_dtype
+            np.save(os.path.join(directory, f'{name}.npy'), series.to_numpy(dtype=numpy_dtype, na_value=numpy_dtype.type(0)))
+            np.save(os.path.join(directory, f'{name}.mask.npy'), series.isna().to_numpy())
+            return {'encoding': 'masked', 'dtype': str(dtype)}
+        try:
+            codes, uniques = pd.factorize(series, use_na_sentinel=True)
+        except TypeError:
+            # Unhashable values (e.g. dicts or lists) are pickled
+            uniques = None
+        if uniques is not None and all(isinstance(value, str) for value in uniques):
+            values = np.asarray(uniques, dtype=object)
+            width = max((len(value) for value in values), default=0)
+            if width * len(values) * 4 <= MAX_FIXED_WIDTH_BYTES:
+                np.save(os.path.join(directory, f'{name}.codes.npy'), codes.astype(np.int32))
+                np.save(os.path.join(directory, f'{name}.values.npy'), values.astype(str))
+                return {'encoding': 'text', 'dtype': str(dtype)}
+        np.save(os.path.join(directory, f'{name}.npy'), series.to_numpy(dtype=object), allow_pickle=True)
+        return {'encoding': 'pickle', 'dtype': str(dtype)}
+
+    @staticmethod
+    def _map(path, mode='c'):
+        # A plain array over the mapping, so pandas sees an ndarray rather than a memmap
+        return np.load(path, mmap_mode=mode).view(np.ndarray)
+
+    @staticmethod
+    def _load_column(directory, name, spec):
+        path = os.path.join(directory, name)
+        encoding = spec['encoding']
+        if encoding == 'numpy':
+            # Copy-on-write mapping: pages are read on access and writes stay in memory
+            return pd.Series(ColumnarCache._map(f'{path}.npy'), copy=False)
+        if encoding == 'datetime_tz':
+            return pd.Series(ColumnarCache._map(f'{path}.npy'), copy=False).dt.tz_localize('UTC').dt.tz_convert(spec['tz'])
+        if encoding == 'masked':
+            values, mask = ColumnarCache._map(f'{path}.npy'), ColumnarCache._map(f'{path}.mask.npy')
+            array_type = {'b': pd.arrays.BooleanArray, 'f': pd.arrays.FloatingArray}.get(values.dtype.kind, pd.arrays.IntegerArray)
+            return pd.Series(array_type(values, mask), copy=False)
+        if encoding == 'category':
+            categories = ColumnarCache._load_column(directory, f'{name}.categories', spec['categories'])
+            codes = np.load(f'{path}.codes.npy')
+            return pd.Series(pd.Categorical.from_codes(codes, categories=categories, ordered=spec['ordered']))
+        if encoding == 'text':
+            # The trailing missing value is what the -1 codes of missing entries pick
+            values = np.append(np.load(f'{path}.values.npy').astype(object), np.nan)
+            return pd.Series(values[ColumnarCache._map(f'{path}.codes.npy', 'r')], dtype=spec['dtype'])
+        return pd.Series(np.load(f'{path}.npy', allow_pickle=True), dtype=spec['dtype'])
+
+    def put(self, df):
+        """
+        Stores a DataFrame.
+
+        :return: str - The key to `get` it back with.
+        """
+        key = uuid.uuid4().hex
+        staging = os.path.join(self.root, f'.{key}')
+        os.makedirs(staging)
+        columns = [
+            {'name': name, **self._save_column(staging, f'c{position}', df[name])}
+            for position, name in enumerate(df.columns)
+        ]
+        index = None
+        if not isinstance(df.index, pd.RangeIndex) or df.index.start != 0 or df.index.step != 1:
+            index = self._save_column(staging, 'index', df.index.to_series(index=None))
+        with open(os.path.join(staging, 'columns.json'), 'w') as f:
+            json.dump({'rows': len(df), 'columns': columns, 'index': index}, f)
+        # A dataset appears complete or not at all
+        os.rename(staging, os.path.join(self.root, key))
+        return key
+
+    def get(self, key):
+        """
+        Loads a stored DataFrame.
+        """
+        directory = os.path.join(self.root, key)
+        with open(os.path.join(directory, 'columns.json')) as f:
+            layout = json.load(f)
+        df = pd.DataFrame({
+            column['name']: self._load_column(directory, f'c{position}', column)
+            for position, column in enumerate(layout['columns'])
+        }, copy=False)
+        if layout['index'] is not None:
+            df.index = pd.Index(self._load_column(directory, 'index', layout['index']))
+        elif not layout['columns']:
+            df = pd.DataFrame(index=pd.RangeIndex(layout['rows']))
+        return df
+
+    def keys(self):
+        return [name for name in os.listdir(self.root) if not name.startswith('.')]
+
+    def delete(self, key):
+        shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
+
+
+def _digest(value):
+    return hashlib.blake2b(json.dumps(value, sort_keys=True, default=str).encode('utf-8'), digest_size=16).hexdigest()
+
+
+def secret_digest(secret, session_id):
+    """
+    A slow hash of a secret salted with the session id. It is saved instead of the secret, so
+    resuming a session can check the secret is entered again by whoever started it.
+    """
+    return hashlib.pbkdf2_hmac('sha256', secret.encode('utf-8'), session_id.encode('utf-8'), 200_000).hex()
+
+
+class SessionStore:
+    """
+    Saved chat sessions, so a restarted or moved server can resume them without verifying
+    keys, uploading files or introspecting databases again.
+
+    A session is a directory with one JSON file per top-level part of its state, rewritten
+    only when that part changed, and its chat history as JSON lines, appended turn by turn.
+    Datasets are kept in the columnar cache and referenced by key. API keys and passwords are
+    never saved, they are asked for again to resume a session; the files are still readable
+    by their owner only.
+    """
+
+    def __init__(self, root=None):
+        """
+        :param root: str - Where sessions are kept (`SESSION_STORE_DIR`, or ~/.ai_multitool by default).
+        """
+        self.root = root or os.environ.get('SESSION_STORE_DIR') or os.path.join(os.path.expanduser('~'), '.ai_multitool')
+        os.makedirs(os.path.join(self.root, 'sessions'), mode=0o700, exist_ok=True)
+        self.cache = ColumnarCache(os.path.join(self.root, 'datasets'))
+        self._lock = threading.Lock()
+        self._written = {}
+
+    def _directory(self, session_id):
+        if not session_id.isalnum():
+            raise ValueError('Invalid session id.')
+        return os.path.join(self.root, 'sessions', session_id)
+
+    @staticmethod
+    def _write(path, text, mode='w'):
+        descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | (os.O_APPEND if mode == 'a' else os.O_TRUNC), 0o600)
+        with os.fdopen(descriptor, mode, encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def save(self, session_id, state, history=()):
+        """
+        Saves a session, writing only the parts of the state and the history turns that
+        changed since the last save.
+
+        :param state: dict - JSON-serializable parts of the session, by name.
+        :param history: list - JSON-serializable chat turns, oldest first.
+        :return: dict - 'parts' (names written) and 'turns' (history entries written).
+        """
+        directory = self._directory(session_id)
+        with self._lock:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+            written = self._written.setdefault(session_id, {'parts': {}, 'history': []})
+            parts = []
+            for name, value in state.items():
+                digest = _digest(value)
+                if written['parts'].get(name) != digest:
+                    path = os.path.join(directory, f'{name}.json')
+                    self._write(path + '.tmp', json.dumps(value, default=str))
+                    os.replace(path + '.tmp', path)
+                    written['parts'][name] = digest
+                    parts.append(name)
+
+            digests = [_digest(turn) for turn in history]
+            path = os.path.join(directory, 'history.jsonl')
+            if digests[:len(written['history'])] == written['history']:
+                new_turns = history[len(written['history']):]
+                if new_turns:
+                    self._write(path, ''.join(json.dumps(turn, default=str) + '\n' for turn in new_turns), mode='a')
+            else:
+                # An earlier turn changed (e.g. an estimate was refined), the history is rewritten
+                new_turns = history
+                self._write(path + '.tmp', ''.join(json.dumps(turn, default=str) + '\n' for turn in history))
+                os.replace(path + '.tmp', path)
+            written['history'] = digests
+            self._write(os.path.join(directory, 'saved_at'), str(time.time()))
+        return {'parts': parts, 'turns': len(new_turns)}
+
+    def load(self, session_id):
+        """
+        :return: dict - 'state' and 'history' of the session, or None if it was not saved.
+        """
+        try:
+            directory = self._directory(session_id)
+        except ValueError:
+            return None
+        if not os.path.isdir(directory):
+            return None
+        state = {}
+        for file_name in os.listdir(directory):
+            if file_name.endswith('.json'):
+                with open(os.path.join(directory, file_name), encoding='utf-8') as f:
+                    state[file_name[:-5]] = json.load(f)
+        history = []
+        if os.path.exists(os.path.join(directory, 'history.jsonl')):
+            with open(os.path.join(directory, 'history.jsonl'), encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        history.append(json.loads(line))
+                    except ValueError:
+                        # A turn cut short by a crash
+                        break
+        with self._lock:
+            self._written[session_id] = {
+                'parts': {name: _digest(value) for name, value in state.items()},
+                'history': [_digest(turn) for turn in history],
+            }
+        return {'state': state, 'history': history}
+
+    def delete(self, session_id):
+        with self._lock:
+            self._written.pop(session_id, None)
+            shutil.rmtree(self._directory(session_id), ignore_errors=True)
+
+    def prune(self, max_age=7 * 86400):
+        """
+        Deletes the sessions not saved for `max_age` seconds, then the datasets no session refers to.
+        """
+        sessions = os.path.join(self.root, 'sessions')
+        referenced = set()
+        for session_id in os.listdir(sessions):
+            directory = os.path.join(sessions, session_id)
+            if not session_id.isalnum() or not os.path.isdir(directory):
+                # Not a session (e.g. a file left by hand)
+                continue
+            try:
+                with open(os.path.join(directory, 'saved_at')) as f:
+                    saved_at = float(f.read())
+            except (OSError, ValueError):
+                saved_at = 0
+            if time.time() - saved_at > max_age:
+                self.delete(session_id)
+                continue
+            for file_name in os.listdir(directory):
+                if file_name.endswith('.json'):
+                    with open(os.path.join(directory, file_name), encoding='utf-8') as f:
+                        referenced.update(_dataset_keys(json.load(f)))
+        for key in set(self.cache.keys()) - referenced:
+            self.cache.delete(key)
+
+
+def _dataset_keys(value):
+    """
+    The columnar cache keys referenced anywhere in a saved part (as 'dataset' entries).
+    """
+    if isinstance(value, dict):
+        keys = {value['dataset']} if isinstance(value.get('dataset'), str) else set()
+        for item in value.values():
+            keys |= _dataset_keys(item)
+        return keys
+    if isinstance(value, list):
+        return set().union(*(_dataset_keys(item) for item in value)) if value else set()
+    return set()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_session_store():
+    """
+    Returns the process-wide session store, pruned of expired sessions when first used.
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SessionStore()
+            try:
+                _store.prune()
+            except OSError:
+                pass
+        return _store
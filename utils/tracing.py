@@ -0,0 +1,350 @@
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Span:
+    """
+    A single timed stage of a request. Spans carry free-form attributes such as
+    row counts, bytes, token usage and cache hit flags.
+    """
+
+    def __init__(self, name, trace_id, parent_id=None, attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.start_time = time.time()
+        self.duration_ms = None
+        self.status = 'ok'
+        self.error = None
+        self._start = time.perf_counter()
+
+    def set(self, **attributes):
+        """
+        Sets (overwrites) attributes on the span.
+        """
+        self.attributes.update(attributes)
+
+    def add(self, **counters):
+        """
+        Increments numeric attributes on the span.
+        """
+        for key, value in counters.items():
+            self.attributes[key] = self.attributes.get(key, 0) + (value or 0)
+
+    def end(self):
+        if self.duration_ms is None:
+            self.duration_ms = (time.perf_counter() - self._start) * 1000
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start_time': self.start_time,
+            'duration_ms': round(self.duration_ms or 0.0, 3),
+            'status': self.status,
+            'error': self.error,
+            'attributes': self.attributes,
+        }
+
+
+class Tracer:
+    """
+    Records nested spans per thread. A span opened while no other span is active starts
+    a new trace; when it closes, the whole trace is kept as `last_trace` and handed to
+    the exporters.
+    """
+
+    def __init__(self, service, exporters=None):
+        """
+        :param service: str - Name of the tool emitting the spans (e.g. 'query_quest').
+        :param exporters: list - Exporters to publish finished traces to. Defaults to the
+                          process-wide exporters returned by `get_exporters()`.
+        """
+        self.service = service
+        self.exporters = exporters
+        self.last_trace = []
+        self._local = threading.local()
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+            self._local.finished = []
+        return self._local.stack
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """
+        Context manager timing the enclosed block as a span named `name`.
+        """
+        stack = self._stack()
+        parent = stack[-1] if stack else None
+        if parent is None:
+            self._local.finished = []
+        span = Span(
+            name=name,
+            trace_id=parent.trace_id if parent else uuid.uuid4().hex,
+            parent_id=parent.span_id if parent else None,
+            attributes=attributes
+        )
+        stack.append(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.status = 'error'
+            span.error = str(e) or type(e).__name__
+            raise
+        finally:
+            span.end()
+            stack.pop()
+            self._local.finished.append(span)
+            if not stack:
+                self._finish_trace(self._local.finished)
+
+    def current_span(self):
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    def annotate(self, **attributes):
+        """
+        Sets attributes on the currently active span, if any.
+        """
+        span = self.current_span()
+        if span is not None:
+            span.set(**attributes)
+
+    def count(self, **counters):
+        """
+        Increments counters on the currently active span, if any.
+        """
+        span = self.current_span()
+        if span is not None:
+            span.add(**counters)
+
+    def _finish_trace(self, spans):
+        spans = sorted(spans, key=lambda s: s.start_time)
+        self.last_trace = spans
+        exporters = self.exporters if self.exporters is not None else get_exporters()
+        for exporter in exporters:
+            try:
+                exporter.export(self.service, spans)
+            except Exception:
+                # Exporting must never break a user request
+                continue
+
+
+def traced(name):
+    """
+    Method decorator wrapping the call in a span of the instance's `tracer`.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            tracer = getattr(self, 'tracer', None)
+            if tracer is None:
+                return method(self, *args, **kwargs)
+            with tracer.span(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class JsonLinesExporter:
+    """
+    Appends every finished span as one JSON document per line.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, service, spans):
+        lines = [json.dumps({'service': service, **span.to_dict()}, default=str) for span in spans]
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write('\n'.join(lines) + '\n')
+
+
+class PrometheusExporter:
+    """
+    Aggregates spans into Prometheus metrics and serves them in the text exposition format.
+    """
+
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+    counted_attributes = ('rows', 'bytes', 'prompt_tokens', 'completion_tokens', 'total_tokens')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._cache = {}
+        self._collectors = []
+        self._server = None
+
+    def register_collector(self, collector):
+        """
+        Registers a callable returning `{metric_name: value}` gauges rendered on every scrape.
+        """
+        self._collectors.append(collector)
+
+    def export(self, service, spans):
+        with self._lock:
+            for span in spans:
+                key = (service, span.name)
+                histogram = self._histograms.setdefault(key, {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0})
+                seconds = (span.duration_ms or 0.0) / 1000
+                for i, bound in enumerate(self.buckets):
+                    if seconds <= bound:
+                        histogram['buckets'][i] += 1
+                histogram['sum'] += seconds
+                histogram['count'] += 1
+
+                for attribute in self.counted_attributes:
+                    value = span.attributes.get(attribute)
+                    if isinstance(value, (int, float)):
+                        counter_key = (service, span.name, attribute)
+                        self._counters[counter_key] = self._counters.get(counter_key, 0) + value
+
+                if 'cache_hit' in span.attributes:
+                    cache_key = (service, span.name, 'hit' if span.attributes['cache_hit'] else 'miss')
+                    self._cache[cache_key] = self._cache.get(cache_key, 0) + 1
+
+    def render(self):
+        """
+        Returns all metrics in the Prometheus text exposition format.
+        """
+        lines = [
+            '# HELP stage_duration_seconds Duration of a traced stage.',
+            '# TYPE stage_duration_seconds histogram',
+        ]
+        with self._lock:
+            for (service, stage), histogram in sorted(self._histograms.items()):
+                labels = f'service="{service}",stage="{stage}"'
+                for bound, count in zip(self.buckets, histogram['buckets']):
+                    lines.append(f'stage_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'stage_duration_seconds_bucket{{{labels},le="+Inf"}} {histogram["count"]}')
+                lines.append(f'stage_duration_seconds_sum{{{labels}}} {histogram["sum"]:.6f}')
+                lines.append(f'stage_duration_seconds_count{{{labels}}} {histogram["count"]}')
+
+            lines.append('# HELP stage_attribute_total Summed numeric span attributes (rows, bytes, tokens).')
+            lines.append('# TYPE stage_attribute_total counter')
+            for (service, stage, attribute), value in sorted(self._counters.items()):
+                lines.append(f'stage_attribute_total{{service="{service}",stage="{stage}",attribute="{attribute}"}} {value}')
+
+            lines.append('# HELP stage_cache_total Cache lookups per stage by outcome.')
+            lines.append('# TYPE stage_cache_total counter')
+            for (service, stage, outcome), value in sorted(self._cache.items()):
+                lines.append(f'stage_cache_total{{service="{service}",stage="{stage}",outcome="{outcome}"}} {value}')
+
+        for collector in self._collectors:
+            try:
+                gauges = collector()
+            except Exception:
+                continue
+            for name, value in sorted(gauges.items()):
+                lines.append(f'# TYPE {name} gauge')
+                lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port, host='0.0.0.0'):
+        """
+        Starts a background HTTP server exposing the metrics at `/metrics`.
+        """
+        if self._server is not None:
+            return self._server
+        exporter = self
+
+        class _MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = exporter.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, int(port)), _MetricsHandler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self._server
+
+
+_exporters = None
+_exporters_lock = threading.Lock()
+
+
+def get_exporters():
+    """
+    Returns the process-wide exporters. On first use they are configured from the
+    `TRACE_JSONL_PATH` and `TRACE_PROMETHEUS_PORT` environment variables.
+    """
+    global _exporters
+    with _exporters_lock:
+        if _exporters is None:
+            _exporters = []
+            if os.environ.get('TRACE_JSONL_PATH'):
+                _exporters.append(JsonLinesExporter(os.environ['TRACE_JSONL_PATH']))
+            if os.environ.get('TRACE_PROMETHEUS_PORT'):
+                prometheus_exporter = PrometheusExporter()
+                try:
+                    prometheus_exporter.serve(os.environ['TRACE_PROMETHEUS_PORT'])
+                except OSError:
+                    # Port already bound by another process serving the same metrics
+                    pass
+                _exporters.append(prometheus_exporter)
+        return _exporters
+
+
+def register_exporter(exporter):
+    """
+    Adds an exporter to the process-wide exporters.
+    """
+    exporters = get_exporters()
+    with _exporters_lock:
+        exporters.append(exporter)
+
+
+def format_waterfall(spans, width=32):
+    """
+    Renders a finished trace as a text waterfall, one line per span.
+
+    :param spans: list - Spans of a single trace, as kept in `Tracer.last_trace`.
+    :param width: int - Number of characters used for the time axis.
+    :return: str - The rendered waterfall.
+    """
+    if not spans:
+        return 'No request traced yet.'
+    origin = min(span.start_time for span in spans)
+    total_ms = max((span.start_time - origin) * 1000 + (span.duration_ms or 0) for span in spans) or 1.0
+    depths = {}
+    for span in spans:
+        depths[span.span_id] = depths.get(span.parent_id, -1) + 1
+
+    name_width = max(len('  ' * depths[span.span_id] + span.name) for span in spans)
+    lines = []
+    for span in spans:
+        offset = int((span.start_time - origin) * 1000 / total_ms * width)
+        length = max(1, int((span.duration_ms or 0) / total_ms * width))
+        bar = (' ' * offset + '█' * length)[:width].ljust(width)
+        label = ('  ' * depths[span.span_id] + span.name).ljust(name_width)
+        details = ', '.join(
+            f'{key}={value}' for key, value in span.attributes.items()
+            if key in ('rows', 'bytes', 'total_tokens', 'cache_hit')
+        )
+        marker = ' !' if span.status == 'error' else ''
+        lines.append(f"{label} |{bar}| {span.duration_ms:8.1f} ms{marker} {details}".rstrip())
+    return '\n'.join(lines)